@@ -1,40 +1,74 @@
 import re
 import json
-import requests
-from bs4 import BeautifulSoup
 import logging
 import urllib.parse
 import os
 import io
-import subprocess
-import tempfile
-import shutil
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TCON, TRCK, TYER, COMM
-from config import USER_AGENT, SOUNDCLOUD_SEARCH_URL, SOUNDCLOUD_API_URL
+import time
+from config import SOUNDCLOUD_SEARCH_URL, SOUNDCLOUD_API_URL, MAX_PLAYLIST_TRACKS
+from utils.capabilities import mp3_encoder, supports_hls
+from utils.http_client import get_http_client
 from utils.logger import setup_logger
+from utils.progress import FfmpegProgressParser, run_with_progress
+from utils.resilience import resilient_get
+from utils.tagging import branded_title, write_tags
 
 logger = setup_logger(__name__, log_to_file=False)
 
+# Ссылки на плейлисты (sets) и лайки пользователя
+SOUNDCLOUD_COLLECTION_RE = re.compile(
+    r'https?://(?:www\.|m\.)?soundcloud\.com/[\w-]+/(?:sets/[\w-]+|likes)/?(?:\?\S*)?$'
+)
+
+# Максимальное количество идентификаторов в одном запросе /tracks?ids=
+SOUNDCLOUD_TRACKS_BATCH_SIZE = 50
+
+# Ссылки на отдельные треки: soundcloud.com/<пользователь>/<трек>
+SOUNDCLOUD_TRACK_RE = re.compile(
+    r'https?://(?:www\.|m\.)?soundcloud\.com/[\w-]+/([\w-]+)/?(?:\?\S*)?$'
+)
+
+# Разделы профиля, которые не являются треками
+SOUNDCLOUD_RESERVED_PATHS = {
+    "sets", "likes", "tracks", "albums", "reposts", "followers", "following",
+    "popular-tracks", "comments", "spotlight",
+}
+
+def is_soundcloud_collection_url(text):
+    return bool(SOUNDCLOUD_COLLECTION_RE.match(text.strip()))
+
+def is_soundcloud_track_url(text):
+    match = SOUNDCLOUD_TRACK_RE.match(text.strip())
+    return bool(match) and match.group(1) not in SOUNDCLOUD_RESERVED_PATHS
+
 class SoundCloudClient:
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": USER_AGENT})
+        self.session = get_http_client()
         self.client_id = None
 
     def search_tracks(self, query, limit=5):
+        tracks, _ = self.search_tracks_page(query, limit)
+        return tracks
+
+    def search_tracks_page(self, query, limit=5, next_href=None):
+        """
+        Ищет одну страницу треков.
+        Возвращает треки и next_href для загрузки следующей страницы (None, если страниц больше нет).
+        """
         try:
             if not self.client_id:
                 self.client_id = self._fetch_client_id()
                 if not self.client_id:
                     logger.error("Failed to fetch client ID")
-                    return []
+                    return [], None
 
-            encoded_query = urllib.parse.quote_plus(query)
-            
-            search_url = f"{SOUNDCLOUD_API_URL}/search/tracks?q={encoded_query}&client_id={self.client_id}&limit={limit}"
+            if next_href:
+                search_url = self._with_client_id(next_href)
+            else:
+                encoded_query = urllib.parse.quote_plus(query)
+                search_url = f"{SOUNDCLOUD_API_URL}/search/tracks?q={encoded_query}&client_id={self.client_id}&limit={limit}"
             
-            response = self.session.get(search_url)
+            response = resilient_get(self.session, "soundcloud_search", search_url, hedge=True)
             response.raise_for_status()
             
             data = response.json()
@@ -45,27 +79,174 @@ class SoundCloudClient:
                 if len(tracks) >= limit:
                     break
                 
-                user = track.get('user', {})
-                
-                tracks.append({
-                    "id": track.get('id'),
-                    "title": track.get('title', ''),
-                    "permalink_url": track.get('permalink_url', ''),
-                    "artwork_url": track.get('artwork_url', ''),
-                    "user": user.get('username', ''),
-                    "duration": track.get('duration', 0),
-                    "genre": track.get('genre', ''),
-                    "description": track.get('description', ''),
-                    "release_year": track.get('release_year', ''),
-                    "track_number": track.get('track_number', ''),
-                    "publisher_metadata": track.get('publisher_metadata', {}),
-                })
-            
-            return tracks
+                tracks.append(self._format_track(track))
+            
+            return tracks, data.get('next_href') if collection else None
             
         except Exception as e:
             logger.error(f"Error searching tracks: {e}")
-            return []
+            return [], None
+
+    def _format_track(self, track):
+        user = track.get('user') or {}
+        
+        return {
+            "id": track.get('id'),
+            "title": track.get('title', ''),
+            "permalink_url": track.get('permalink_url', ''),
+            "artwork_url": track.get('artwork_url', ''),
+            "user": user.get('username', ''),
+            "duration": track.get('duration', 0),
+            "genre": track.get('genre', ''),
+            "description": track.get('description', ''),
+            "release_year": track.get('release_year', ''),
+            "track_number": track.get('track_number', ''),
+            "publisher_metadata": track.get('publisher_metadata', {}),
+            "platform": "soundcloud"
+        }
+
+    def _ensure_client_id(self):
+        if not self.client_id:
+            self.client_id = self._fetch_client_id()
+        return self.client_id
+
+    def warm_up(self):
+        """Получает client_id заранее, чтобы его поиск не задерживал первый запрос"""
+        return bool(self._ensure_client_id())
+
+    def _with_client_id(self, url):
+        separator = '&' if '?' in url else '?'
+        return f"{url}{separator}client_id={self.client_id}"
+
+    def resolve_url(self, url):
+        """Разрешает ссылку soundcloud.com в объект API (трек, плейлист, пользователь)"""
+        try:
+            if not self._ensure_client_id():
+                logger.error("Failed to fetch client ID for resolve")
+                return None
+            
+            encoded_url = urllib.parse.quote(url, safe='')
+            response = resilient_get(self.session, "soundcloud_resolve", f"{SOUNDCLOUD_API_URL}/resolve?url={encoded_url}&client_id={self.client_id}", hedge=True)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error(f"Error resolving URL {url}: {e}")
+            return None
+
+    def _hydrate_tracks(self, stubs):
+        """Догружает неполные треки плейлиста пачками через /tracks?ids="""
+        missing_ids = [stub.get('id') for stub in stubs if stub.get('id') and not stub.get('title')]
+        hydrated = {}
+        
+        for i in range(0, len(missing_ids), SOUNDCLOUD_TRACKS_BATCH_SIZE):
+            batch = missing_ids[i:i + SOUNDCLOUD_TRACKS_BATCH_SIZE]
+            try:
+                ids = ','.join(str(track_id) for track_id in batch)
+                response = resilient_get(self.session, "soundcloud_tracks", f"{SOUNDCLOUD_API_URL}/tracks?ids={ids}&client_id={self.client_id}", hedge=True)
+                response.raise_for_status()
+                for track in response.json():
+                    hydrated[track.get('id')] = track
+            except Exception as e:
+                logger.error(f"Error hydrating playlist tracks: {e}")
+        
+        tracks = []
+        for stub in stubs:
+            track = stub if stub.get('title') else hydrated.get(stub.get('id'))
+            if track:
+                tracks.append(track)
+        return tracks
+
+    def _get_user_likes(self, user_id, limit):
+        tracks = []
+        next_url = f"{SOUNDCLOUD_API_URL}/users/{user_id}/track_likes?limit=50&client_id={self.client_id}"
+        
+        while next_url and len(tracks) < limit:
+            response = resilient_get(self.session, "soundcloud_likes", next_url, hedge=True)
+            response.raise_for_status()
+            data = response.json()
+            
+            for item in data.get('collection', []):
+                track = item.get('track')
+                if track:
+                    tracks.append(track)
+            
+            next_href = data.get('next_href')
+            next_url = self._with_client_id(next_href) if next_href else None
+        
+        return tracks[:limit]
+
+    def get_collection_tracks(self, collection_url, limit=MAX_PLAYLIST_TRACKS):
+        """
+        Возвращает название и треки плейлиста, альбома или лайков пользователя.
+        Каждый трек содержит полные данные API в поле raw_track.
+        """
+        try:
+            if not self._ensure_client_id():
+                logger.error("Failed to fetch client ID for collection")
+                return None, []
+            
+            url = collection_url.split('?')[0].rstrip('/')
+            
+            if url.endswith('/likes'):
+                user = self.resolve_url(url[:-len('/likes')])
+                if not user or not user.get('id'):
+                    return None, []
+                title = f"Лайки {user.get('username', '')}"
+                raw_tracks = self._get_user_likes(user['id'], limit)
+            else:
+                playlist = self.resolve_url(url)
+                if not playlist or playlist.get('kind') != 'playlist':
+                    logger.error(f"URL is not a SoundCloud playlist: {collection_url}")
+                    return None, []
+                title = playlist.get('title', '')
+                raw_tracks = self._hydrate_tracks(playlist.get('tracks', [])[:limit])
+            
+            tracks = []
+            for raw_track in raw_tracks:
+                track = self._format_track(raw_track)
+                track["raw_track"] = raw_track
+                tracks.append(track)
+            
+            logger.info(f"📀 Получено треков из коллекции \"{title}\": {len(tracks)}")
+            return title, tracks
+            
+        except Exception as e:
+            logger.error(f"Error getting collection tracks: {e}")
+            return None, []
+
+    def get_track_by_url(self, track_url):
+        """Разрешает ссылку на трек в данные трека без поиска"""
+        track = self.resolve_url(track_url.split('?')[0])
+        if not track or track.get('kind') != 'track':
+            logger.error(f"URL is not a SoundCloud track: {track_url}")
+            return None
+        
+        formatted = self._format_track(track)
+        formatted["raw_track"] = track
+        return formatted
+
+    def get_track_by_id(self, track_id):
+        """Загружает данные трека по его идентификатору"""
+        try:
+            if not self._ensure_client_id():
+                return None
+            
+            response = resilient_get(self.session, "soundcloud_tracks", f"{SOUNDCLOUD_API_URL}/tracks/{track_id}?client_id={self.client_id}", hedge=True)
+            response.raise_for_status()
+            track = response.json()
+            
+            formatted = self._format_track(track)
+            formatted["raw_track"] = track
+            return formatted
+        except Exception as e:
+            logger.error(f"Error getting track {track_id}: {e}")
+            return None
+
+    def get_stream_url_for_track(self, track_data):
+        """Получает ссылку на поток для уже загруженных данных трека без повторного resolve"""
+        if not self._ensure_client_id():
+            return None, None
+        return self._get_stream_url_from_id(track_data.get('id')), track_data
 
     def _fetch_client_id(self):
         try:
@@ -146,6 +327,8 @@ class SoundCloudClient:
             response = self.session.get(track_url)
             response.raise_for_status()
             
+            # bs4 нужен только для этого запасного пути, не тратим время на импорт при запуске
+            from bs4 import BeautifulSoup
             soup = BeautifulSoup(response.text, "html.parser")
             track_data = None
             
@@ -189,7 +372,7 @@ class SoundCloudClient:
                                                 logger.info(f"Found progressive stream URL: {stream_full_url}")
                                                 
                                                 try:
-                                                    stream_response = self.session.get(stream_full_url)
+                                                    stream_response = resilient_get(self.session, "soundcloud_stream", stream_full_url, hedge=True)
                                                     stream_response.raise_for_status()
                                                     stream_data = stream_response.json()
                                                     download_url = stream_data.get("url")
@@ -212,7 +395,7 @@ class SoundCloudClient:
     def _get_stream_url_from_id(self, track_id):
         try:
             api_url = f"{SOUNDCLOUD_API_URL}/tracks/{track_id}/stream?client_id={self.client_id}"
-            response = self.session.get(api_url, allow_redirects=False)
+            response = self.session.get(api_url, follow_redirects=False)
             
             if response.status_code == 302:
                 redirect_url = response.headers.get('Location')
@@ -220,7 +403,7 @@ class SoundCloudClient:
                 return redirect_url
             
             api_url = f"{SOUNDCLOUD_API_URL}/tracks/{track_id}?client_id={self.client_id}"
-            response = self.session.get(api_url)
+            response = resilient_get(self.session, "soundcloud_tracks", api_url, hedge=True)
             response.raise_for_status()
             
             track_data = response.json()
@@ -231,7 +414,7 @@ class SoundCloudClient:
                     stream_url = media.get("url")
                     if stream_url:
                         stream_full_url = f"{stream_url}?client_id={self.client_id}"
-                        stream_response = self.session.get(stream_full_url)
+                        stream_response = resilient_get(self.session, "soundcloud_stream", stream_full_url, hedge=True)
                         stream_response.raise_for_status()
                         stream_data = stream_response.json()
                         return stream_data.get("url")
@@ -241,7 +424,7 @@ class SoundCloudClient:
                     stream_url = media.get("url")
                     if stream_url:
                         stream_full_url = f"{stream_url}?client_id={self.client_id}"
-                        stream_response = self.session.get(stream_full_url)
+                        stream_response = resilient_get(self.session, "soundcloud_stream", stream_full_url, hedge=True)
                         stream_response.raise_for_status()
                         stream_data = stream_response.json()
                         playlist_url = stream_data.get("url")
@@ -256,10 +439,7 @@ class SoundCloudClient:
             logger.error(f"Error getting stream URL from ID: {e}")
             return None
     
-    def download_track(self, download_url, track_data, filename=None):
-        temp_output = None
-        temp_artwork = None
-        
+    def download_track(self, download_url, track_data, filename=None, encode_profile=None, progress_callback=None):
         try:
             logger.info(f"⬇️ Начинаем загрузку трека...")
             logger.debug(f"URL для скачивания: {download_url}")
@@ -274,168 +454,63 @@ class SoundCloudClient:
             if not filename:
                 filename = "track.mp3"
                 
-            if not self._check_ffmpeg_available():
-                logger.warning("FFmpeg not available, falling back to direct download")
-                self._download_file(download_url, filename)
-                try:
-                    self._add_metadata_to_file(filename, track_data)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка добавления метаданных в direct download: {e}")
-                return filename
-            
             is_hls = False
             if download_url:
                 is_hls = download_url.endswith('.m3u8') or 'playlist.m3u8' in download_url
             
+            # Возможности FFmpeg проверены один раз при запуске (utils.capabilities)
+            encoder = mp3_encoder()
+            if not encoder or (is_hls and not supports_hls()):
+                logger.warning("FFmpeg not available, falling back to direct download")
+                self._download_file(download_url, filename, progress_callback)
+                self._add_metadata_to_file(filename, track_data)
+                return filename
+            
             if is_hls:
                 logger.info("🔄 Конвертация HLS плейлиста с помощью FFmpeg...")
             else:
                 logger.info("🔄 Конвертация трека с помощью FFmpeg...")
             
-            temp_output = os.path.join(tempfile.gettempdir(), f"sc_temp_{os.urandom(4).hex()}.mp3")
-            
-            artwork_url = None
-            try:
-                if track_data:
-                    artwork_url = self._get_best_artwork_url(track_data)
-            except Exception as e:
-                logger.error(f"❌ Ошибка получения URL обложки: {e}")
-                
-            if artwork_url:
-                try:
-                    temp_artwork = os.path.join(tempfile.gettempdir(), f"sc_art_{os.urandom(4).hex()}.jpg")
-                    artwork_response = self.session.get(artwork_url)
-                    artwork_response.raise_for_status()
-                    
-                    with open(temp_artwork, 'wb') as f:
-                        f.write(artwork_response.content)
-                        
-                    logger.info(f"📁 Скачана обложка во временный файл: {os.path.basename(temp_artwork)}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка скачивания обложки: {e}")
-                    temp_artwork = None
-            
-            title = ""
-            artist = ""
-            album = "SoundCloud"
-            genre = ""
-            comment = ""
-            year = ""
-            track_num = ""
-            
-            if track_data:
-                if isinstance(track_data.get("title"), str):
-                    title = track_data.get("title", "")
-                
-                user_data = track_data.get("user", {})
-                if isinstance(user_data, dict) and isinstance(user_data.get("username"), str):
-                    artist = user_data.get("username", "")
-                    
-                publisher = track_data.get("publisher_metadata", {})
-                if isinstance(publisher, dict) and isinstance(publisher.get("album_title"), str):
-                    album = publisher.get("album_title", "SoundCloud")
-                    
-                if isinstance(track_data.get("genre"), str):
-                    genre = track_data.get("genre", "")
-                    
-                if isinstance(track_data.get("description"), str):
-                    comment = track_data.get("description", "")
-                    
-                if track_data.get("release_year"):
-                    year = str(track_data.get("release_year", ""))
-                    
-                if track_data.get("track_number"):
-                    track_num = str(track_data.get("track_number", ""))
-            
-            title = f"{title} | @hxmusic_robot" if title else "@hxmusic_robot"
-            
-            metadata = {
-                "title": title,
-                "artist": artist,
-                "album": album,
-                "genre": genre,
-                "comment": comment,
-                "year": year,
-                "track": track_num,
-            }
-            
-            command = ['ffmpeg', '-i', download_url]
-            
-            if temp_artwork:
-                command.extend(['-i', temp_artwork])
-            
-            for key, value in metadata.items():
-                if value:
-                    command.extend(['-metadata', f'{key}={value}'])
+            encode_args = encode_profile["ffmpeg_args"] if encode_profile else ['-q:a', '2']
             
+            # FFmpeg только кодирует звук: теги и обложка записываются один раз после кодирования
+            command = ['ffmpeg', '-i', download_url, '-map', '0:a', '-c:a', encoder]
+            command.extend(encode_args)
             command.extend([
-                '-c:a', 'libmp3lame',
-                '-q:a', '2',
                 '-ar', '44100',
-                '-map_metadata', '0',
-            ])
-            
-            if temp_artwork:
-                command.extend([
-                    '-map', '0:a',
-                    '-map', '1:v',
-                    '-c:v', 'mjpeg',
-                    '-disposition:v', 'attached_pic'
-                ])
-            
-            command.extend([
+                '-map_metadata', '-1',
+                '-id3v2_version', '0',
                 '-v', 'warning',
-                '-stats',
+                '-progress', 'pipe:1',
+                '-nostats',
                 '-y',
-                temp_output
+                filename
             ])
             
-            logger.info(f"🔄 Конвертация трека с помощью FFmpeg...")
-            process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            parser = FfmpegProgressParser(track_data.get("duration", 0) if track_data else 0)
+            returncode, output = run_with_progress(command, parser.feed, progress_callback)
             
-            if process.returncode != 0:
-                logger.error(f"❌ Ошибка FFmpeg: {process.stderr.decode()}")
+            if returncode != 0:
+                logger.error(f"❌ Ошибка FFmpeg: {output}")
                 logger.info("🔄 Переключаемся на прямое скачивание...")
-                self._download_file(download_url, filename)
-                try:
-                    self._add_metadata_to_file(filename, track_data)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка добавления метаданных: {e}")
+                self._download_file(download_url, filename, progress_callback)
             else:
-                shutil.copy2(temp_output, filename)
                 logger.info(f"✅ Трек успешно обработан и сохранен: {os.path.basename(filename)}")
             
+            self._add_metadata_to_file(filename, track_data)
             return filename
             
         except Exception as e:
             logger.error(f"❌ Ошибка при скачивании трека: {e}")
             try:
                 logger.info("🔄 Пробуем прямое скачивание как запасной вариант...")
-                self._download_file(download_url, filename)
-                try:
-                    self._add_metadata_to_file(filename, track_data)
-                except Exception as e2:
-                    logger.error(f"❌ Ошибка добавления метаданных: {e2}")
+                self._download_file(download_url, filename, progress_callback)
+                self._add_metadata_to_file(filename, track_data)
                 logger.info(f"✅ Трек скачан напрямую и сохранен: {os.path.basename(filename)}")
                 return filename
             except Exception as e2:
                 logger.error(f"❌ Ошибка при запасном скачивании: {e2}")
                 return None
-                
-        finally:
-            temp_files = [f for f in [temp_output, temp_artwork] if f and os.path.exists(f)]
-            if temp_files:
-                self._cleanup_temp_files(temp_files)
-                logger.debug(f"🧹 Очищено {len(temp_files)} временных файлов")
-    
-    def _check_ffmpeg_available(self):
-        try:
-            subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            logger.info("FFmpeg is available")
-            return True
-        except (subprocess.SubprocessError, FileNotFoundError):
-            logger.warning("FFmpeg not found in system path")
-            return False
     
     def _get_best_artwork_url(self, track_data):
         if not track_data:
@@ -454,43 +529,38 @@ class SoundCloudClient:
         
         return None
     
-    def _cleanup_temp_files(self, file_list):
-        if not file_list:
-            return
-            
-        for file_path in file_list:
-            if file_path and os.path.exists(file_path):
-                try:
-                    os.unlink(file_path)
-                    logger.debug(f"🧹 Удален временный файл: {os.path.basename(file_path)}")
-                except (PermissionError, OSError) as e:
-                    logger.debug(f"⚠️ Не удалось удалить файл {os.path.basename(file_path)}: {e}")
-                    try:
-                        os.chmod(file_path, 0o777)
-                        tempfile._finalizer.register(os.unlink, file_path)
-                    except Exception:
-                        pass
-    
-    def _download_file(self, url, filename):
+    def _download_file(self, url, filename, progress_callback=None):
         try:
             logger.info(f"📥 Начинаем прямую загрузку файла...")
-            response = self.session.get(url, stream=True)
-            response.raise_for_status()
+            with self.session.stream("GET", url) as response:
+                response.raise_for_status()
             
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            chunk_size = 8192
+                total_size = int(response.headers.get('content-length', 0))
+                downloaded = 0
+                chunk_size = 8192
+                started_at = time.monotonic()
             
-            logger.info(f"📦 Размер файла: {total_size / (1024 * 1024):.2f} МБ")
+                logger.info(f"📦 Размер файла: {total_size / (1024 * 1024):.2f} МБ")
             
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    f.write(chunk)
-                    downloaded += len(chunk)
+                with open(filename, 'wb') as f:
+                    for chunk in response.iter_bytes(chunk_size=chunk_size):
+                        f.write(chunk)
+                        downloaded += len(chunk)
                     
-                    if total_size > 0 and downloaded % (total_size // 10) < chunk_size:
-                        percent = int(downloaded * 100 / total_size)
-                        logger.info(f"⏳ Прогресс загрузки: {percent}% ({downloaded / (1024 * 1024):.2f} / {total_size / (1024 * 1024):.2f} МБ)")
+                        if total_size > 0 and downloaded % (total_size // 10) < chunk_size:
+                            percent = int(downloaded * 100 / total_size)
+                            logger.info(f"⏳ Прогресс загрузки: {percent}% ({downloaded / (1024 * 1024):.2f} / {total_size / (1024 * 1024):.2f} МБ)")
+                        
+                            if progress_callback:
+                                elapsed = time.monotonic() - started_at
+                                speed = downloaded / elapsed if elapsed > 0 else None
+                                progress_callback({
+                                    "stage": "download",
+                                    "percent": float(percent),
+                                    "total_bytes": total_size,
+                                    "speed": speed,
+                                    "eta": (total_size - downloaded) / speed if speed else None,
+                                })
                     
             logger.info(f"✅ Загрузка завершена: {os.path.basename(filename)}")
             return True
@@ -499,193 +569,39 @@ class SoundCloudClient:
             return False
 
     def _add_metadata_to_file(self, filename, track_data):
-        try:
-            if not track_data:
-                logger.warning("⚠️ Нет данных для добавления метаданных")
-                return
-                
-            if not os.path.exists(filename):
-                logger.error(f"❌ Файл не существует: {filename}")
-                return
-                
-            logger.info(f"🔖 Добавляем метаданные к файлу...")
-                
-            title = ""
-            if isinstance(track_data.get("title"), str):
-                title = track_data.get("title", "")
-                
-            artist = ""
-            user_data = track_data.get("user", {})
-            if isinstance(user_data, dict) and isinstance(user_data.get("username"), str):
-                artist = user_data.get("username", "")
-                
-            album = "SoundCloud"
-            publisher = track_data.get("publisher_metadata", {})
-            if isinstance(publisher, dict) and isinstance(publisher.get("album_title"), str):
-                album = publisher.get("album_title", "SoundCloud")
-                
-            genre = ""
-            if isinstance(track_data.get("genre"), str):
-                genre = track_data.get("genre", "")
-                
-            year = ""
-            if track_data.get("release_year"):
-                year = str(track_data.get("release_year", ""))
-                
-            track_number = ""
-            if track_data.get("track_number"):
-                track_number = str(track_data.get("track_number", ""))
-                
-            description = ""
-            if isinstance(track_data.get("description"), str):
-                description = track_data.get("description", "")
-            
-            title = f"{title} | @hxmusic_robot" if title else "@hxmusic_robot"
-            
-            artwork_url = None
-            try:
-                artwork_url = self._get_best_artwork_url(track_data)
-            except Exception as e:
-                logger.error(f"Error getting artwork URL for metadata: {e}")
-            
-            try:
-                audio = MP3(filename, ID3=ID3)
-                
-                try:
-                    audio.add_tags()
-                except:
-                    pass
-                
-                if title:
-                    audio.tags.add(TIT2(encoding=3, text=title))
-                if artist:
-                    audio.tags.add(TPE1(encoding=3, text=artist))
-                if album:
-                    audio.tags.add(TALB(encoding=3, text=album))
-                if genre:
-                    audio.tags.add(TCON(encoding=3, text=genre))
-                if track_number:
-                    audio.tags.add(TRCK(encoding=3, text=track_number))
-                if year:
-                    audio.tags.add(TYER(encoding=3, text=year))
-                if description:
-                    audio.tags.add(COMM(encoding=3, lang='eng', desc='Description', text=description))
-                
-                if artwork_url:
-                    try:
-                        logger.info(f"🖼️ Загружаем обложку для трека...")
-                        artwork_response = self.session.get(artwork_url)
-                        artwork_response.raise_for_status()
-                        
-                        content_type = artwork_response.headers.get('Content-Type', 'image/jpeg')
-                        
-                        audio.tags.add(APIC(
-                            encoding=3,
-                            mime=content_type,
-                            type=3,
-                            desc='Cover',
-                            data=artwork_response.content
-                        ))
-                        
-                        logger.info(f"✅ Обложка добавлена к файлу")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка добавления обложки: {e}")
-                
-                audio.save()
-                logger.info(f"✅ Метаданные успешно добавлены к файлу")
-                
-            except Exception as e:
-                logger.error(f"❌ Ошибка добавления метаданных через mutagen: {e}")
-                try:
-                    logger.info("🔄 Пробуем альтернативный метод добавления метаданных через ffmpeg...")
-                    self._add_metadata_with_ffmpeg(filename, track_data, artwork_url)
-                except Exception as e2:
-                    logger.error(f"❌ Ошибка с альтернативным методом добавления метаданных: {e2}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка добавления метаданных: {e}")
+        if not track_data:
+            logger.warning("⚠️ Нет данных для добавления метаданных")
+            return False
             
-    def _add_metadata_with_ffmpeg(self, filename, track_data, artwork_url=None):
+        if not os.path.exists(filename):
+            logger.error(f"❌ Файл не существует: {filename}")
+            return False
+        
+        title = track_data.get("title") if isinstance(track_data.get("title"), str) else ""
+        
+        artist = ""
+        user_data = track_data.get("user", {})
+        if isinstance(user_data, dict) and isinstance(user_data.get("username"), str):
+            artist = user_data.get("username", "")
+            
+        album = "SoundCloud"
+        publisher = track_data.get("publisher_metadata", {})
+        if isinstance(publisher, dict) and isinstance(publisher.get("album_title"), str):
+            album = publisher.get("album_title", "SoundCloud")
+        
+        artwork_url = None
         try:
-            if not track_data:
-                logger.warning("No track data available for adding metadata with ffmpeg")
-                return False
-                
-            if not os.path.exists(filename):
-                logger.error(f"File does not exist for ffmpeg metadata: {filename}")
-                return False
-                
-            if not self._check_ffmpeg_available():
-                logger.warning("ffmpeg not available for metadata")
-                return False
-                
-            temp_output = os.path.join(tempfile.gettempdir(), f"sc_meta_{os.urandom(4).hex()}.mp3")
-            temp_artwork = None
-            
-            title = ""
-            if isinstance(track_data.get("title"), str):
-                title = track_data.get("title", "")
-                
-            artist = ""
-            user_data = track_data.get("user", {})
-            if isinstance(user_data, dict) and isinstance(user_data.get("username"), str):
-                artist = user_data.get("username", "")
-                
-            album = "SoundCloud"
-            publisher = track_data.get("publisher_metadata", {})
-            if isinstance(publisher, dict) and isinstance(publisher.get("album_title"), str):
-                album = publisher.get("album_title", "SoundCloud")
-                
-            genre = ""
-            if isinstance(track_data.get("genre"), str):
-                genre = track_data.get("genre", "")
-                
-            description = ""
-            if isinstance(track_data.get("description"), str):
-                description = track_data.get("description", "")
-            
-            title = f"{title} | @hxmusic_robot" if title else "@hxmusic_robot"
-            
-            metadata = {
-                "title": title,
-                "artist": artist,
-                "album": album,
-                "genre": genre,
-                "comment": description
-            }
-            
-            args = ['ffmpeg', '-i', filename]
-            
-            for key, value in metadata.items():
-                if value:
-                    args.extend(['-metadata', f'{key}={value}'])
-            
-            if artwork_url:
-                try:
-                    temp_artwork = os.path.join(tempfile.gettempdir(), f"sc_art_{os.urandom(4).hex()}.jpg")
-                    artwork_response = self.session.get(artwork_url)
-                    artwork_response.raise_for_status()
-                    
-                    with open(temp_artwork, 'wb') as f:
-                        f.write(artwork_response.content)
-                    
-                    args.extend(['-i', temp_artwork, '-map', '0:a', '-map', '1:v', '-c:v', 'copy', '-disposition:v', 'attached_pic'])
-                except Exception as e:
-                    logger.error(f"Error downloading artwork for ffmpeg: {e}")
-            
-            args.extend(['-c:a', 'copy', '-y', temp_output])
-            
-            process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if process.returncode != 0:
-                logger.error(f"FFmpeg metadata error: {process.stderr.decode()}")
-                return False
-            
-            shutil.move(temp_output, filename)
-            
-            self._cleanup_temp_files([temp_artwork])
-                
-            logger.info(f"Added metadata using ffmpeg to {filename}")
-            return True
-            
+            artwork_url = self._get_best_artwork_url(track_data)
         except Exception as e:
-            logger.error(f"Error in ffmpeg metadata: {e}")
-            return False
\ No newline at end of file
+            logger.error(f"Error getting artwork URL for metadata: {e}")
+        
+        return write_tags(filename, {
+            "title": branded_title(title),
+            "artist": artist,
+            "album": album,
+            "genre": track_data.get("genre") if isinstance(track_data.get("genre"), str) else "",
+            "year": track_data.get("release_year") or "",
+            "track_number": track_data.get("track_number") or "",
+            "comment": track_data.get("description") if isinstance(track_data.get("description"), str) else "",
+            "artwork_url": artwork_url,
+        }, self.session)
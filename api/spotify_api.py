@@ -1,119 +1,287 @@
 import re
 import json
-import requests
-import base64
-import time
+import threading
 import urllib.parse
-import os
 import io
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TCON, TRCK, TYER, COMM
-from config import USER_AGENT
+from collections import OrderedDict
+from config import MAX_PLAYLIST_TRACKS
+from utils.http_client import get_http_client
 from utils.logger import setup_logger
+from utils.resilience import resilient_get
+from utils.spotify_token import get_token_manager
+from utils.tagging import write_tags
 
 logger = setup_logger(__name__, log_to_file=False)
 
-class SpotifyClient:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": USER_AGENT})
-        self.client_id = os.getenv("SPOTIFY_CLIENT_ID")
-        self.client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
-        self.access_token = None
-        self.token_expiry = 0
+# Ссылки на альбомы и плейлисты Spotify
+SPOTIFY_COLLECTION_RE = re.compile(
+    r'https?://open\.spotify\.com/(?:intl-[\w-]+/)?(album|playlist)/([A-Za-z0-9]+)'
+)
 
-    def _get_access_token(self):
-        try:
-            # Check if token is still valid
-            if self.access_token and time.time() < self.token_expiry:
-                return self.access_token
+# Ограничения пакетных эндпоинтов Spotify Web API
+SPOTIFY_TRACKS_BATCH_SIZE = 50
+SPOTIFY_ALBUMS_BATCH_SIZE = 20
 
-            if not self.client_id or not self.client_secret:
-                logger.error("Spotify credentials not configured")
-                return None
+# Сколько альбомов держать в памяти (вытесняются давно не использованные)
+ALBUM_CACHE_SIZE = 300
 
-            # Request a new token
-            auth_string = f"{self.client_id}:{self.client_secret}"
-            auth_bytes = auth_string.encode("utf-8")
-            auth_base64 = base64.b64encode(auth_bytes).decode("utf-8")
+# Ссылки на отдельные треки Spotify
+SPOTIFY_TRACK_RE = re.compile(
+    r'https?://open\.spotify\.com/(?:intl-[\w-]+/)?track/([A-Za-z0-9]+)'
+)
 
-            url = "https://accounts.spotify.com/api/token"
-            headers = {
-                "Authorization": f"Basic {auth_base64}",
-                "Content-Type": "application/x-www-form-urlencoded"
-            }
-            data = {"grant_type": "client_credentials"}
+def is_spotify_collection_url(text):
+    return bool(SPOTIFY_COLLECTION_RE.match(text.strip()))
 
-            response = self.session.post(url, headers=headers, data=data)
-            response.raise_for_status()
-            
-            json_result = response.json()
-            self.access_token = json_result["access_token"]
-            self.token_expiry = time.time() + json_result["expires_in"] - 60  # Subtract 60 seconds to be safe
-            
-            logger.info("Successfully obtained Spotify access token")
-            return self.access_token
-            
-        except Exception as e:
-            logger.error(f"Error getting Spotify access token: {e}")
-            return None
+def is_spotify_track_url(text):
+    return bool(SPOTIFY_TRACK_RE.match(text.strip()))
+
+class SpotifyClient:
+    def __init__(self):
+        self.session = get_http_client()
+        self.token_manager = get_token_manager()
+        self.album_cache = OrderedDict()
+        self.album_cache_lock = threading.Lock()
+
+    def warm_up(self):
+        """Получает токен заранее и запускает его фоновое обновление, чтобы поиск не ждал авторизации"""
+        token = self._get_access_token()
+        self.token_manager.start_refresher()
+        return bool(token)
+
+    def _get_access_token(self):
+        return self.token_manager.get_token()
+
+    def _authorized_get(self, endpoint, url, access_token):
+        """GET к Web API Spotify; токен, отклоненный с 401, сбрасывается и запрос повторяется с новым"""
+        response = resilient_get(self.session, endpoint, url, hedge=True, headers={"Authorization": f"Bearer {access_token}"})
+        if response.status_code == 401:
+            self.token_manager.invalidate(access_token)
+            access_token = self._get_access_token()
+            if access_token:
+                response = resilient_get(self.session, endpoint, url, hedge=True, headers={"Authorization": f"Bearer {access_token}"})
+        return response
 
     def search_tracks(self, query, limit=20):
+        tracks, _ = self.search_tracks_page(query, limit)
+        return tracks
+
+    def search_tracks_page(self, query, limit=20, offset=0):
+        """
+        Ищет одну страницу треков.
+        Возвращает треки и смещение следующей страницы (None, если страниц больше нет).
+        """
         try:
             access_token = self._get_access_token()
             if not access_token:
                 logger.error("Failed to get Spotify access token")
-                return []
+                return [], None
 
             encoded_query = urllib.parse.quote_plus(query)
-            url = f"https://api.spotify.com/v1/search?q={encoded_query}&type=track&limit={limit}"
+            url = f"https://api.spotify.com/v1/search?q={encoded_query}&type=track&limit={limit}&offset={offset}"
             
-            headers = {"Authorization": f"Bearer {access_token}"}
-            response = self.session.get(url, headers=headers)
+            response = self._authorized_get("spotify_search", url, access_token)
             response.raise_for_status()
             
             data = response.json()
-            tracks_data = data.get('tracks', {}).get('items', [])
+            tracks_page = data.get('tracks', {})
+            tracks_data = tracks_page.get('items', [])
             
             tracks = []
             for track in tracks_data:
-                artists = track.get('artists', [])
-                artist_names = [artist.get('name', '') for artist in artists]
-                artist_name = ', '.join(artist_names)
-                
-                album = track.get('album', {})
-                album_name = album.get('name', '')
-                
-                # Get the largest image from album
-                images = album.get('images', [])
-                artwork_url = images[0].get('url') if images else ''
-                
-                # Preview URL might be None for some tracks
-                preview_url = track.get('preview_url', '')
-                
-                track_info = {
-                    "id": track.get('id'),
-                    "title": track.get('name', ''),
-                    "permalink_url": track.get('external_urls', {}).get('spotify', ''),
-                    "artwork_url": artwork_url,
-                    "user": artist_name,
-                    "duration": track.get('duration_ms', 0),
-                    "genre": "",  # Spotify API doesn't directly provide genre in track object
-                    "description": "",
-                    "release_year": album.get('release_date', '')[:4] if album.get('release_date') else '',
-                    "track_number": track.get('track_number', ''),
-                    "album": album_name,
-                    "preview_url": preview_url,
-                    "platform": "spotify"  # Mark this as a Spotify track
-                }
-                
-                tracks.append(track_info)
+                if track:
+                    tracks.append(self._format_track(track))
             
-            return tracks
+            next_offset = offset + len(tracks_data) if tracks_page.get('next') and tracks_data else None
+            return tracks, next_offset
             
         except Exception as e:
             logger.error(f"Error searching Spotify tracks: {e}")
-            return []
+            return [], None
+
+    def _format_track(self, track, album=None):
+        artists = track.get('artists', [])
+        artist_names = [artist.get('name', '') for artist in artists]
+        artist_name = ', '.join(artist_names)
+        
+        # Треки альбома приходят без объекта album, его передаем отдельно
+        album = track.get('album') or album or {}
+        album_name = album.get('name', '')
+        
+        # Get the largest image from album
+        images = album.get('images', [])
+        artwork_url = images[0].get('url') if images else ''
+        
+        # Preview URL might be None for some tracks
+        preview_url = track.get('preview_url', '')
+        
+        return {
+            "id": track.get('id'),
+            "title": track.get('name', ''),
+            "permalink_url": track.get('external_urls', {}).get('spotify', ''),
+            "artwork_url": artwork_url,
+            "user": artist_name,
+            "duration": track.get('duration_ms', 0),
+            # Spotify doesn't provide genre in track object, only in the full album
+            "genre": (track.get('album_details', {}).get('genres') or [''])[0],
+            "description": "",
+            "release_year": album.get('release_date', '')[:4] if album.get('release_date') else '',
+            "track_number": track.get('track_number', ''),
+            "album": album_name,
+            "preview_url": preview_url,
+            "platform": "spotify"  # Mark this as a Spotify track
+        }
+
+    def _api_get(self, url):
+        access_token = self._get_access_token()
+        if not access_token:
+            raise Exception("Failed to get Spotify access token")
+        
+        response = self._authorized_get("spotify_api", url, access_token)
+        response.raise_for_status()
+        return response.json()
+
+    def get_tracks(self, track_ids):
+        """Загружает полные данные треков пачками по 50 через /v1/tracks?ids="""
+        tracks = {}
+        for i in range(0, len(track_ids), SPOTIFY_TRACKS_BATCH_SIZE):
+            batch = track_ids[i:i + SPOTIFY_TRACKS_BATCH_SIZE]
+            try:
+                data = self._api_get(f"https://api.spotify.com/v1/tracks?ids={','.join(batch)}")
+                for track in data.get('tracks', []):
+                    if track:
+                        tracks[track.get('id')] = track
+            except Exception as e:
+                logger.error(f"Error getting Spotify tracks batch: {e}")
+        return [tracks[track_id] for track_id in track_ids if track_id in tracks]
+
+    def get_albums(self, album_ids):
+        """Возвращает данные альбомов из LRU-кэша, недостающие загружает пачками по 20"""
+        albums = {}
+        with self.album_cache_lock:
+            for album_id in album_ids:
+                if album_id in self.album_cache:
+                    self.album_cache.move_to_end(album_id)
+                    albums[album_id] = self.album_cache[album_id]
+        missing_ids = list(dict.fromkeys(
+            album_id for album_id in album_ids if album_id and album_id not in albums
+        ))
+        
+        for i in range(0, len(missing_ids), SPOTIFY_ALBUMS_BATCH_SIZE):
+            batch = missing_ids[i:i + SPOTIFY_ALBUMS_BATCH_SIZE]
+            try:
+                data = self._api_get(f"https://api.spotify.com/v1/albums?ids={','.join(batch)}")
+            except Exception as e:
+                logger.error(f"Error getting Spotify albums batch: {e}")
+                continue
+            with self.album_cache_lock:
+                for album in data.get('albums', []):
+                    if album:
+                        albums[album.get('id')] = album
+                        self.album_cache[album.get('id')] = album
+                        self.album_cache.move_to_end(album.get('id'))
+                while len(self.album_cache) > ALBUM_CACHE_SIZE:
+                    self.album_cache.popitem(last=False)
+        
+        return {album_id: albums[album_id] for album_id in album_ids if album_id in albums}
+
+    def _album_details(self, album):
+        """Поля полного объекта альбома, которых нет в кратком: жанры для тегов трека"""
+        return {"genres": album.get('genres', [])}
+
+    def _get_album_tracks(self, album_id, limit):
+        album = self.get_albums([album_id]).get(album_id)
+        if not album:
+            return None, []
+        
+        page = album.get('tracks', {})
+        track_ids = [item.get('id') for item in page.get('items', []) if item.get('id')]
+        next_url = page.get('next')
+        
+        while next_url and len(track_ids) < limit:
+            page = self._api_get(next_url)
+            track_ids.extend(item.get('id') for item in page.get('items', []) if item.get('id'))
+            next_url = page.get('next')
+        
+        return album.get('name', ''), self.get_tracks(track_ids[:limit])
+
+    def _get_playlist_tracks(self, playlist_id, limit):
+        playlist = self._api_get(f"https://api.spotify.com/v1/playlists/{playlist_id}?fields=name")
+        
+        tracks = []
+        next_url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?limit=100"
+        while next_url and len(tracks) < limit:
+            page = self._api_get(next_url)
+            for item in page.get('items', []):
+                track = item.get('track')
+                # Локальные файлы и эпизоды подкастов пропускаем
+                if track and track.get('id') and track.get('type', 'track') == 'track':
+                    tracks.append(track)
+            next_url = page.get('next')
+        
+        return playlist.get('name', ''), tracks[:limit]
+
+    def get_collection_tracks(self, collection_url, limit=MAX_PLAYLIST_TRACKS):
+        """
+        Возвращает название и треки альбома или плейлиста Spotify.
+        Каждый трек содержит полные данные API с деталями альбома в поле raw_track.
+        """
+        try:
+            match = SPOTIFY_COLLECTION_RE.match(collection_url.strip())
+            if not match:
+                return None, []
+            
+            kind, collection_id = match.groups()
+            if kind == 'album':
+                title, raw_tracks = self._get_album_tracks(collection_id, limit)
+            else:
+                title, raw_tracks = self._get_playlist_tracks(collection_id, limit)
+            
+            albums = self.get_albums([track.get('album', {}).get('id') for track in raw_tracks])
+            
+            tracks = []
+            for raw_track in raw_tracks:
+                album_details = albums.get(raw_track.get('album', {}).get('id'))
+                if album_details:
+                    raw_track['album_details'] = self._album_details(album_details)
+                track = self._format_track(raw_track)
+                track["raw_track"] = raw_track
+                tracks.append(track)
+            
+            logger.info(f"📀 Получено треков из коллекции Spotify \"{title}\": {len(tracks)}")
+            return title, tracks
+            
+        except Exception as e:
+            logger.error(f"Error getting Spotify collection tracks: {e}")
+            return None, []
+
+    def get_track_by_url(self, track_url):
+        """Загружает данные трека по ссылке без поиска"""
+        match = SPOTIFY_TRACK_RE.match(track_url.strip())
+        if not match:
+            return None
+        return self.get_track_by_id(match.group(1))
+
+    def get_track_by_id(self, track_id):
+        """Загружает данные трека и его альбома по идентификатору"""
+        try:
+            raw_tracks = self.get_tracks([track_id])
+            if not raw_tracks:
+                return None
+            
+            raw_track = raw_tracks[0]
+            album_id = raw_track.get('album', {}).get('id')
+            album_details = self.get_albums([album_id]).get(album_id)
+            if album_details:
+                raw_track['album_details'] = self._album_details(album_details)
+            
+            track = self._format_track(raw_track)
+            track["raw_track"] = raw_track
+            return track
+            
+        except Exception as e:
+            logger.error(f"Error getting Spotify track {track_id}: {e}")
+            return None
 
     def get_track_download_url(self, track_url):
         """
@@ -131,9 +299,7 @@ class SpotifyClient:
                 track_id = track_id.split('?')[0]
             
             url = f"https://api.spotify.com/v1/tracks/{track_id}"
-            headers = {"Authorization": f"Bearer {access_token}"}
-            
-            response = self.session.get(url, headers=headers)
+            response = self._authorized_get("spotify_api", url, access_token)
             response.raise_for_status()
             
             track_data = response.json()
@@ -142,12 +308,9 @@ class SpotifyClient:
             # Also get more info about album for metadata
             album_id = track_data.get('album', {}).get('id')
             if album_id:
-                album_url = f"https://api.spotify.com/v1/albums/{album_id}"
-                album_response = self.session.get(album_url, headers=headers)
-                
-                if album_response.status_code == 200:
-                    album_data = album_response.json()
-                    track_data['album_details'] = album_data
+                album_data = self.get_albums([album_id]).get(album_id)
+                if album_data:
+                    track_data['album_details'] = self._album_details(album_data)
             
             return preview_url, track_data
         
@@ -175,12 +338,12 @@ class SpotifyClient:
         
         try:
             # Download the file
-            response = self.session.get(download_url, stream=True)
-            response.raise_for_status()
-            
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            with self.session.stream("GET", download_url) as response:
+                response.raise_for_status()
+                
+                with open(filename, 'wb') as f:
+                    for chunk in response.iter_bytes(chunk_size=8192):
+                        f.write(chunk)
             
             # Add metadata to the file
             self._add_metadata_to_file(filename, track_data)
@@ -192,72 +355,14 @@ class SpotifyClient:
             return False
     
     def _add_metadata_to_file(self, filename, track_data):
-        try:
-            # Download album artwork
-            artwork_url = None
-            images = track_data.get('album', {}).get('images', [])
-            if images and len(images) > 0:
-                artwork_url = images[0].get('url')
-            
-            if not artwork_url:
-                logger.warning("No artwork URL found for Spotify track")
-                return
-            
-            # Get artist and title information
-            artists = track_data.get('artists', [])
-            artist_name = artists[0].get('name', '') if artists else 'Unknown Artist'
-            title = track_data.get('name', 'Unknown Track')
-            album = track_data.get('album', {}).get('name', '')
-            
-            # Get album artwork
-            artwork_data = None
-            if artwork_url:
-                try:
-                    artwork_response = self.session.get(artwork_url)
-                    artwork_response.raise_for_status()
-                    artwork_data = artwork_response.content
-                except Exception as e:
-                    logger.error(f"Error downloading artwork: {e}")
-            
-            # Add ID3 tags
-            try:
-                audio = MP3(filename, ID3=ID3)
-                
-                # Create ID3 tag if it doesn't exist
-                try:
-                    audio.add_tags()
-                except:
-                    pass
-                
-                # Add the artwork
-                if artwork_data:
-                    audio.tags.add(
-                        APIC(
-                            encoding=3,  # UTF-8
-                            mime='image/jpeg',
-                            type=3,  # Cover image
-                            desc='Cover',
-                            data=artwork_data
-                        )
-                    )
-                
-                # Add track information
-                if title:
-                    audio.tags.add(TIT2(encoding=3, text=title))
-                if artist_name:
-                    audio.tags.add(TPE1(encoding=3, text=artist_name))
-                if album:
-                    audio.tags.add(TALB(encoding=3, text=album))
-                
-                # Add comment indicating this is only a preview from Spotify
-                audio.tags.add(COMM(encoding=3, lang='eng', desc='desc', text='Spotify preview'))
-                
-                # Save the changes
-                audio.save()
-                logger.info(f"Added metadata to file: {filename}")
-                
-            except Exception as e:
-                logger.error(f"Error adding ID3 tags: {e}")
-                
-        except Exception as e:
-            logger.error(f"Error adding metadata to file: {e}") 
\ No newline at end of file
+        album = track_data.get('album') or {}
+        images = album.get('images', [])
+        artists = track_data.get('artists', [])
+        
+        return write_tags(filename, {
+            "title": track_data.get('name', 'Unknown Track'),
+            "artist": artists[0].get('name', '') if artists else 'Unknown Artist',
+            "album": album.get('name', ''),
+            "comment": "Spotify preview",
+            "artwork_url": images[0].get('url') if images else None,
+        }, self.session)
@@ -4,19 +4,21 @@ import subprocess
 import logging
 import tempfile
 from urllib.parse import quote
-import requests
-from bs4 import BeautifulSoup
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TCON, TRCK, TYER, COMM
-from config import USER_AGENT
+from utils.capabilities import ytdlp_command
+from utils.http_client import get_http_client
 from utils.logger import setup_logger
+from utils.progress import parse_ytdlp_progress, run_with_progress
+from utils.tagging import write_tags
 
 logger = setup_logger(__name__, log_to_file=False)
 
 class YouTubeClient:
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": USER_AGENT})
+        self.session = get_http_client()
+
+    def warm_up(self):
+        """Проверяет, что yt-dlp или youtube-dl установлен"""
+        return ytdlp_command()
     
     def search_on_youtube(self, query, artist=None, title=None):
         """Search for a track on YouTube Music and return the video URL"""
@@ -87,7 +89,7 @@ class YouTubeClient:
                 
                 # Пробуем получить информацию о видео, чтобы проверить наличие ограничений
                 try:
-                    info_cmd = ["yt-dlp", "--skip-download", "--print", "title", youtube_url]
+                    info_cmd = [ytdlp_command() or "yt-dlp", "--skip-download", "--print", "title", youtube_url]
                     process = subprocess.Popen(
                         info_cmd,
                         stdout=subprocess.PIPE,
@@ -113,18 +115,18 @@ class YouTubeClient:
             logger.error(f"Ошибка при поиске на YouTube: {e}")
             return None
     
-    def download_from_youtube(self, youtube_url, output_file, metadata=None):
+    def download_from_youtube(self, youtube_url, output_file, metadata=None, audio_quality="0", progress_callback=None):
         """Download audio from YouTube using youtube-dl or yt-dlp"""
         try:
-            # Create temporary directory for the download
-            with tempfile.TemporaryDirectory() as temp_dir:
+            # Промежуточные файлы - рядом с итоговым, в каталоге задачи: перенос будет переименованием
+            output_dir = os.path.dirname(os.path.abspath(output_file))
+            with tempfile.TemporaryDirectory(dir=output_dir) as temp_dir:
                 temp_file = os.path.join(temp_dir, "audio.mp3")
                 
-                # First check if yt-dlp is available (preferred)
-                ytdlp_available = self._check_command_available("yt-dlp")
-                youtube_dl_available = self._check_command_available("youtube-dl")
+                # yt-dlp предпочтительнее, youtube-dl - запасной (проверены один раз при запуске)
+                downloader = ytdlp_command()
                 
-                if not (ytdlp_available or youtube_dl_available):
+                if not downloader:
                     logger.error("Neither yt-dlp nor youtube-dl is available on the system!")
                     return False
                 
@@ -180,14 +182,12 @@ class YouTubeClient:
                 # Перебираем все подходы
                 for approach_idx, approach in enumerate(download_approaches):
                     try:
-                        # Command for downloading (prefer yt-dlp, fallback to youtube-dl)
-                        cmd = ["yt-dlp"] if ytdlp_available else ["youtube-dl"]
+                        cmd = [downloader]
                         cmd.extend([
                             "-x", "--audio-format", "mp3",
-                            "--audio-quality", "0",      # Best quality
-                            "--embed-thumbnail",         # Embed thumbnail if available
-                            "--add-metadata",            # Add metadata from YouTube
+                            "--audio-quality", audio_quality,  # Качество из профиля кодирования
                             "--no-playlist",             # Не скачивать плейлист, только видео
+                            "--newline",                 # Прогресс построчно, для отображения пользователю
                         ])
                         
                         # Добавляем дополнительные аргументы, если они есть
@@ -207,29 +207,23 @@ class YouTubeClient:
                         logger.info(f"Команда: {' '.join(cmd)}")
                         
                         # Execute the command
-                        process = subprocess.Popen(
-                            cmd, 
-                            stdout=subprocess.PIPE, 
-                            stderr=subprocess.PIPE,
-                            text=True
-                        )
-                        stdout, stderr = process.communicate()
+                        returncode, output = run_with_progress(cmd, parse_ytdlp_progress, progress_callback)
                         
-                        if process.returncode == 0:
+                        if returncode == 0:
                             logger.info(f"✅ Успешно скачано с помощью подхода: {approach['name']}")
                             
                             # Проверяем наличие файла
                             downloaded_file = self._find_downloaded_file(temp_dir, current_temp_file)
                             if downloaded_file:
-                                # Добавляем метаданные
+                                # Теги и обложку записываем сами за один проход,
+                                # без повторной обработки файла через yt-dlp
                                 if metadata:
                                     self._add_metadata_to_file(downloaded_file, metadata)
                                 
-                                # Копируем файл в указанное место
-                                shutil.copy(downloaded_file, output_file)
+                                shutil.move(downloaded_file, output_file)
                                 return True
                         else:
-                            logger.warning(f"❌ Не удалось скачать с помощью подхода {approach['name']}: {stderr}")
+                            logger.warning(f"❌ Не удалось скачать с помощью подхода {approach['name']}: {output}")
                     
                     except Exception as e:
                         logger.warning(f"Ошибка при использовании подхода {approach['name']}: {e}")
@@ -242,122 +236,18 @@ class YouTubeClient:
             logger.error(f"Error in YouTube download process: {e}")
             return False
     
-    def _check_command_available(self, command):
-        """Check if a command is available on the system"""
-        try:
-            subprocess.run(
-                [command, "--version"], 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                check=False
-            )
-            return True
-        except FileNotFoundError:
-            return False
-    
-    def _convert_to_mp3(self, input_file, output_file):
-        """Convert audio file to MP3 using ffmpeg"""
-        try:
-            cmd = [
-                "ffmpeg",
-                "-i", input_file,
-                "-codec:a", "libmp3lame",
-                "-q:a", "0",  # Best quality
-                output_file
-            ]
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = process.communicate()
-            
-            if process.returncode != 0:
-                logger.error(f"Error converting to MP3: {stderr}")
-                raise Exception(f"FFmpeg error: {stderr}")
-            
-            return True
-        except Exception as e:
-            logger.error(f"Error in conversion process: {e}")
-            raise
-    
     def _add_metadata_to_file(self, filename, metadata):
         """Add metadata to the downloaded MP3 file"""
-        try:
-            # Extract metadata from the dictionary and ensure all values are strings
-            title = self._extract_simple_value(metadata.get('title', ''))
-            artist = self._extract_simple_value(metadata.get('artist', ''))
-            album = self._extract_simple_value(metadata.get('album', ''))
-            release_year = self._extract_simple_value(metadata.get('release_year', ''))
-            track_number = self._extract_simple_value(metadata.get('track_number', ''))
-            genre = self._extract_simple_value(metadata.get('genre', ''))
-            artwork_url = self._extract_simple_value(metadata.get('artwork_url', ''))
-            
-            logger.info(f"Processing metadata: Title={title}, Artist={artist}, Album={album}")
-            
-            # Download artwork if available
-            artwork_data = None
-            if artwork_url:
-                try:
-                    artwork_response = self.session.get(artwork_url)
-                    artwork_response.raise_for_status()
-                    artwork_data = artwork_response.content
-                except Exception as e:
-                    logger.error(f"Error downloading artwork: {e}")
-            
-            # Add ID3 tags
-            try:
-                # First try to load existing tags
-                try:
-                    audio = MP3(filename, ID3=ID3)
-                except Exception:
-                    # If there are no tags or error loading them, create new
-                    audio = MP3(filename)
-                    audio.add_tags()
-                
-                # Add the artwork
-                if artwork_data:
-                    audio.tags.add(
-                        APIC(
-                            encoding=3,  # UTF-8
-                            mime='image/jpeg',
-                            type=3,  # Cover image
-                            desc='Cover',
-                            data=artwork_data
-                        )
-                    )
-                
-                # Add track information, ensuring all values are strings
-                if title:
-                    audio.tags.add(TIT2(encoding=3, text=title))
-                if artist:
-                    audio.tags.add(TPE1(encoding=3, text=artist))
-                if album:
-                    audio.tags.add(TALB(encoding=3, text=album))
-                
-                # Add additional metadata if available
-                if genre:
-                    audio.tags.add(TCON(encoding=3, text=genre))
-                if track_number:
-                    audio.tags.add(TRCK(encoding=3, text=str(track_number)))
-                if release_year:
-                    audio.tags.add(TYER(encoding=3, text=str(release_year)))
-                
-                # Add comment 
-                audio.tags.add(COMM(encoding=3, lang='eng', desc='desc', text='Downloaded with Music Search Bot'))
-                
-                # Save the changes
-                audio.save()
-                logger.info(f"Added metadata to file: {filename}")
-                
-            except Exception as e:
-                logger.error(f"Error adding ID3 tags: {e}")
-                
-        except Exception as e:
-            logger.error(f"Error adding metadata to file: {e}")
+        return write_tags(filename, {
+            "title": self._extract_simple_value(metadata.get('title', '')),
+            "artist": self._extract_simple_value(metadata.get('artist', '')),
+            "album": self._extract_simple_value(metadata.get('album', '')),
+            "year": self._extract_simple_value(metadata.get('release_year', '')),
+            "track_number": self._extract_simple_value(metadata.get('track_number', '')),
+            "genre": self._extract_simple_value(metadata.get('genre', '')),
+            "comment": "Downloaded with Music Search Bot",
+            "artwork_url": self._extract_simple_value(metadata.get('artwork_url', '')),
+        }, self.session)
 
     def _extract_simple_value(self, value):
         """Extract a simple string value from potentially complex objects"""
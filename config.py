@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,6 +8,90 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
+# Токен Spotify общий для всех процессов и хранится между перезапусками;
+# фоновое обновление начинается за SPOTIFY_TOKEN_REFRESH_MARGIN секунд до истечения
+SPOTIFY_TOKEN_PATH = os.getenv("SPOTIFY_TOKEN_PATH", "data/spotify_token.json")
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.getenv("SPOTIFY_TOKEN_REFRESH_MARGIN", 300))
+
 SOUNDCLOUD_API_URL = "https://api-v2.soundcloud.com"
 SOUNDCLOUD_SEARCH_URL = "https://soundcloud.com/search/sounds"
-USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36" 
\ No newline at end of file
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36" 
+
+# Количество процессов для скачивания и кодирования (0 - работа в потоках основного процесса)
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", os.cpu_count() or 1))
+
+# Собственный сервер Telegram Bot API (например, http://localhost:8081).
+# В режиме --local сервер читает файлы с диска по file:// и принимает файлы до 2 ГБ
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+TELEGRAM_API_LOCAL = bool(TELEGRAM_API_URL) and os.getenv("TELEGRAM_API_LOCAL", "true").lower() in ("1", "true", "yes")
+
+# Максимальный размер файла для отправки в Telegram
+MAX_UPLOAD_SIZE = (2000 if TELEGRAM_API_LOCAL else 50) * 1024 * 1024
+
+# Максимальное время одного шага прогрева при запуске (в секундах)
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 20))
+
+# Как часто писать сводку метрик в журнал (в секундах, 0 - не писать)
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", 300))
+
+# Минимальный интервал между обновлениями сообщения с прогрессом (в секундах)
+PROGRESS_UPDATE_INTERVAL = float(os.getenv("PROGRESS_UPDATE_INTERVAL", 3))
+
+# Лимиты исходящих запросов к Telegram (сообщений в секунду)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", 3))
+
+# HTTP-клиент для запросов к платформам: таймауты (в секундах), размер пула соединений и HTTP/2
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Устойчивость запросов к платформам: предохранители эндпоинтов, повторы с задержкой и дублирование медленных запросов
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 5))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 0.3))
+
+# База данных для кэша file_id и индекса треков
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "data/cache.db")
+
+# Локальный кэш аудио: аудиоданные и ID3-теги хранятся отдельно (0 - кэш отключен)
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "data/audio")
+AUDIO_CACHE_MAX_MB = int(os.getenv("AUDIO_CACHE_MAX_MB", 2048))
+
+# Рабочий каталог загрузок: у каждой загрузки свой подкаталог, удаляемый после отправки.
+# Можно указать tmpfs (например /dev/shm/music_bot); SCRATCH_MAX_MB - лимит места под загрузки
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "music_bot"))
+SCRATCH_MAX_MB = int(os.getenv("SCRATCH_MAX_MB", 1024))
+
+# Отпечатки аудио для поиска одной и той же записи на разных платформах:
+# длина анализируемого фрагмента (в секундах) и порог совпадения бит
+FINGERPRINT_ENABLED = os.getenv("FINGERPRINT_ENABLED", "true").lower() in ("1", "true", "yes")
+FINGERPRINT_LENGTH = int(os.getenv("FINGERPRINT_LENGTH", 30))
+FINGERPRINT_SIMILARITY = float(os.getenv("FINGERPRINT_SIMILARITY", 0.85))
+
+# Подпись бота, добавляемая к названиям треков в тегах
+TITLE_BRANDING = os.getenv("TITLE_BRANDING", "@hxmusic_robot")
+
+# Максимальное количество треков, загружаемых из одного плейлиста
+MAX_PLAYLIST_TRACKS = int(os.getenv("MAX_PLAYLIST_TRACKS", 100))
+
+# Кэш результатов поиска
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1000))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 600))
+# Порог похожести запросов по триграммам (1 - только точное совпадение) и транслитерация кириллицы в ключах кэша
+SEARCH_FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", 0.8))
+SEARCH_TRANSLITERATE = os.getenv("SEARCH_TRANSLITERATE", "false").lower() in ("1", "true", "yes")
+
+# Отвечать на поиск сразу из локального индекса треков, обновляя результаты платформ в фоне
+LOCAL_FIRST_SEARCH = os.getenv("LOCAL_FIRST_SEARCH", "false").lower() in ("1", "true", "yes")
+
+# Инлайн-режим: задержка перед поиском (пока пользователь печатает) и время кэширования ответа в Telegram
+INLINE_DEBOUNCE_SECONDS = float(os.getenv("INLINE_DEBOUNCE_SECONDS", 0.4))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))
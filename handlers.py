@@ -1,11 +1,7 @@
 import os
-import logging
-import tempfile
-import time
+import asyncio
 import html
 import re
-import subprocess
-import shutil
 from aiogram import types, Router, F
 from aiogram.filters import Command, CommandObject
 from aiogram.types import FSInputFile, InputMediaAudio, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
@@ -14,10 +10,26 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
 
-from api.soundcloud_api import SoundCloudClient
-from api.spotify_api import SpotifyClient
+from api.soundcloud_api import SoundCloudClient, is_soundcloud_collection_url, is_soundcloud_track_url
+from api.spotify_api import SpotifyClient, is_spotify_collection_url, is_spotify_track_url
 from api.youtube_api import YouTubeClient
+from config import (
+    MAX_UPLOAD_SIZE, INLINE_DEBOUNCE_SECONDS, INLINE_CACHE_TIME, LOCAL_FIRST_SEARCH, TITLE_BRANDING,
+    TELEGRAM_API_LOCAL
+)
+from utils import capabilities
+from utils.audio_cache import audio_cache
+from utils.encode_profiles import ENCODE_PROFILES, predict_size, select_encode_profile
+from utils.file_id_cache import file_id_cache
+from utils.fingerprint import fingerprint_index
 from utils.logger import setup_logger
+from utils.metrics import metrics
+from utils.progress import ProgressReporter
+from utils.query_normalizer import normalize_query
+from utils.scratch import scratch_space
+from utils.search_cache import search_cache
+from utils.track_index import track_index
+from utils.workers import download_pool
 
 logger = setup_logger(__name__, log_to_file=False)
 
@@ -34,6 +46,81 @@ class SearchStates(StatesGroup):
 
 TRACKS_PER_PAGE = 5
 MAX_CAPTION_LENGTH = 1024
+INLINE_RESULTS_PER_PLATFORM = 10
+# Сколько результатов загружать с платформы за раз: текущая страница и одна про запас
+SEARCH_BATCH_SIZE = TRACKS_PER_PAGE * 2
+
+# Допустимая разница длительности (в секундах) для одинаковых треков с разных платформ
+DUPLICATE_DURATION_TOLERANCE = 3
+
+PLATFORM_LABELS = {
+    "soundcloud": "🟠 SoundCloud",
+    "spotify": "🟢 Spotify",
+    "all": "🌐 всех платформах",
+}
+
+# Префиксы параметра /start для ссылок из инлайн-режима
+DEEP_LINK_PLATFORMS = {
+    "sc": "soundcloud",
+    "sp": "spotify",
+}
+
+# Последний инлайн-запрос каждого пользователя (для отбрасывания устаревших)
+inline_query_ids = {}
+
+# Фоновые обновления результатов поиска в режиме LOCAL_FIRST_SEARCH
+background_refreshes = set()
+
+# Текущая загрузка каждого пользователя: выбор другого трека или переход по результатам ее отменяет
+user_jobs = {}
+
+CANCELLED_MESSAGE = "🚫 Загрузка отменена"
+
+def get_warm_up_steps():
+    """Подготовка при запуске, которую иначе пришлось бы ждать первому пользователю"""
+    return {
+        "soundcloud": sc_client.warm_up,
+        "spotify": spotify_client.warm_up,
+        "youtube": youtube_client.warm_up,
+        "capabilities": capabilities.warm_up,
+        "file_id_cache": file_id_cache.warm_up,
+        "track_index": track_index.warm_up,
+        "fingerprints": fingerprint_index.warm_up,
+        "audio_cache": audio_cache.warm_up,
+        "scratch": scratch_space.warm_up,
+        "download_pool": download_pool.warm_up,
+    }
+
+def cancel_user_job(user_id):
+    """Отменяет незавершенную загрузку пользователя вместе с задачей в пуле процессов"""
+    task = user_jobs.pop(user_id, None)
+    if task and not task.done():
+        task.cancel()
+        metrics.inc("deliveries_cancelled")
+        logger.info(f"🚫 Отменена предыдущая загрузка пользователя {user_id}")
+
+async def edit_cancelled(status_message):
+    try:
+        await status_message.edit_text(CANCELLED_MESSAGE)
+    except Exception:
+        pass
+
+async def run_user_job(user_id, coro):
+    """Выполняет загрузку как задачу пользователя, заменяя предыдущую"""
+    cancel_user_job(user_id)
+    task = asyncio.ensure_future(coro)
+    user_jobs[user_id] = task
+    try:
+        await asyncio.wait([task])
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        if user_jobs.get(user_id) is task:
+            del user_jobs[user_id]
+    
+    if not task.cancelled():
+        task.result()
 
 def escape_html(text):
     if not text:
@@ -41,7 +128,20 @@ def escape_html(text):
     return html.escape(str(text))
 
 @router.message(Command("start"))
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, command: CommandObject, state: FSMContext):
+    # Ссылка вида t.me/<бот>?start=sc_<id> из инлайн-режима - сразу скачиваем трек
+    if command.args:
+        platform_prefix, _, track_id = command.args.partition("_")
+        platform = DEEP_LINK_PLATFORMS.get(platform_prefix)
+        if platform and track_id:
+            await state.clear()
+            client = sc_client if platform == "soundcloud" else spotify_client
+            await run_user_job(
+                message.from_user.id,
+                deliver_track_from(message, platform, client.get_track_by_id, track_id)
+            )
+            return
+    
     # Эмодзи для оформления
     music_emoji = "🎵"
     sound_emoji = "🟠"
@@ -133,6 +233,18 @@ async def process_search_query(message: types.Message, state: FSMContext):
     if not query:
         await message.answer("Пожалуйста, введите запрос для поиска.")
         return
+    
+    collection_platform = get_collection_platform(query)
+    if collection_platform:
+        await state.clear()
+        await run_user_job(message.from_user.id, deliver_collection(message, query, collection_platform))
+        return
+    
+    track_platform = get_track_url_platform(query)
+    if track_platform:
+        await state.clear()
+        await run_user_job(message.from_user.id, deliver_track_url(message, query, track_platform))
+        return
         
     # Show search message with platform options in the same message
     search_msg = await message.answer(f"🔍 Поиск: <b>{escape_html(query)}</b>\n\nВыберите платформу:", 
@@ -146,6 +258,100 @@ async def process_search_query(message: types.Message, state: FSMContext):
     )
     await state.set_state(SearchStates.select_platform)
 
+async def search_platform(platform, query, limit, cursor=None):
+    """
+    Загружает одну страницу результатов платформы.
+    Возвращает треки и курсор следующей страницы (None, если страниц больше нет).
+    Первая страница берется из общего кэша результатов поиска.
+    """
+    if cursor is None:
+        cached = search_cache.get(platform, query, limit)
+        if cached is not None:
+            return cached
+    
+    tracks, next_cursor = [], None
+    if platform == "soundcloud":
+        tracks, next_cursor = await asyncio.to_thread(sc_client.search_tracks_page, query, limit, cursor)
+    elif platform == "spotify":
+        tracks, next_cursor = await asyncio.to_thread(spotify_client.search_tracks_page, query, limit, cursor or 0)
+    
+    if tracks and cursor is None:
+        search_cache.put(platform, query, limit, (tracks, next_cursor))
+    if tracks:
+        await asyncio.to_thread(track_index.add, tracks)
+    return tracks, next_cursor
+
+def refresh_search_in_background(platforms, query, limit):
+    """Обновляет кэш и индекс результатами платформ, не задерживая ответ пользователю"""
+    for platform in platforms:
+        task = asyncio.ensure_future(search_platform(platform, query, limit))
+        background_refreshes.add(task)
+        task.add_done_callback(background_refreshes.discard)
+
+def normalize_track_name(text):
+    """Приводит исполнителя или название к виду для сравнения треков между платформами"""
+    # Уточнения вида (Official Audio), [Remastered] на разных платформах пишут по-разному
+    text = re.sub(r"[\(\[].*?[\)\]]", " ", str(text or ""))
+    return normalize_query(text, transliterate=False)
+
+def get_track_key(track):
+    return normalize_track_name(get_track_artist(track)), normalize_track_name(track.get("title"))
+
+def merge_search_results(sc_tracks, spotify_tracks):
+    """
+    Объединяет результаты платформ, чередуя их по релевантности.
+    Дубликаты из Spotify отбрасываются: с SoundCloud трек скачивается напрямую, без YouTube.
+    """
+    sc_durations = {}
+    for track in sc_tracks:
+        sc_durations.setdefault(get_track_key(track), []).append(int(track.get("duration", 0)))
+    
+    tolerance_ms = DUPLICATE_DURATION_TOLERANCE * 1000
+    unique_spotify = [
+        track for track in spotify_tracks
+        if not any(
+            abs(duration - int(track.get("duration", 0))) <= tolerance_ms
+            for duration in sc_durations.get(get_track_key(track), [])
+        )
+    ]
+    
+    merged = []
+    for i in range(max(len(sc_tracks), len(unique_spotify))):
+        merged.extend(tracks[i] for tracks in (sc_tracks, unique_spotify) if i < len(tracks))
+    return merged
+
+async def search_tracks(platform, query, limit, cursors=None):
+    """
+    Загружает очередную порцию результатов режима поиска.
+    cursors - курсоры платформ из предыдущего вызова (None для первой страницы),
+    возвращаются треки и курсоры платформ, у которых остались результаты.
+    """
+    if cursors is None:
+        platforms = ["soundcloud", "spotify"] if platform == "all" else [platform]
+        cursors = {name: None for name in platforms}
+        
+        if LOCAL_FIRST_SEARCH:
+            local_tracks = await asyncio.to_thread(track_index.search, query, platforms, limit)
+            if len(local_tracks) >= TRACKS_PER_PAGE:
+                # Отвечаем из индекса; пустые курсоры при перелистывании
+                # догрузят первые страницы платформ, к тому времени уже из кэша
+                refresh_search_in_background(platforms, query, limit)
+                return local_tracks, cursors
+    
+    # В режиме всех платформ запросы к ним выполняются одновременно
+    names = list(cursors)
+    pages = dict(zip(names, await asyncio.gather(
+        *(search_platform(name, query, limit, cursors[name]) for name in names)
+    )))
+    next_cursors = {name: cursor for name, (_, cursor) in pages.items() if cursor is not None}
+    
+    if platform == "all":
+        tracks = merge_search_results(pages.get("soundcloud", ([], None))[0],
+                                      pages.get("spotify", ([], None))[0])
+    else:
+        tracks = pages.get(platform, ([], None))[0]
+    return tracks, next_cursors
+
 def get_platform_selection_keyboard():
     """Create platform selection keyboard with colored emoji"""
     builder = InlineKeyboardBuilder()
@@ -153,49 +359,42 @@ def get_platform_selection_keyboard():
         types.InlineKeyboardButton(text="🟠 SoundCloud", callback_data="platform_soundcloud"),
         types.InlineKeyboardButton(text="🟢 Spotify", callback_data="platform_spotify")
     )
+    builder.row(
+        types.InlineKeyboardButton(text="🌐 Все платформы", callback_data="platform_all")
+    )
     return builder.as_markup()
 
 @router.callback_query(SearchStates.select_platform, F.data.startswith("platform_"))
 async def process_platform_selection(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
+    cancel_user_job(callback_query.from_user.id)
     
     platform = callback_query.data.split("_")[1]
     data = await state.get_data()
     query = data.get("query", "")
     
     # Show loading in the same message
-    platform_name = "SoundCloud" if platform == "soundcloud" else "Spotify"
-    platform_emoji = "🟠" if platform == "soundcloud" else "🟢"
+    platform_label = PLATFORM_LABELS.get(platform, platform)
     
     await callback_query.message.edit_text(
-        f"🔍 Ищу на {platform_emoji} {platform_name}: <b>{escape_html(query)}</b>...",
+        f"🔍 Ищу на {platform_label}: <b>{escape_html(query)}</b>...",
         parse_mode="HTML"
     )
     
     # Search based on selected platform
-    tracks = []
-    if platform == "soundcloud":
-        tracks = sc_client.search_tracks(query, limit=20)
-    elif platform == "spotify":
-        tracks = spotify_client.search_tracks(query, limit=20)
+    tracks, cursors = await search_tracks(platform, query, SEARCH_BATCH_SIZE)
     
     if not tracks:
         # Show no results but keep platform selection buttons
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            types.InlineKeyboardButton(text="🟠 SoundCloud", callback_data="platform_soundcloud"),
-            types.InlineKeyboardButton(text="🟢 Spotify", callback_data="platform_spotify")
-        )
-        
         await callback_query.message.edit_text(
-            f"❌ Ничего не найдено на {platform_emoji} {platform_name} по запросу: <b>{escape_html(query)}</b>\n\n"
+            f"❌ Ничего не найдено на {platform_label} по запросу: <b>{escape_html(query)}</b>\n\n"
             f"Попробуйте поискать на другой платформе или измените запрос.",
             parse_mode="HTML",
-            reply_markup=builder.as_markup()
+            reply_markup=get_platform_selection_keyboard()
         )
         return
     
-    await state.update_data(tracks=tracks, current_page=0, platform=platform)
+    await state.update_data(tracks=tracks, cursors=cursors, current_page=0, platform=platform)
     
     # Show results in the same message
     await show_tracks_page(callback_query.message, state)
@@ -239,9 +438,13 @@ async def show_tracks_page(message: types.Message, state: FSMContext):
         safe_username = escape_html(username)
         safe_title = escape_html(title)
         
-        # Removed platform emoji from individual tracks
+        # В общем поиске отмечаем, с какой платформы трек
+        track_emoji = ""
+        if platform == "all":
+            track_emoji = "🟠 " if track.get("platform") == "soundcloud" else "🟢 "
+        
         track_list.append(
-            f"{start_idx + i + 1}. <b>{safe_username}</b> - {safe_title} ({duration_min}:{duration_sec:02d})"
+            f"{start_idx + i + 1}. {track_emoji}<b>{safe_username}</b> - {safe_title} ({duration_min}:{duration_sec:02d})"
         )
     
     builder = InlineKeyboardBuilder()
@@ -263,13 +466,15 @@ async def show_tracks_page(message: types.Message, state: FSMContext):
             callback_data="page_prev"
         ))
     
+    # Если на платформах остались результаты, общее число страниц пока неизвестно
+    has_more = bool(data.get("cursors"))
     total_pages = (total_tracks + TRACKS_PER_PAGE - 1) // TRACKS_PER_PAGE
     pagination_buttons.append(types.InlineKeyboardButton(
-        text=f"Стр. {current_page + 1}/{total_pages}",
+        text=f"Стр. {current_page + 1}/{total_pages}{'+' if has_more else ''}",
         callback_data="page_info"
     ))
     
-    if end_idx < total_tracks:
+    if end_idx < total_tracks or has_more:
         pagination_buttons.append(types.InlineKeyboardButton(
             text="Вперед ▶️",
             callback_data="page_next"
@@ -277,22 +482,18 @@ async def show_tracks_page(message: types.Message, state: FSMContext):
     
     builder.row(*pagination_buttons)
     
-    # Add button to switch directly to the alternative platform
-    alt_platform = "spotify" if platform == "soundcloud" else "soundcloud"
-    alt_platform_name = "Spotify" if alt_platform == "spotify" else "SoundCloud"
     builder.row(types.InlineKeyboardButton(
-        text=f"Поменять на {alt_platform_name}",
-        callback_data=f"direct_change_{alt_platform}"
+        text="⬇️ Скачать всю страницу",
+        callback_data="download_page"
     ))
     
+    # Add buttons to switch directly to the other platforms
+    builder.row(*get_alt_platform_buttons(platform))
+    
     query = data.get("query", "")
     safe_query = escape_html(query)
     
-    # Add platform emoji to the platform name in the header
-    platform_emoji = "🟠" if platform == "soundcloud" else "🟢"
-    platform_name = "SoundCloud" if platform == "soundcloud" else "Spotify"
-    
-    text = f"🎵 Результаты поиска на {platform_emoji} {platform_name}: <b>{safe_query}</b>\n" \
+    text = f"🎵 Результаты поиска на {PLATFORM_LABELS.get(platform, platform)}: <b>{safe_query}</b>\n" \
            f"Показаны треки {start_idx + 1}-{end_idx} из {total_tracks}\n\n" \
            f"{'\n'.join(track_list)}"
     
@@ -305,45 +506,46 @@ async def show_tracks_page(message: types.Message, state: FSMContext):
     
     await state.set_state(SearchStates.select_track)
 
+def get_alt_platform_buttons(platform):
+    """Кнопки переключения на остальные режимы поиска"""
+    buttons = []
+    for alt_platform, text in (("soundcloud", "Поменять на SoundCloud"),
+                               ("spotify", "Поменять на Spotify"),
+                               ("all", "🌐 Искать везде")):
+        if alt_platform != platform:
+            buttons.append(types.InlineKeyboardButton(
+                text=text,
+                callback_data=f"direct_change_{alt_platform}"
+            ))
+    return buttons
+
 @router.callback_query(F.data.startswith("direct_change_"))
 async def direct_change_platform(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
+    cancel_user_job(callback_query.from_user.id)
     
     new_platform = callback_query.data.split("_")[2]
     data = await state.get_data()
     query = data.get("query", "")
     
     # Show loading message
-    platform_name = "SoundCloud" if new_platform == "soundcloud" else "Spotify"
-    platform_emoji = "🟠" if new_platform == "soundcloud" else "🟢"
+    platform_label = PLATFORM_LABELS.get(new_platform, new_platform)
     
     await callback_query.message.edit_text(
-        f"🔍 Ищу на {platform_emoji} {platform_name}: <b>{escape_html(query)}</b>...",
+        f"🔍 Ищу на {platform_label}: <b>{escape_html(query)}</b>...",
         parse_mode="HTML"
     )
     
     # Search on the new platform
-    tracks = []
-    if new_platform == "soundcloud":
-        tracks = sc_client.search_tracks(query, limit=20)
-    elif new_platform == "spotify":
-        tracks = spotify_client.search_tracks(query, limit=20)
+    tracks, cursors = await search_tracks(new_platform, query, SEARCH_BATCH_SIZE)
     
     if not tracks:
         # Show platform selection buttons again
         builder = InlineKeyboardBuilder()
-        alt_platform = "spotify" if new_platform == "soundcloud" else "soundcloud"
-        alt_platform_name = "Spotify" if alt_platform == "spotify" else "SoundCloud"
-        
-        builder.row(
-            types.InlineKeyboardButton(
-                text=f"Поменять на {alt_platform_name}", 
-                callback_data=f"direct_change_{alt_platform}"
-            )
-        )
+        builder.row(*get_alt_platform_buttons(new_platform))
         
         await callback_query.message.edit_text(
-            f"❌ Ничего не найдено на {platform_emoji} {platform_name} по запросу: <b>{escape_html(query)}</b>\n\n"
+            f"❌ Ничего не найдено на {platform_label} по запросу: <b>{escape_html(query)}</b>\n\n"
             f"Попробуйте поискать на другой платформе или измените запрос.",
             parse_mode="HTML",
             reply_markup=builder.as_markup()
@@ -354,6 +556,7 @@ async def direct_change_platform(callback_query: types.CallbackQuery, state: FSM
     await state.update_data(
         platform=new_platform,
         tracks=tracks,
+        cursors=cursors,
         current_page=0
     )
     
@@ -363,6 +566,7 @@ async def direct_change_platform(callback_query: types.CallbackQuery, state: FSM
 @router.callback_query(F.data == "change_platform")
 async def change_platform(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
+    cancel_user_job(callback_query.from_user.id)
     
     data = await state.get_data()
     query = data.get("query", "")
@@ -379,6 +583,7 @@ async def change_platform(callback_query: types.CallbackQuery, state: FSMContext
 @router.callback_query(F.data == "page_prev")
 async def process_previous_page(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
+    cancel_user_job(callback_query.from_user.id)
     
     data = await state.get_data()
     current_page = data.get("current_page", 0)
@@ -388,13 +593,39 @@ async def process_previous_page(callback_query: types.CallbackQuery, state: FSMC
         
         await show_tracks_page(callback_query.message, state)
 
+async def load_more_tracks(state: FSMContext):
+    """Загружает следующую порцию результатов по сохраненным курсорам платформ"""
+    data = await state.get_data()
+    tracks = data.get("tracks", [])
+    
+    new_tracks, cursors = await search_tracks(
+        data.get("platform", "soundcloud"),
+        data.get("query", ""),
+        SEARCH_BATCH_SIZE,
+        data.get("cursors")
+    )
+    
+    known = {(track.get("platform"), track.get("id")) for track in tracks}
+    tracks = tracks + [
+        track for track in new_tracks
+        if (track.get("platform"), track.get("id")) not in known
+    ]
+    await state.update_data(tracks=tracks, cursors=cursors)
+    return tracks
+
 @router.callback_query(F.data == "page_next")
 async def process_next_page(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
+    cancel_user_job(callback_query.from_user.id)
     
     data = await state.get_data()
     current_page = data.get("current_page", 0)
     tracks = data.get("tracks", [])
+    
+    # Догружаем результаты, когда следующая страница - последняя из загруженных
+    if (current_page + 2) * TRACKS_PER_PAGE > len(tracks) and data.get("cursors"):
+        tracks = await load_more_tracks(state)
+    
     total_tracks = len(tracks)
     total_pages = (total_tracks + TRACKS_PER_PAGE - 1) // TRACKS_PER_PAGE
     
@@ -407,45 +638,74 @@ async def process_next_page(callback_query: types.CallbackQuery, state: FSMConte
 async def process_page_info(callback_query: types.CallbackQuery):
     await callback_query.answer("Информация о текущей странице")
 
-@router.callback_query(SearchStates.select_track, F.data.startswith("track_"))
-async def process_track_selection(callback_query: types.CallbackQuery, state: FSMContext):
-    await callback_query.answer()
-    
-    track_index = int(callback_query.data.split("_")[1])
-    
-    data = await state.get_data()
-    tracks = data.get("tracks", [])
-    platform = data.get("platform", "soundcloud")
-    
-    if track_index >= len(tracks):
-        await callback_query.message.answer("❌ Ошибка: Трек не найден. Пожалуйста, попробуйте снова.")
-        return
-        
-    selected_track = tracks[track_index]
-    
-    user_info = selected_track.get('user', '')
-    username = ''
-    
+AUDIO_CAPTION = "👉 <a href='https://t.me/hxmusic_robot'>Ищи свои любимые треки в боте</a> 👈"
+MEDIA_GROUP_SIZE = 10
+# Предел длины имени файла (NAME_MAX = 255 байт) с запасом
+MAX_FILENAME_BYTES = 250
+
+DOWNLOAD_ERROR_MESSAGES = {
+    "youtube_not_found": "❌ Не удалось найти трек на YouTube.\n"
+                         "Попробуйте другой трек или платформу.",
+    "no_download_url": "❌ Не удалось получить ссылку для скачивания этого трека.\n"
+                       "Пожалуйста, попробуйте другой трек или платформу.",
+}
+
+def get_track_artist(track):
+    user_info = track.get('user', '') if track else ''
     if isinstance(user_info, dict):
-        username = user_info.get('username', 'Unknown')
-    else:
-        username = str(user_info)
+        return user_info.get('username', 'Unknown')
+    return str(user_info)
+
+def get_audio_details(track_data):
+    """Возвращает имя файла, название и исполнителя для отправки в Telegram"""
+    user = track_data.get("user", "") if track_data else ""
+    title = track_data.get("title", "") if track_data else ""
     
-    track_title = selected_track.get('title', 'Untitled')
+    if isinstance(user, dict):
+        user = user.get("username", "")
     
-    safe_username = escape_html(username)
-    safe_title = escape_html(track_title)
+    user = str(user).replace('<', '').replace('>', '').replace('&', '').replace('"', '').replace("'", "")
+    title = str(title).replace('<', '').replace('>', '').replace('&', '').replace('"', '').replace("'", "")
     
-    platform_emoji = "🟠" if platform == "soundcloud" else "🟢"
-    platform_name = "SoundCloud" if platform == "soundcloud" else "Spotify"
+    if user and title:
+        clean_title = f"{user} - {title} {TITLE_BRANDING}"
+    else:
+        clean_title = f"music_track {TITLE_BRANDING}"
     
-    logger.info(f"🎵 Выбран трек: {username} - {track_title} на платформе {platform}")
+    clean_title = "".join(c for c in clean_title if c.isalnum() or c in " -_.").strip()
+    return f"{clean_title}.mp3", title, user
+
+def get_upload_file(path, filename):
+    """
+    Готовит файл к отправке. Локальному серверу Bot API передается путь file://,
+    он читает файл с диска сам, без загрузки multipart.
+    """
+    if not TELEGRAM_API_LOCAL:
+        return FSInputFile(path, filename=filename)
     
-    await callback_query.message.edit_text(
-        f"⏳ Обрабатываю трек:\n"
-        f"<b>{safe_username}</b> - {safe_title}",
-        parse_mode="HTML"
-    )
+    # Сервер берет имя отправляемого файла из пути. Имя уже очищено от спецсимволов,
+    # поэтому путь передается без URL-кодирования
+    named_path = os.path.join(os.path.dirname(path), fit_filename(filename))
+    try:
+        os.replace(path, named_path)
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось переименовать файл для отправки, имя останется прежним: {e}")
+        named_path = path
+    return f"file://{os.path.abspath(named_path)}"
+
+def fit_filename(filename, max_bytes=MAX_FILENAME_BYTES):
+    """Укорачивает имя файла до max_bytes в UTF-8, сохраняя расширение"""
+    if len(filename.encode("utf-8")) <= max_bytes:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    limit = max_bytes - len(ext.encode("utf-8"))
+    stem = stem.encode("utf-8")[:limit].decode("utf-8", errors="ignore").rstrip()
+    return f"{stem}{ext}"
+
+async def resolve_track(selected_track, platform):
+    """Получает ссылку для скачивания и полные данные трека"""
+    username = get_track_artist(selected_track)
+    track_title = selected_track.get('title', 'Untitled')
     
     track_url = selected_track.get("permalink_url")
     logger.info(f"🔗 URL трека: {track_url}")
@@ -455,18 +715,23 @@ async def process_track_selection(callback_query: types.CallbackQuery, state: FS
     track_data = None
     youtube_used = False
     
-    if platform == "soundcloud":
-        download_url, track_data = sc_client.get_track_download_url(track_url)
+    if platform == "soundcloud" and selected_track.get("raw_track"):
+        # Данные трека уже загружены вместе с плейлистом, повторный resolve не нужен
+        download_url, track_data = await asyncio.to_thread(sc_client.get_stream_url_for_track, dict(selected_track["raw_track"]))
+    elif platform == "soundcloud":
+        download_url, track_data = await asyncio.to_thread(sc_client.get_track_download_url, track_url)
     elif platform == "spotify":
-        # Try to get Spotify download URL first (for metadata)
-        download_url, track_data = spotify_client.get_track_download_url(track_url)
+        if selected_track.get("raw_track"):
+            # Данные трека и альбома уже загружены пакетно вместе с плейлистом
+            download_url, track_data = None, dict(selected_track["raw_track"])
+        else:
+            # Try to get Spotify download URL first (for metadata)
+            download_url, track_data = await asyncio.to_thread(spotify_client.get_track_download_url, track_url)
         
         # Always use YouTube for Spotify tracks
-        # Формируем более точный поисковый запрос с отдельной передачей исполнителя и названия
-        # Не обновляем сообщение, оставляем "Обрабатываю трек"
-        
         # Передаем исполнителя и название отдельно для более точного поиска
-        youtube_url = youtube_client.search_on_youtube(
+        youtube_url = await asyncio.to_thread(
+            youtube_client.search_on_youtube,
             f"{username} - {track_title}",  # Для совместимости оставляем полный запрос
             artist=username,                # Передаем исполнителя отдельно
             title=track_title               # Передаем название отдельно
@@ -478,138 +743,224 @@ async def process_track_selection(callback_query: types.CallbackQuery, state: FS
             logger.info(f"YouTube URL для Spotify трека: {youtube_url}")
         else:
             logger.error(f"Не удалось найти трек на YouTube: {f"{username} - {track_title}"}")
-            await callback_query.message.edit_text(
-                f"❌ Не удалось найти трек на YouTube.\n"
-                f"Попробуйте другой трек или платформу.",
-                parse_mode="HTML"
-            )
-            return
+            return {"error": "youtube_not_found"}
     
     if not download_url:
-        await callback_query.message.edit_text(
-            f"❌ Не удалось получить ссылку для скачивания этого трека.\n"
-            f"Пожалуйста, попробуйте другой трек или платформу.",
+        return {"error": "no_download_url"}
+    
+    merged_track_data = track_data or selected_track
+    
+    if track_data and selected_track:
+        for key, value in selected_track.items():
+            if key == "raw_track":
+                continue
+            if key not in track_data or not track_data.get(key):
+                merged_track_data[key] = value
+    
+    logger.info(f"Merged track data available: {bool(merged_track_data)}")
+    
+    return {
+        "error": None,
+        "download_url": download_url,
+        "track_data": merged_track_data,
+        "youtube_used": youtube_used,
+    }
+
+async def download_track_file(selected_track, platform, temp_dir, encode_profile, progress_callback=None):
+    """Разрешает ссылку на трек и скачивает его через пул рабочих процессов"""
+    resolved = await resolve_track(selected_track, platform)
+    if resolved["error"]:
+        return {"success": False, "path": None, "error": resolved["error"]}
+    
+    temp_filename = os.path.join(temp_dir, "audio.mp3")
+    logger.info(f"📁 Создан временный файл: {temp_filename}")
+    
+    # Скачивание и кодирование выполняются в пуле рабочих процессов
+    job = {
+        "platform": platform,
+        "download_url": resolved["download_url"],
+        "track_data": resolved["track_data"],
+        "output_file": temp_filename,
+        "youtube_used": resolved["youtube_used"],
+        "artist": get_track_artist(selected_track),
+        "title": selected_track.get('title', 'Untitled'),
+        "encode_profile": encode_profile,
+    }
+    result = await download_pool.submit(job, progress_callback=progress_callback)
+    result["track_data"] = resolved["track_data"]
+    return result
+
+def _store_file_id(platform, track, audio):
+    track_index.add([dict(track, platform=platform)])
+    file_id_cache.put(platform, track.get("id"), audio.file_id, audio.title or "", audio.performer or "")
+
+async def remember_file_id(platform, track, sent_message):
+    """Сохраняет file_id отправленного аудио для повторного использования"""
+    if not isinstance(sent_message, types.Message) or not sent_message.audio:
+        return
+    # Запись в SQLite выполняется в потоке, чтобы не задерживать обработку обновлений
+    await asyncio.to_thread(_store_file_id, platform, track, sent_message.audio)
+
+async def send_audio(message: types.Message, audio, title, performer):
+    """Заменяет статусное сообщение аудиофайлом, при неудаче отправляет новое сообщение"""
+    # Добавляем заголовок и исполнителя для корректного отображения в Telegram
+    media = InputMediaAudio(
+        media=audio,
+        caption=AUDIO_CAPTION,
+        parse_mode="HTML",
+        title=title,
+        performer=performer
+    )
+    
+    try:
+        logger.debug("Пробуем обновить сообщение с аудио")
+        sent = await message.edit_media(media=media)
+        logger.info("✅ Сообщение успешно обновлено с аудио")
+        return sent
+    except TelegramBadRequest as e:
+        error_msg = str(e).lower()
+        logger.warning(f"⚠️ Ошибка Telegram при обновлении: {error_msg}")
+        
+        logger.info("⚠️ Не удалось обновить сообщение, отправляем новое")
+        
+        try:
+            await message.delete()
+        except Exception:
+            pass
+        
+        sent = await message.answer_audio(
+            audio=audio,
+            caption=AUDIO_CAPTION,
+            parse_mode="HTML",
+            title=title,
+            performer=performer
+        )
+        logger.info("✅ Отправлено новое сообщение с аудио")
+        return sent
+
+def get_cache_keys(platform, track_id):
+    """Ключи кэшей трека: собственный и канонический, если та же запись уже скачивалась с другой платформы"""
+    keys = [(platform, str(track_id))]
+    canonical = fingerprint_index.canonical(platform, track_id)
+    if canonical and canonical != keys[0]:
+        keys.append(canonical)
+    return keys
+
+def lookup_file_id(platform, track_id):
+    """Сохраненный file_id трека с учетом канонического ключа; блокирующий, вызывать в потоке"""
+    for key in get_cache_keys(platform, track_id):
+        cached = file_id_cache.get(*key)
+        if cached:
+            return key, cached
+    return None, None
+
+async def get_cached_file_id(platform, track_id):
+    return await asyncio.to_thread(lookup_file_id, platform, track_id)
+
+async def get_cached_audio(platform, track_id, filename):
+    for key in await asyncio.to_thread(get_cache_keys, platform, track_id):
+        audio = await asyncio.to_thread(audio_cache.get, *key, filename)
+        if audio:
+            return audio
+    return None
+
+async def cache_downloaded_audio(platform, track_id, result):
+    """
+    Сохраняет отпечаток скачанного трека и кладет файл в кэш аудио под каноническим ключом,
+    чтобы одинаковые записи с разных платформ хранились один раз
+    """
+    canonical = await asyncio.to_thread(fingerprint_index.register, platform, track_id, result.get("fingerprint"))
+    cache_key = canonical or (platform, str(track_id))
+    if cache_key == (platform, str(track_id)) or not audio_cache.contains(*cache_key):
+        await asyncio.to_thread(audio_cache.store, *cache_key, result["path"])
+
+async def send_cached_track(message: types.Message, selected_track, platform):
+    """Отправляет трек по сохраненному file_id, если он есть"""
+    key, cached = await get_cached_file_id(platform, selected_track.get("id"))
+    if not cached:
+        return False
+    
+    try:
+        await send_audio(message, cached["file_id"], cached["title"], cached["performer"])
+        logger.info("♻️ Трек отправлен из кэша file_id")
+        return True
+    except TelegramBadRequest as e:
+        logger.warning(f"⚠️ Сохраненный file_id недействителен, скачиваем заново: {e}")
+        await asyncio.to_thread(file_id_cache.delete, *key)
+        return False
+
+async def send_from_audio_cache(message: types.Message, selected_track, platform):
+    """Отправляет трек из локального кэша аудио без повторного скачивания"""
+    filename, title, user = get_audio_details(selected_track)
+    audio = await get_cached_audio(platform, selected_track.get("id"), filename)
+    if not audio:
+        return False
+    
+    try:
+        sent = await send_audio(message, audio, title, user)
+        await remember_file_id(platform, selected_track, sent)
+        logger.info("♻️ Трек отправлен из локального кэша аудио")
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось отправить трек из кэша аудио: {e}")
+        return False
+
+async def deliver_track(message: types.Message, selected_track, platform):
+    """Скачивает выбранный трек и отправляет его вместо статусного сообщения"""
+    username = get_track_artist(selected_track)
+    track_title = selected_track.get('title', 'Untitled')
+    
+    safe_username = escape_html(username)
+    safe_title = escape_html(track_title)
+    
+    logger.info(f"🎵 Выбран трек: {username} - {track_title} на платформе {platform}")
+    
+    if await send_cached_track(message, selected_track, platform):
+        return
+    
+    if await send_from_audio_cache(message, selected_track, platform):
+        return
+    
+    # Выбираем профиль кодирования заранее, чтобы не качать треки, которые не поместятся в лимит
+    encode_profile = select_encode_profile(selected_track.get("duration", 0), platform)
+    if not encode_profile:
+        await message.edit_text(
+            f"❌ Трек слишком длинный для отправки в Telegram:\n"
+            f"<b>{safe_username}</b> - {safe_title}\n\n"
+            f"Максимальный размер файла: {MAX_UPLOAD_SIZE / (1024 * 1024):.2f} МБ",
             parse_mode="HTML"
         )
         return
     
-    # создаем временный каталог для работы с файлами
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_filename = None
-        
+    status_header = f"⏳ Обрабатываю трек:\n<b>{safe_username}</b> - {safe_title}"
+    await message.edit_text(status_header, parse_mode="HTML")
+    
+    # Каталог загрузки в рабочем месте бота; место под файл резервируется по прогнозу размера
+    async with scratch_space.job(predict_size(selected_track.get("duration", 0), encode_profile)) as temp_dir:
         try:
-            temp_filename = os.path.join(temp_dir, "audio.mp3")
-            
-            logger.info(f"📁 Создан временный файл: {temp_filename}")
-            
-            merged_track_data = track_data or selected_track
+            progress = ProgressReporter(message, status_header)
+            result = await download_track_file(selected_track, platform, temp_dir, encode_profile, progress)
+            await progress.close()
             
-            if track_data and selected_track:
-                for key, value in selected_track.items():
-                    if key not in track_data or not track_data.get(key):
-                        merged_track_data[key] = value
-                        
-            logger.info(f"Merged track data available: {bool(merged_track_data)}")
-            
-            # Download track based on platform
-            download_success = False
-            processed_with_ffmpeg = False
-            
-            if platform == "soundcloud":
-                download_success = sc_client.download_track(download_url, merged_track_data, temp_filename)
-            elif platform == "spotify" and youtube_used:
-                try:
-                    # Подготовка расширенных метаданных из Spotify
-                    # Получаем данные из Spotify API для альбома
-                    album_name = ""
-                    artwork_url = ""
-                    release_year = ""
-                    
-                    # Обработка метаданных альбома
-                    album_data = merged_track_data.get('album', {})
-                    if isinstance(album_data, dict):
-                        album_name = album_data.get('name', '')
-                        
-                        # Получаем обложку альбома
-                        images = album_data.get('images', [])
-                        if images and len(images) > 0 and isinstance(images[0], dict):
-                            artwork_url = images[0].get('url', '')
-                        
-                        # Получаем год выпуска
-                        release_date = album_data.get('release_date', '')
-                        if release_date and isinstance(release_date, str):
-                            # Берем только год из даты (первые 4 символа)
-                            release_year = release_date[:4] if len(release_date) >= 4 else ''
-                    
-                    # Формируем упрощенные метаданные для передачи
-                    metadata = {
-                        'title': track_title,
-                        'artist': username,
-                        'album': album_name,
-                        'artwork_url': artwork_url,
-                        'release_year': release_year,
-                        'track_number': merged_track_data.get('track_number', ''),
-                        'genre': '' # Spotify API не предоставляет напрямую жанр
-                    }
-                    
-                    logger.info(f"Подготовлены метаданные: Название={metadata['title']}, Исполнитель={metadata['artist']}, Альбом={metadata['album']}")
-                    
-                    # Скачиваем сначала во временный файл
-                    temp_yt_file = os.path.join(temp_dir, "youtube_audio.mp3")
-                    download_success = youtube_client.download_from_youtube(download_url, temp_yt_file, metadata)
-                    
-                    if download_success:
-                        # Обрабатываем через ffmpeg для обеспечения совместимости и улучшения качества
-                        processed_with_ffmpeg = process_with_ffmpeg(temp_yt_file, temp_filename, metadata)
-                        if processed_with_ffmpeg:
-                            logger.info(f"✅ Трек успешно обработан через FFmpeg")
-                        else:
-                            # Если ffmpeg обработка не удалась, используем исходный файл
-                            shutil.copy(temp_yt_file, temp_filename)
-                            logger.warning(f"⚠️ Обработка через FFmpeg не удалась, используем исходный файл")
-                except Exception as e:
-                    logger.error(f"Ошибка при подготовке метаданных: {e}")
-                    # Попытка загрузки с минимальными метаданными если возникла ошибка
-                    simple_metadata = {
-                        'title': track_title,
-                        'artist': username
-                    }
-                    download_success = youtube_client.download_from_youtube(download_url, temp_filename, simple_metadata)
-            elif platform == "spotify":
-                download_success = spotify_client.download_track(download_url, merged_track_data, temp_filename)
-            
-            if not download_success:
-                await callback_query.message.edit_text(
-                    f"❌ Не удалось скачать трек. Пожалуйста, попробуйте другой трек.",
+            if not result.get("success"):
+                await message.edit_text(
+                    DOWNLOAD_ERROR_MESSAGES.get(
+                        result.get("error"),
+                        "❌ Не удалось скачать трек. Пожалуйста, попробуйте другой трек."
+                    ),
                     parse_mode="HTML"
                 )
                 return
             
-            user = merged_track_data.get("user", "") if merged_track_data else ""
-            title = merged_track_data.get("title", "") if merged_track_data else ""
-            
-            if isinstance(user, dict):
-                user = user.get("username", "")
-            
-            user = str(user).replace('<', '').replace('>', '').replace('&', '').replace('"', '').replace("'", "")
-            title = str(title).replace('<', '').replace('>', '').replace('&', '').replace('"', '').replace("'", "")
-            
-            if user and title:
-                clean_title = f"{user} - {title} @hxmusic_robot"
-            else:
-                clean_title = "music_track @hxmusic_robot"
-            
-            clean_title = "".join(c for c in clean_title if c.isalnum() or c in " -_.")
-            logger.info(f"📋 Подготовлено имя файла: {clean_title}.mp3")
-            
-            # Create caption with link to the bot (removed platform information)
-            caption = "👉 <a href='https://t.me/hxmusic_robot'>Ищи свои любимые треки в боте</a> 👈"
+            temp_filename = result["path"]
+            filename, title, user = get_audio_details(result["track_data"])
+            logger.info(f"📋 Подготовлено имя файла: {filename}")
             
             file_size = os.path.getsize(temp_filename)
-            max_telegram_size = 50 * 1024 * 1024
+            max_telegram_size = MAX_UPLOAD_SIZE
             
             if file_size > max_telegram_size:
-                await callback_query.message.edit_text(
+                await message.edit_text(
                     f"❌ Файл слишком большой для отправки в Telegram ({file_size / (1024 * 1024):.2f} МБ).\n"
                     f"Максимальный размер файла: {max_telegram_size / (1024 * 1024):.2f} МБ",
                     parse_mode="HTML"
@@ -617,43 +968,17 @@ async def process_track_selection(callback_query: types.CallbackQuery, state: FS
                 return
             
             logger.info(f"📊 Размер файла: {file_size / (1024 * 1024):.2f} МБ")
+            await cache_downloaded_audio(platform, selected_track.get("id"), result)
+            
+            # Та же запись уже отправлялась с другой платформы - загружать файл заново не нужно
+            if await send_cached_track(message, selected_track, platform):
+                return
             
+            audio = get_upload_file(temp_filename, filename)
             try:
-                audio = FSInputFile(temp_filename, filename=f"{clean_title}.mp3")
-                logger.info(f"📤 Отправляем аудиофайл пользователю...")
-                
-                # Добавляем заголовок и исполнителя для корректного отображения в Telegram
-                media = InputMediaAudio(
-                    media=audio,
-                    caption=caption,
-                    parse_mode="HTML",
-                    title=title,
-                    performer=user
-                )
-                
-                try:
-                    logger.debug(f"Пробуем обновить сообщение с аудио")
-                    await callback_query.message.edit_media(media=media)
-                    logger.info(f"✅ Сообщение успешно обновлено с аудио")
-                except TelegramBadRequest as e:
-                    error_msg = str(e).lower()
-                    logger.warning(f"⚠️ Ошибка Telegram при обновлении: {error_msg}")
-                    
-                    logger.info(f"⚠️ Не удалось обновить сообщение, отправляем новое")
-                    
-                    try:
-                        await callback_query.message.delete()
-                    except Exception:
-                        pass
-                    
-                    await callback_query.message.answer_audio(
-                        audio=audio,
-                        caption=caption,
-                        parse_mode="HTML",
-                        title=title,
-                        performer=user
-                    )
-                    logger.info(f"✅ Отправлено новое сообщение с аудио")
+                logger.info("📤 Отправляем аудиофайл пользователю...")
+                sent = await send_audio(message, audio, title, user)
+                await remember_file_id(platform, selected_track, sent)
                     
             except Exception as e:
                 error_text = str(e).lower()
@@ -662,92 +987,382 @@ async def process_track_selection(callback_query: types.CallbackQuery, state: FS
                 if "too large" in error_text or "entity too large" in error_text:
                     logger.error(f"❌ Файл слишком большой для отправки: {error_text}")
                     try:
-                        await callback_query.message.delete()
+                        await message.delete()
                     except Exception:
                         pass
                     
-                    await callback_query.message.answer(
+                    await message.answer(
                         f"❌ Файл слишком большой для отправки в Telegram.\n"
                         f"Ошибка: {error_text}",
                         parse_mode="HTML"
                     )
                 else:
-                    logger.info(f"⚠️ Используем запасной метод отправки")
+                    logger.info("⚠️ Используем запасной метод отправки")
                     
                     try:
-                        await callback_query.message.answer_audio(
+                        sent = await message.answer_audio(
                             audio=audio,
-                            caption=caption,
+                            caption=AUDIO_CAPTION,
                             parse_mode="HTML",
                             title=title,
                             performer=user
                         )
-                        logger.info(f"✅ Успешно отправлено с использованием запасного метода")
+                        await remember_file_id(platform, selected_track, sent)
+                        logger.info("✅ Успешно отправлено с использованием запасного метода")
                     except Exception as e2:
                         logger.error(f"❌ Финальная ошибка при отправке аудио: {e2}")
-                        await callback_query.message.answer(f"❌ Не удалось отправить файл: {e2}")
+                        await message.answer(f"❌ Не удалось отправить файл: {e2}")
                 
+        except asyncio.CancelledError:
+            await progress.close()
+            try:
+                await message.edit_text(CANCELLED_MESSAGE)
+            except Exception:
+                pass
+            raise
         except Exception as e:
             logger.error(f"❌ Ошибка при обработке трека: {e}")
-            await callback_query.message.edit_text(f"❌ Произошла ошибка при обработке трека: {e}")
+            await message.edit_text(f"❌ Произошла ошибка при обработке трека: {e}")
         
     # Temporary directory will be automatically cleaned up after this block
 
-def process_with_ffmpeg(input_file, output_file, metadata):
-    """Обработка аудиофайла через FFmpeg с добавлением метаданных"""
+async def prepare_batch_item(index, track, platform, temp_dir):
+    """Готовит один трек пакета: file_id из кэша или скачанный файл"""
+    _, cached = await get_cached_file_id(platform, track.get("id"))
+    if cached:
+        return {"index": index, "track": track, "platform": platform, "file_id": cached["file_id"],
+                "title": cached["title"], "performer": cached["performer"]}
+    
+    filename, title, user = get_audio_details(track)
+    audio = await get_cached_audio(platform, track.get("id"), filename)
+    if audio:
+        return {"index": index, "track": track, "platform": platform, "audio": audio,
+                "title": title, "performer": user}
+    
+    encode_profile = select_encode_profile(track.get("duration", 0), platform)
+    if not encode_profile:
+        return None
+    
+    track_dir = os.path.join(temp_dir, str(index))
+    os.makedirs(track_dir, exist_ok=True)
+    
     try:
-        if not os.path.exists(input_file):
-            logger.error(f"Входной файл не найден: {input_file}")
-            return False
+        result = await download_track_file(dict(track), platform, track_dir, encode_profile)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при скачивании трека пакета: {e}")
+        return None
+    
+    if not result.get("success") or os.path.getsize(result["path"]) > MAX_UPLOAD_SIZE:
+        return None
+    
+    await cache_downloaded_audio(platform, track.get("id"), result)
+    _, cached = await get_cached_file_id(platform, track.get("id"))
+    if cached:
+        return {"index": index, "track": track, "platform": platform, "file_id": cached["file_id"],
+                "title": cached["title"], "performer": cached["performer"]}
+    
+    filename, title, user = get_audio_details(result["track_data"])
+    return {"index": index, "track": track, "platform": platform, "path": result["path"],
+            "filename": filename, "title": title, "performer": user}
+
+async def send_batch_items(message: types.Message, items):
+    """Отправляет готовые треки одной медиагруппой"""
+    media = []
+    for i, item in enumerate(items):
+        audio = item.get("file_id") or item.get("audio") or get_upload_file(item["path"], item["filename"])
+        # Подпись у медиагруппы показывается под последним треком
+        is_last = i == len(items) - 1
+        media.append(InputMediaAudio(
+            media=audio,
+            caption=AUDIO_CAPTION if is_last else None,
+            parse_mode="HTML" if is_last else None,
+            title=item["title"],
+            performer=item["performer"]
+        ))
+    
+    if len(media) == 1:
+        sent_messages = [await message.answer_audio(
+            audio=media[0].media,
+            caption=AUDIO_CAPTION,
+            parse_mode="HTML",
+            title=media[0].title,
+            performer=media[0].performer
+        )]
+    else:
+        sent_messages = await message.answer_media_group(media=media)
+    
+    for item, sent in zip(items, sent_messages):
+        if not item.get("file_id"):
+            await remember_file_id(item["platform"], item["track"], sent)
+
+async def deliver_track_batch(message: types.Message, tracks, platform):
+    """Скачивает несколько треков параллельно и отправляет их медиагруппами"""
+    status_message = await message.answer(
+        f"⏳ Скачиваю треков: {len(tracks)}...",
+        parse_mode="HTML"
+    )
+    
+    # Ограничиваем число одновременно обрабатываемых треков, чтобы ссылки на потоки
+    # не успевали устареть в очереди и не перегружать API платформ
+    semaphore = asyncio.Semaphore(max(download_pool.workers, 1) * 2)
+    
+    async def prepare_limited(index, track, chunk_dir):
+        async with semaphore:
+            return await prepare_batch_item(index, track, track.get("platform", platform), chunk_dir)
+    
+    sent_count = 0
+    
+    async def process_chunk(chunk_start, previous):
+        """
+        Скачивает одну медиагруппу в свой каталог и отправляет ее после предыдущей.
+        Место резервируется и освобождается на каждую группу, а не на весь пакет.
+        """
+        nonlocal sent_count
+        chunk_tracks = tracks[chunk_start:chunk_start + MEDIA_GROUP_SIZE]
+        reserve_bytes = sum(predict_size(track.get("duration", 0), ENCODE_PROFILES[0]) for track in chunk_tracks)
+        async with scratch_space.job(reserve_bytes) as chunk_dir:
+            chunk = await asyncio.gather(*[
+                prepare_limited(chunk_start + i, track, chunk_dir)
+                for i, track in enumerate(chunk_tracks)
+            ])
+            # Группы отправляются по порядку
+            if previous:
+                await previous
+            items = [item for item in chunk if item]
+            if not items:
+                return
             
-        # Базовые параметры FFmpeg
-        cmd = [
-            "ffmpeg",
-            "-i", input_file,
-            "-codec:a", "libmp3lame",
-            "-q:a", "0",       # Лучшее качество MP3
-            "-map_metadata", "0",  # Сохранить исходные метаданные
-        ]
-        
-        # Добавляем метаданные если они доступны
-        if metadata:
-            if metadata.get('title'):
-                cmd.extend(["-metadata", f"title={metadata['title']}"])
-            if metadata.get('artist'):
-                cmd.extend(["-metadata", f"artist={metadata['artist']}"])
-            if metadata.get('album'):
-                cmd.extend(["-metadata", f"album={metadata['album']}"])
-            if metadata.get('release_year'):
-                cmd.extend(["-metadata", f"date={metadata['release_year']}"])
-            if metadata.get('track_number'):
-                cmd.extend(["-metadata", f"track={metadata['track_number']}"])
-            if metadata.get('genre'):
-                cmd.extend(["-metadata", f"genre={metadata['genre']}"])
-        
-        # Добавляем выходной файл
-        cmd.append(output_file)
-        
-        logger.info(f"Запуск FFmpeg: {' '.join(cmd)}")
-        
-        # Запускаем FFmpeg
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
+            try:
+                await send_batch_items(message, items)
+                sent_count += len(items)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при отправке медиагруппы: {e}")
+
+        # Если группа не отправилась, текст не меняется и Telegram отвечает "message is not modified"
+        try:
+            await status_message.edit_text(
+                f"⏳ Отправлено треков: {sent_count} из {len(tracks)}...",
+                parse_mode="HTML"
+            )
+        except TelegramBadRequest as e:
+            logger.debug(f"Статус пакета не обновлен: {e}")
+    
+    # Следующая группа скачивается, пока отправляется текущая; дальше вперед пакет не забегает
+    previous = current = None
+    try:
+        for chunk_start in range(0, len(tracks), MEDIA_GROUP_SIZE):
+            current = asyncio.ensure_future(process_chunk(chunk_start, previous))
+            if previous:
+                await previous
+            previous = current
+        if current:
+            await current
+    except asyncio.CancelledError:
+        try:
+            await status_message.edit_text(f"{CANCELLED_MESSAGE}. Отправлено треков: {sent_count} из {len(tracks)}")
+        except Exception:
+            pass
+        raise
+    finally:
+        for task in (previous, current):
+            if task:
+                task.cancel()
+    
+    failed_count = len(tracks) - sent_count
+    if failed_count:
+        await status_message.edit_text(
+            f"✅ Отправлено треков: {sent_count} из {len(tracks)}\n"
+            f"❌ Не удалось скачать: {failed_count}",
+            parse_mode="HTML"
         )
+    else:
+        try:
+            await status_message.delete()
+        except Exception:
+            pass
+
+def get_collection_platform(text):
+    """Определяет платформу по ссылке на плейлист, альбом или лайки"""
+    if is_soundcloud_collection_url(text):
+        return "soundcloud"
+    if is_spotify_collection_url(text):
+        return "spotify"
+    return None
+
+def get_track_url_platform(text):
+    """Определяет платформу по ссылке на отдельный трек"""
+    if is_soundcloud_track_url(text):
+        return "soundcloud"
+    if is_spotify_track_url(text):
+        return "spotify"
+    return None
+
+async def deliver_track_url(message: types.Message, url, platform):
+    """Скачивает трек по присланной ссылке, минуя поиск и выбор платформы"""
+    client = sc_client if platform == "soundcloud" else spotify_client
+    await deliver_track_from(message, platform, client.get_track_by_url, url)
+
+async def deliver_track_from(message: types.Message, platform, load_track, *args):
+    """Загружает данные трека переданной функцией и сразу запускает скачивание"""
+    status_message = await message.answer("⏳ Обрабатываю трек...", parse_mode="HTML")
+    
+    try:
+        track = await asyncio.to_thread(load_track, *args)
+    except asyncio.CancelledError:
+        await edit_cancelled(status_message)
+        raise
+    
+    if not track:
+        await status_message.edit_text(
+            "❌ Не удалось найти трек. Проверьте ссылку и попробуйте снова.",
+            parse_mode="HTML"
+        )
+        return
+    
+    await deliver_track(status_message, track, platform)
+
+async def deliver_collection(message: types.Message, url, platform):
+    """Загружает все треки плейлиста, альбома или лайков"""
+    platform_emoji = "🟠" if platform == "soundcloud" else "🟢"
+    platform_name = "SoundCloud" if platform == "soundcloud" else "Spotify"
+    status_message = await message.answer(f"🔍 Загружаю плейлист {platform_emoji} {platform_name}...", parse_mode="HTML")
+    
+    client = sc_client if platform == "soundcloud" else spotify_client
+    try:
+        title, tracks = await asyncio.to_thread(client.get_collection_tracks, url)
+    except asyncio.CancelledError:
+        await edit_cancelled(status_message)
+        raise
+    
+    if not tracks:
+        await status_message.edit_text(
+            "❌ Не удалось загрузить плейлист. Проверьте ссылку и попробуйте снова.",
+            parse_mode="HTML"
+        )
+        return
+    
+    await status_message.edit_text(
+        f"📀 <b>{escape_html(title)}</b>\n"
+        f"Треков: {len(tracks)}",
+        parse_mode="HTML"
+    )
+    
+    await deliver_track_batch(message, tracks, platform)
+
+@router.callback_query(SearchStates.select_track, F.data.startswith("track_"))
+async def process_track_selection(callback_query: types.CallbackQuery, state: FSMContext):
+    await callback_query.answer()
+    
+    track_index = int(callback_query.data.split("_")[1])
+    
+    data = await state.get_data()
+    tracks = data.get("tracks", [])
+    platform = data.get("platform", "soundcloud")
+    
+    if track_index >= len(tracks):
+        await callback_query.message.answer("❌ Ошибка: Трек не найден. Пожалуйста, попробуйте снова.")
+        return
         
-        stdout, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            logger.error(f"Ошибка FFmpeg: {stderr}")
-            return False
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"Ошибка при обработке FFmpeg: {e}")
-        return False
+    selected_track = tracks[track_index]
+    
+    await run_user_job(
+        callback_query.from_user.id,
+        deliver_track(callback_query.message, selected_track, selected_track.get("platform", platform))
+    )
+
+@router.callback_query(SearchStates.select_track, F.data == "download_page")
+async def process_download_page(callback_query: types.CallbackQuery, state: FSMContext):
+    await callback_query.answer("⏳ Скачиваю все треки страницы")
+    
+    data = await state.get_data()
+    tracks = data.get("tracks", [])
+    current_page = data.get("current_page", 0)
+    platform = data.get("platform", "soundcloud")
+    
+    start_idx = current_page * TRACKS_PER_PAGE
+    page_tracks = tracks[start_idx:start_idx + TRACKS_PER_PAGE]
+    
+    if not page_tracks:
+        await callback_query.message.answer("❌ Ошибка: Треки не найдены. Пожалуйста, попробуйте снова.")
+        return
+    
+    logger.info(f"📦 Скачивание страницы {current_page + 1}: {len(page_tracks)} треков на платформе {platform}")
+    await run_user_job(callback_query.from_user.id, deliver_track_batch(callback_query.message, page_tracks, platform))
+
+def build_inline_result(track, platform, bot_username, cached=None):
+    """Готовит результат инлайн-режима: аудио из кэша (cached) или карточку со ссылкой на скачивание"""
+    prefix = "sc" if platform == "soundcloud" else "sp"
+    result_id = f"{prefix}_{track.get('id')}"
+    
+    if cached:
+        return types.InlineQueryResultCachedAudio(
+            id=result_id,
+            audio_file_id=cached["file_id"],
+            caption=AUDIO_CAPTION,
+            parse_mode="HTML"
+        )
+    
+    username = get_track_artist(track)
+    title = track.get('title', 'Untitled')
+    duration_sec = int(track.get("duration", 0)) // 1000
+    platform_emoji = "🟠" if platform == "soundcloud" else "🟢"
+    
+    builder = InlineKeyboardBuilder()
+    builder.row(types.InlineKeyboardButton(
+        text="⬇️ Скачать в боте",
+        url=f"https://t.me/{bot_username}?start={result_id}"
+    ))
+    
+    return types.InlineQueryResultArticle(
+        id=result_id,
+        title=f"{username} - {title}",
+        description=f"{platform_emoji} {duration_sec // 60}:{duration_sec % 60:02d}",
+        thumbnail_url=track.get("artwork_url") or None,
+        input_message_content=types.InputTextMessageContent(
+            message_text=f"{platform_emoji} <b>{escape_html(username)}</b> - {escape_html(title)}\n"
+                         f"{escape_html(track.get('permalink_url', ''))}",
+            parse_mode="HTML"
+        ),
+        reply_markup=builder.as_markup()
+    )
+
+@router.inline_query()
+async def process_inline_query(inline_query: types.InlineQuery):
+    query = inline_query.query.strip()
+    if len(query) < 2:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+    
+    # Запросы приходят на каждое нажатие клавиши - ищем только после паузы в наборе
+    user_id = inline_query.from_user.id
+    inline_query_ids[user_id] = inline_query.id
+    await asyncio.sleep(INLINE_DEBOUNCE_SECONDS)
+    if inline_query_ids.get(user_id) != inline_query.id:
+        return
+    inline_query_ids.pop(user_id, None)
+    
+    tracks, _ = await search_tracks("all", query, INLINE_RESULTS_PER_PLATFORM)
+    
+    bot_user = await inline_query.bot.me()
+    # Все file_id читаются одним заходом в поток, с учетом канонических ключей
+    cached_files = await asyncio.to_thread(lambda: [
+        lookup_file_id(track.get("platform", "soundcloud"), track.get("id"))[1] for track in tracks
+    ])
+    results = []
+    seen_ids = set()
+    for track, cached in zip(tracks, cached_files):
+        result = build_inline_result(track, track.get("platform", "soundcloud"), bot_user.username, cached)
+        if result.id not in seen_ids:
+            seen_ids.add(result.id)
+            results.append(result)
+    
+    # Треки, которые можно отправить сразу, показываем первыми
+    results.sort(key=lambda result: not isinstance(result, types.InlineQueryResultCachedAudio))
+    
+    try:
+        await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+    except TelegramBadRequest as e:
+        logger.warning(f"⚠️ Не удалось ответить на инлайн-запрос: {e}")
 
 @router.message()
 async def handle_text_message(message: types.Message, state: FSMContext):
@@ -757,7 +1372,13 @@ async def handle_text_message(message: types.Message, state: FSMContext):
         await process_search_query(message, state)
     else:
         query = message.text.strip()
-        if query:
+        collection_platform = get_collection_platform(query)
+        track_platform = get_track_url_platform(query)
+        if collection_platform:
+            await run_user_job(message.from_user.id, deliver_collection(message, query, collection_platform))
+        elif track_platform:
+            await run_user_job(message.from_user.id, deliver_track_url(message, query, track_platform))
+        elif query:
             # Show search message with platform options in the same message
             search_msg = await message.answer(f"🔍 Поиск: <b>{escape_html(query)}</b>\n\nВыберите платформу:", 
                                             parse_mode="HTML",
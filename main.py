@@ -1,3 +1,8 @@
+import time
+
+# Время запуска отсчитываем до импорта тяжелых модулей
+BOOT_STARTED_AT = time.monotonic()
+
 import asyncio
 import logging
 import sys
@@ -6,10 +11,17 @@ from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-from config import BOT_TOKEN
-from handlers import router
+from config import BOT_TOKEN, TELEGRAM_API_URL, TELEGRAM_API_LOCAL, METRICS_LOG_INTERVAL
+from handlers import router, get_warm_up_steps
+from utils.telegram_scheduler import OutboundScheduler
+from utils.workers import download_pool
+from utils.http_client import close_http_client
 from utils.logger import setup_root_logger, setup_logger
+from utils.metrics import log_metrics_periodically, metrics, format_summary
+from utils.startup import warm_up, report_ready
 
 setup_root_logger(log_to_file=False)
 logger = setup_logger(__name__, log_to_file=False)
@@ -19,7 +31,13 @@ async def main():
         logger.error("No token provided. Set BOT_TOKEN environment variable.")
         return
     
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    session = None
+    if TELEGRAM_API_URL:
+        logger.info(f"Using Bot API server {TELEGRAM_API_URL} (local mode: {TELEGRAM_API_LOCAL})")
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL, is_local=TELEGRAM_API_LOCAL))
+    
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(OutboundScheduler())
     
     dp = Dispatcher(storage=MemoryStorage())
     
@@ -27,11 +45,22 @@ async def main():
     
     await bot.delete_webhook(drop_pending_updates=True)
     
+    metrics_task = None
+    
     try:
         logger.info("Starting SoundCloud Bot")
+        results = await warm_up(get_warm_up_steps())
+        report_ready(BOOT_STARTED_AT, results)
+        if METRICS_LOG_INTERVAL > 0:
+            metrics_task = asyncio.create_task(log_metrics_periodically(METRICS_LOG_INTERVAL))
         await dp.start_polling(bot)
     finally:
         logger.info("Bot stopped!")
+        if metrics_task:
+            metrics_task.cancel()
+        logger.info(format_summary(metrics.snapshot()))
+        download_pool.shutdown()
+        close_http_client()
         await bot.session.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,29 @@
+import unittest
+
+from utils.metrics import Metrics
+
+class MetricsMergeTest(unittest.TestCase):
+    def test_worker_metrics_are_merged(self):
+        worker, main = Metrics(), Metrics()
+        worker.inc("downloads", 2)
+        worker.observe("download_seconds", 1.5)
+        main.inc("downloads")
+        main.merge(worker.drain())
+
+        self.assertEqual(main.counters["downloads"], 3)
+        self.assertEqual(list(main.observations["download_seconds"]), [1.5])
+        # Повторная выгрузка передает только новое
+        self.assertEqual(worker.drain()["counters"], {})
+
+    def test_worker_gauges_do_not_replace_own_gauges(self):
+        worker, main = Metrics(), Metrics()
+        main.set_gauge("circuit_spotify_state", 0)
+        worker.set_gauge("circuit_spotify_state", 2)
+        data = worker.drain()
+        main.merge(data)
+
+        self.assertEqual(main.gauges["circuit_spotify_state"], 0)
+        self.assertEqual(main.gauges[f"circuit_spotify_state@{data['pid']}"], 2)
+
+if __name__ == "__main__":
+    unittest.main()
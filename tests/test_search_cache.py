@@ -0,0 +1,29 @@
+import unittest
+
+from utils.search_cache import SearchCache
+
+class SearchCacheFuzzyTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SearchCache(max_entries=100, ttl=600, fuzzy_threshold=0.8)
+
+    def test_typo_reuses_results(self):
+        self.cache.put("soundcloud", "eminem lose yourself", 20, ["track"])
+        self.assertEqual(self.cache.get("soundcloud", "eminem loose yourself", 20), ["track"])
+
+    def test_extra_token_is_not_reused(self):
+        for query in ("eminem lose yourself", "queen bohemian rhapsody", "linkin park numb"):
+            self.cache.put("soundcloud", query, 20, [query])
+        self.assertIsNone(self.cache.get("soundcloud", "eminem lose yourself live", 20))
+        self.assertIsNone(self.cache.get("soundcloud", "queen bohemian rhapsody remix", 20))
+        self.assertIsNone(self.cache.get("soundcloud", "linkin park numb live", 20))
+
+    def test_base_query_does_not_reuse_extended_one(self):
+        self.cache.put("soundcloud", "eminem lose yourself live", 20, ["live"])
+        self.assertIsNone(self.cache.get("soundcloud", "eminem lose yourself", 20))
+
+    def test_different_word_is_not_reused(self):
+        self.cache.put("soundcloud", "linkin park numb", 20, ["numb"])
+        self.assertIsNone(self.cache.get("soundcloud", "linkin park faint", 20))
+
+if __name__ == "__main__":
+    unittest.main()
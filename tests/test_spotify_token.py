@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import spotify_token
+from utils.spotify_token import SpotifyTokenManager
+
+class FakeResponse:
+    def __init__(self, token):
+        self.token = token
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"access_token": self.token, "expires_in": 3600}
+
+class FakeClient:
+    def __init__(self):
+        self.calls = 0
+
+    def post(self, *args, **kwargs):
+        self.calls += 1
+        return FakeResponse(f"tok{self.calls}")
+
+class SpotifyTokenManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "token.json")
+        self.client = FakeClient()
+        patcher = mock.patch.object(spotify_token, "get_http_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def make_manager(self):
+        return SpotifyTokenManager(client_id="id", client_secret="secret", path=self.path, refresh_margin=300)
+
+    def test_token_is_shared_through_file(self):
+        self.assertEqual(self.make_manager().get_token(), "tok1")
+        self.assertEqual(self.make_manager().get_token(), "tok1")
+        self.assertEqual(self.client.calls, 1)
+
+    def test_invalidated_token_is_not_read_back_from_file(self):
+        manager = self.make_manager()
+        self.assertEqual(manager.get_token(), "tok1")
+        manager.invalidate("tok1")
+        self.assertEqual(manager.get_token(), "tok2")
+        self.assertEqual(self.client.calls, 2)
+        # Другой процесс берет из файла уже новый токен
+        self.assertEqual(self.make_manager().get_token(), "tok2")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+import glob
+import hashlib
+import mmap
+import os
+import threading
+
+from aiogram.types import InputFile
+
+from config import AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_MB, TITLE_BRANDING
+from utils.logger import setup_logger
+from utils.metrics import metrics
+from utils.tagging import rebrand_tag_blob
+
+logger = setup_logger(__name__, log_to_file=False)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def _id3v2_size(header):
+    """Размер ID3v2-тега по его 10-байтному заголовку (0, если тега нет)"""
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    # Флаг 0x10 - у тега есть 10-байтный футер
+    return 10 + size + (10 if header[5] & 0x10 else 0)
+
+class CachedAudioFile(InputFile):
+    """
+    Файл для отправки в Telegram: ID3-тег и аудиоданные из кэша передаются одним потоком.
+    Аудио отдается срезами mmap без чтения в буферы Python: популярные треки
+    читаются из страничного кэша ОС, сколько бы раз их ни отправляли.
+    """
+
+    def __init__(self, tag, audio_path, filename=None):
+        super().__init__(filename=filename)
+        self.tag = tag
+        self.audio_path = audio_path
+
+    @property
+    def size(self):
+        return len(self.tag) + os.path.getsize(self.audio_path)
+
+    def _map_body(self):
+        with open(self.audio_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(body, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            body.madvise(mmap.MADV_SEQUENTIAL)
+        return body
+
+    async def read(self, bot):
+        if self.tag:
+            yield self.tag
+
+        body = self._map_body()
+        if body is None:
+            return
+        # mmap не закрываем явно: транспорт может держать срезы до отправки,
+        # отображение освободится вместе с последним из них
+        view = memoryview(body)
+        for offset in range(0, len(view), self.chunk_size):
+            yield view[offset:offset + self.chunk_size]
+        metrics.inc("audio_cache_bytes_sent", len(view))
+
+class AudioCache:
+    """
+    Локальный кэш отправленных треков.
+    MPEG-кадры хранятся без тегов, а ID3-тег - отдельным блоком для текущей подписи бота,
+    поэтому смена подписи или метаданных не требует перезаписи аудио.
+    """
+
+    def __init__(self, cache_dir=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self.lock = threading.Lock()
+        self.branding_key = hashlib.sha1(TITLE_BRANDING.encode()).hexdigest()[:8]
+
+    def _base_path(self, platform, track_id):
+        safe_id = "".join(c for c in str(track_id) if c.isalnum() or c in "-_")
+        return os.path.join(self.cache_dir, platform, safe_id)
+
+    def store(self, platform, track_id, filename):
+        """Разделяет готовый MP3 на тег и аудиоданные и сохраняет их в кэш"""
+        if not self.enabled or not track_id:
+            return False
+        base_path = self._base_path(platform, track_id)
+        try:
+            os.makedirs(os.path.dirname(base_path), exist_ok=True)
+            total_size = os.path.getsize(filename)
+
+            with open(filename, "rb") as src:
+                tag_size = _id3v2_size(src.read(10))
+                src.seek(0)
+                tag = src.read(tag_size)
+
+                # ID3v1 в конце файла не нужен - все метаданные в ID3v2
+                audio_end = total_size
+                if total_size - tag_size >= 128:
+                    src.seek(total_size - 128)
+                    if src.read(3) == b"TAG":
+                        audio_end -= 128
+
+                src.seek(tag_size)
+                remaining = audio_end - tag_size
+                temp_path = f"{base_path}.audio.tmp"
+                with open(temp_path, "wb") as dst:
+                    while remaining > 0:
+                        chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        remaining -= len(chunk)
+
+            with self.lock:
+                os.replace(temp_path, f"{base_path}.audio")
+                self._write_tag(base_path, tag)
+            metrics.inc("audio_cache_stores")
+            self._enforce_quota()
+            return True
+        except OSError as e:
+            logger.error(f"❌ Ошибка записи в кэш аудио: {e}")
+            return False
+
+    def warm_up(self):
+        """Считает размер кэша и освобождает место, если лимит уменьшили"""
+        if not self.enabled:
+            return None
+        self._enforce_quota()
+        return True
+
+    def contains(self, platform, track_id):
+        return self.enabled and bool(track_id) and os.path.exists(f"{self._base_path(platform, track_id)}.audio")
+
+    def get(self, platform, track_id, filename=None):
+        """Возвращает CachedAudioFile для отправки или None, если трека нет в кэше"""
+        if not self.enabled or not track_id:
+            return None
+        base_path = self._base_path(platform, track_id)
+        audio_path = f"{base_path}.audio"
+        try:
+            with self.lock:
+                if not os.path.exists(audio_path):
+                    metrics.inc("audio_cache_misses")
+                    return None
+                tag = self._read_tag(base_path)
+                # Время изменения используется для вытеснения давно не отправлявшихся треков
+                os.utime(audio_path)
+        except OSError as e:
+            logger.error(f"❌ Ошибка чтения кэша аудио: {e}")
+            return None
+
+        metrics.inc("audio_cache_hits")
+        return CachedAudioFile(tag, audio_path, filename)
+
+    def _tag_path(self, base_path):
+        return f"{base_path}.{self.branding_key}.id3"
+
+    def _write_tag(self, base_path, tag):
+        for old_path in glob.glob(f"{glob.escape(base_path)}.*.id3"):
+            os.unlink(old_path)
+        with open(self._tag_path(base_path), "wb") as f:
+            f.write(tag)
+
+    def _read_tag(self, base_path):
+        tag_path = self._tag_path(base_path)
+        if os.path.exists(tag_path):
+            with open(tag_path, "rb") as f:
+                return f.read()
+
+        # Тег сохранен с прежней подписью бота - пересобираем только его
+        old_paths = glob.glob(f"{glob.escape(base_path)}.*.id3")
+        if not old_paths:
+            return b""
+        with open(old_paths[0], "rb") as f:
+            tag = f.read()
+        try:
+            tag = rebrand_tag_blob(tag) if tag else tag
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось обновить подпись в теге: {e}")
+        self._write_tag(base_path, tag)
+        metrics.inc("audio_cache_rebranded")
+        return tag
+
+    def _enforce_quota(self):
+        """Удаляет давно не отправлявшиеся треки, пока кэш больше лимита"""
+        entries = []
+        total = 0
+        for path in glob.glob(os.path.join(glob.escape(self.cache_dir), "*", "*.audio")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        metrics.set_gauge("audio_cache_bytes", total)
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            base_path = path[:-len(".audio")]
+            with self.lock:
+                for file_path in [path] + glob.glob(f"{glob.escape(base_path)}.*.id3"):
+                    try:
+                        os.unlink(file_path)
+                    except OSError:
+                        pass
+            total -= size
+            metrics.inc("audio_cache_evictions")
+        metrics.set_gauge("audio_cache_bytes", total)
+
+audio_cache = AudioCache()
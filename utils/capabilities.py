@@ -0,0 +1,131 @@
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger(__name__, log_to_file=False)
+
+# MP3-кодировщики FFmpeg в порядке предпочтения (libshine умеет только постоянный битрейт)
+MP3_ENCODERS = ("libmp3lame", "libshine")
+# Загрузчики YouTube в порядке предпочтения
+YTDLP_COMMANDS = ("yt-dlp", "youtube-dl")
+
+PROBE_TIMEOUT = 10
+
+_capabilities = None
+_lock = threading.Lock()
+
+def _run(command):
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug(f"Не удалось выполнить {command[0]}: {e}")
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+def _list_names(output):
+    """Имена из вывода ffmpeg -encoders/-demuxers (строки вида ' A..... libmp3lame  описание')"""
+    names = set()
+    for line in (output or "").splitlines():
+        match = re.match(r"\s*[A-Z.]{1,6}\s+([\w,]+)\s", line)
+        if match:
+            names.update(match.group(1).split(","))
+    return names
+
+def _probe_ffmpeg():
+    path = shutil.which("ffmpeg")
+    if not path:
+        return None
+    version = _run([path, "-hide_banner", "-version"])
+    if version is None:
+        return None
+    match = re.match(r"ffmpeg version (\S+)", version)
+    encoders = _list_names(_run([path, "-hide_banner", "-encoders"]))
+    demuxers = _list_names(_run([path, "-hide_banner", "-demuxers"]))
+    return {
+        "path": path,
+        "version": match.group(1) if match else "",
+        "mp3_encoders": [encoder for encoder in MP3_ENCODERS if encoder in encoders],
+        "hls": "hls" in demuxers,
+    }
+
+def _probe_ytdlp():
+    for command in YTDLP_COMMANDS:
+        path = shutil.which(command)
+        if not path:
+            continue
+        version = _run([path, "--version"])
+        if version is not None:
+            return {"command": command, "path": path, "version": version.strip()}
+    return None
+
+def probe():
+    """Проверяет внешние программы: версии FFmpeg и yt-dlp, кодировщики MP3, поддержку HLS, fpcalc"""
+    started_at = time.monotonic()
+    capabilities = {
+        "ffmpeg": _probe_ffmpeg(),
+        "ytdlp": _probe_ytdlp(),
+        "fpcalc": shutil.which("fpcalc"),
+    }
+    metrics.observe("capability_probe_seconds", time.monotonic() - started_at)
+    return capabilities
+
+def get_capabilities():
+    """Возможности системы; проверяются один раз на процесс (рабочие процессы получают их от пула)"""
+    global _capabilities
+    if _capabilities is None:
+        with _lock:
+            if _capabilities is None:
+                _capabilities = probe()
+    return _capabilities
+
+def set_capabilities(capabilities):
+    """Устанавливает результат проверки, полученный от основного процесса"""
+    global _capabilities
+    _capabilities = capabilities
+
+def has_ffmpeg():
+    return get_capabilities()["ffmpeg"] is not None
+
+def mp3_encoder():
+    """Лучший доступный MP3-кодировщик FFmpeg или None"""
+    ffmpeg = get_capabilities()["ffmpeg"]
+    if not ffmpeg or not ffmpeg["mp3_encoders"]:
+        return None
+    return ffmpeg["mp3_encoders"][0]
+
+def supports_hls():
+    ffmpeg = get_capabilities()["ffmpeg"]
+    return bool(ffmpeg and ffmpeg["hls"])
+
+def ytdlp_command():
+    """Команда загрузчика YouTube (yt-dlp или youtube-dl) или None"""
+    ytdlp = get_capabilities()["ytdlp"]
+    return ytdlp["command"] if ytdlp else None
+
+def has_fpcalc():
+    return get_capabilities()["fpcalc"] is not None
+
+def describe():
+    """Краткое описание возможностей для журнала запуска"""
+    capabilities = get_capabilities()
+    ffmpeg, ytdlp = capabilities["ffmpeg"], capabilities["ytdlp"]
+    parts = [
+        f"ffmpeg {ffmpeg['version']} ({', '.join(ffmpeg['mp3_encoders']) or 'без MP3'}"
+        f"{', HLS' if ffmpeg['hls'] else ''})" if ffmpeg else "ffmpeg нет",
+        f"{ytdlp['command']} {ytdlp['version']}" if ytdlp else "yt-dlp нет",
+        "fpcalc" if capabilities["fpcalc"] else "fpcalc нет",
+    ]
+    return ", ".join(parts)
+
+def warm_up():
+    """Проверяет возможности при запуске; без FFmpeg загрузки идут без перекодирования"""
+    summary = describe()
+    if not mp3_encoder():
+        logger.warning(f"⚠️ Нет FFmpeg с MP3-кодировщиком: {summary}")
+        return False
+    return summary
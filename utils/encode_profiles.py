@@ -0,0 +1,66 @@
+from config import MAX_UPLOAD_SIZE
+from utils.capabilities import mp3_encoder
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__, log_to_file=False)
+
+# Запас на ID3-теги, обложку и служебные кадры MP3
+TAG_OVERHEAD_BYTES = 1024 * 1024
+
+# Профили кодирования от лучшего качества к худшему.
+# max_kbps - оценка битрейта сверху, по ней прогнозируется размер файла.
+# Переменный битрейт (vbr) поддерживает только libmp3lame.
+ENCODE_PROFILES = [
+    {"name": "vbr_v0", "ffmpeg_args": ["-q:a", "0"], "ytdlp_quality": "0", "max_kbps": 260, "vbr": True},
+    {"name": "vbr_v2", "ffmpeg_args": ["-q:a", "2"], "ytdlp_quality": "2", "max_kbps": 210, "vbr": True},
+    {"name": "cbr_192", "ffmpeg_args": ["-b:a", "192k"], "ytdlp_quality": "192K", "max_kbps": 192},
+    {"name": "cbr_160", "ffmpeg_args": ["-b:a", "160k"], "ytdlp_quality": "160K", "max_kbps": 160},
+    {"name": "cbr_128", "ffmpeg_args": ["-b:a", "128k"], "ytdlp_quality": "128K", "max_kbps": 128},
+    {"name": "cbr_96", "ffmpeg_args": ["-b:a", "96k"], "ytdlp_quality": "96K", "max_kbps": 96},
+    {"name": "cbr_64", "ffmpeg_args": ["-b:a", "64k"], "ytdlp_quality": "64K", "max_kbps": 64},
+]
+
+# Профиль по умолчанию для каждой платформы
+DEFAULT_PROFILES = {
+    "soundcloud": "vbr_v2",
+    "spotify": "vbr_v0",
+}
+
+def predict_size(duration_ms, profile):
+    """Прогнозирует размер MP3-файла в байтах для заданного профиля"""
+    duration_sec = max(int(duration_ms or 0), 0) / 1000
+    return int(profile["max_kbps"] * 1000 / 8 * duration_sec) + TAG_OVERHEAD_BYTES
+
+def select_encode_profile(duration_ms, platform="soundcloud", max_size=MAX_UPLOAD_SIZE):
+    """
+    Выбирает профиль кодирования, при котором файл поместится в лимит загрузки.
+    Возвращает None, если трек слишком длинный даже для самого низкого битрейта.
+    """
+    preferred = DEFAULT_PROFILES.get(platform, "vbr_v2")
+    start_idx = next(
+        (i for i, profile in enumerate(ENCODE_PROFILES) if profile["name"] == preferred),
+        0
+    )
+    # Кодировщик без VBR (или без FFmpeg вовсе - тогда решает yt-dlp/прямая загрузка)
+    encoder = mp3_encoder()
+    if encoder and encoder != "libmp3lame":
+        while ENCODE_PROFILES[start_idx].get("vbr"):
+            start_idx += 1
+
+    try:
+        duration_ms = int(duration_ms or 0)
+    except (TypeError, ValueError):
+        duration_ms = 0
+
+    # Длительность неизвестна - кодируем как обычно, размер проверится после загрузки
+    if duration_ms <= 0:
+        return ENCODE_PROFILES[start_idx]
+
+    for profile in ENCODE_PROFILES[start_idx:]:
+        if predict_size(duration_ms, profile) <= max_size:
+            if profile["name"] != preferred:
+                logger.info(f"🎚️ Для трека длительностью {duration_ms // 1000} с выбран профиль {profile['name']}")
+            return profile
+
+    logger.warning(f"⚠️ Трек длительностью {duration_ms // 1000} с не поместится в {max_size / (1024 * 1024):.0f} МБ")
+    return None
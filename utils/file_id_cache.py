@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+import time
+
+from config import CACHE_DB_PATH
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__, log_to_file=False)
+
+class FileIdCache:
+    """Хранит Telegram file_id уже отправленных треков, чтобы не загружать их повторно"""
+
+    def __init__(self, db_path=CACHE_DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "platform TEXT NOT NULL, "
+                "track_id TEXT NOT NULL, "
+                "file_id TEXT NOT NULL, "
+                "title TEXT, "
+                "performer TEXT, "
+                "updated_at REAL, "
+                "PRIMARY KEY (platform, track_id))"
+            )
+            self.conn.commit()
+        return self.conn
+
+    def warm_up(self):
+        """Открывает базу заранее, возвращает число сохраненных file_id"""
+        try:
+            with self.lock:
+                return self._connect().execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка открытия кэша file_id: {e}")
+            return None
+
+    def get(self, platform, track_id):
+        if not track_id:
+            return None
+        try:
+            with self.lock:
+                row = self._connect().execute(
+                    "SELECT file_id, title, performer FROM file_ids WHERE platform = ? AND track_id = ?",
+                    (platform, str(track_id))
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка чтения кэша file_id: {e}")
+            return None
+
+        if not row:
+            return None
+        return {"file_id": row[0], "title": row[1], "performer": row[2]}
+
+    def put(self, platform, track_id, file_id, title="", performer=""):
+        if not track_id or not file_id:
+            return
+        try:
+            with self.lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO file_ids (platform, track_id, file_id, title, performer, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (platform, str(track_id), file_id, title, performer, time.time())
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка записи в кэш file_id: {e}")
+
+    def delete(self, platform, track_id):
+        try:
+            with self.lock:
+                conn = self._connect()
+                conn.execute(
+                    "DELETE FROM file_ids WHERE platform = ? AND track_id = ?",
+                    (platform, str(track_id))
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка удаления из кэша file_id: {e}")
+
+file_id_cache = FileIdCache()
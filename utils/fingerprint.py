@@ -0,0 +1,235 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from array import array
+
+from config import CACHE_DB_PATH, FINGERPRINT_ENABLED, FINGERPRINT_LENGTH, FINGERPRINT_SIMILARITY
+from utils.capabilities import has_ffmpeg, has_fpcalc
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger(__name__, log_to_file=False)
+
+# Параметры запасного отпечатка по огибающей энергии
+SAMPLE_RATE = 11025
+ENERGY_BLOCK = 512
+HASH_BITS = 32
+HASH_STEP = 16
+# Насколько хэшей можно сдвинуть отпечатки друг относительно друга при сравнении
+MAX_SHIFT = 3
+# Допустимая разница длительностей одной и той же записи (в секундах)
+DURATION_TOLERANCE = 3
+
+def _get_duration(filename):
+    from mutagen.mp3 import MP3
+    try:
+        return MP3(filename).info.length
+    except Exception:
+        return 0
+
+def _chromaprint(filename):
+    """Отпечаток chromaprint через fpcalc"""
+    result = subprocess.run(
+        ["fpcalc", "-raw", "-length", str(FINGERPRINT_LENGTH), filename],
+        capture_output=True, text=True, timeout=60
+    )
+    if result.returncode != 0:
+        return None
+    for line in result.stdout.splitlines():
+        if line.startswith("FINGERPRINT="):
+            return [int(value) & 0xFFFFFFFF for value in line[len("FINGERPRINT="):].split(",") if value]
+    return None
+
+def _energy_hashes(filename):
+    """
+    Запасной отпечаток без chromaprint: начальная тишина обрезается, каждый бит хэша -
+    растет ли энергия звука от блока к блоку (огибающая почти не зависит от кодека и битрейта).
+    """
+    result = subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-i", filename,
+            "-af", f"silenceremove=start_periods=1:start_threshold=-50dB,atrim=duration={FINGERPRINT_LENGTH}",
+            "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"
+        ],
+        capture_output=True, timeout=60
+    )
+    if result.returncode != 0:
+        return None
+
+    pcm = result.stdout
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder != "little":
+        samples.byteswap()
+
+    energies = [
+        sum(sample * sample for sample in samples[i:i + ENERGY_BLOCK])
+        for i in range(0, len(samples) - ENERGY_BLOCK + 1, ENERGY_BLOCK)
+    ]
+    hashes = []
+    for start in range(0, len(energies) - HASH_BITS, HASH_STEP):
+        value = 0
+        for j in range(HASH_BITS):
+            if energies[start + j + 1] > energies[start + j]:
+                value |= 1 << j
+        hashes.append(value)
+    return hashes or None
+
+def compute_fingerprint(filename):
+    """
+    Считает отпечаток первых FINGERPRINT_LENGTH секунд готового MP3.
+    Возвращает {"kind", "duration", "hashes"} или None.
+    """
+    if not FINGERPRINT_ENABLED:
+        return None
+    started_at = time.monotonic()
+    try:
+        if has_fpcalc():
+            kind, hashes = "chromaprint", _chromaprint(filename)
+        elif has_ffmpeg():
+            kind, hashes = "energy", _energy_hashes(filename)
+        else:
+            return None
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"⚠️ Не удалось посчитать отпечаток аудио: {e}")
+        return None
+
+    if not hashes:
+        return None
+    metrics.observe("fingerprint_seconds", time.monotonic() - started_at)
+    return {"kind": kind, "duration": _get_duration(filename), "hashes": hashes}
+
+def similarity(a, b):
+    """Доля совпадающих бит при лучшем сдвиге отпечатков друг относительно друга"""
+    best = 0.0
+    for shift in range(-MAX_SHIFT, MAX_SHIFT + 1):
+        pairs = list(zip(a[max(shift, 0):], b[max(-shift, 0):]))
+        if len(pairs) < MAX_SHIFT * 2:
+            continue
+        errors = sum((x ^ y).bit_count() for x, y in pairs)
+        best = max(best, 1 - errors / (len(pairs) * HASH_BITS))
+    return best
+
+def _pack(hashes):
+    return array("I", hashes).tobytes()
+
+def _unpack(blob):
+    hashes = array("I")
+    hashes.frombytes(blob)
+    return hashes.tolist()
+
+class FingerprintIndex:
+    """
+    Индекс отпечатков аудио: одинаковые записи с разных платформ
+    сводятся к одному каноническому треку, чьи file_id и файл в кэше используются повторно.
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH, threshold=FINGERPRINT_SIMILARITY):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "platform TEXT NOT NULL, "
+                "track_id TEXT NOT NULL, "
+                "kind TEXT NOT NULL, "
+                "duration REAL, "
+                "hashes BLOB NOT NULL, "
+                "canonical_platform TEXT NOT NULL, "
+                "canonical_track_id TEXT NOT NULL, "
+                "created_at REAL, "
+                "PRIMARY KEY (platform, track_id))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS fingerprints_duration ON fingerprints (kind, duration)"
+            )
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def warm_up(self):
+        """Открывает индекс заранее, возвращает число отпечатков в нем"""
+        try:
+            with self.lock:
+                return self._connect().execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка открытия индекса отпечатков: {e}")
+            return None
+
+    def canonical(self, platform, track_id):
+        """Канонический трек (platform, track_id) для уже известного трека или None"""
+        if not track_id:
+            return None
+        try:
+            with self.lock:
+                row = self._connect().execute(
+                    "SELECT canonical_platform, canonical_track_id FROM fingerprints "
+                    "WHERE platform = ? AND track_id = ?",
+                    (platform, str(track_id))
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка чтения индекса отпечатков: {e}")
+            return None
+        return tuple(row) if row else None
+
+    def register(self, platform, track_id, fingerprint):
+        """
+        Сохраняет отпечаток трека и возвращает его канонический трек:
+        самую похожую запись среди известных или сам трек, если похожих нет.
+        """
+        if not track_id or not fingerprint:
+            return None
+        key = (platform, str(track_id))
+        try:
+            with self.lock:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT canonical_platform, canonical_track_id FROM fingerprints "
+                    "WHERE platform = ? AND track_id = ?",
+                    key
+                ).fetchone()
+                if row:
+                    return tuple(row)
+
+                duration = fingerprint["duration"] or 0
+                candidates = conn.execute(
+                    "SELECT canonical_platform, canonical_track_id, hashes FROM fingerprints "
+                    "WHERE kind = ? AND duration BETWEEN ? AND ?",
+                    (fingerprint["kind"], duration - DURATION_TOLERANCE, duration + DURATION_TOLERANCE)
+                ).fetchall()
+
+                canonical, best_score = key, self.threshold
+                for canonical_platform, canonical_track_id, hashes in candidates:
+                    score = similarity(fingerprint["hashes"], _unpack(hashes))
+                    if score >= best_score:
+                        canonical, best_score = (canonical_platform, canonical_track_id), score
+
+                conn.execute(
+                    "INSERT INTO fingerprints (platform, track_id, kind, duration, hashes, "
+                    "canonical_platform, canonical_track_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*key, fingerprint["kind"], duration, _pack(fingerprint["hashes"]), *canonical, time.time())
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка записи в индекс отпечатков: {e}")
+            return None
+
+        if canonical != key:
+            metrics.inc("fingerprint_duplicates")
+            logger.info(f"🧬 Трек {platform}:{track_id} совпадает с {canonical[0]}:{canonical[1]} ({best_score:.2f})")
+        else:
+            metrics.inc("fingerprint_unique")
+        return canonical
+
+fingerprint_index = FingerprintIndex()
@@ -0,0 +1,111 @@
+import importlib.util
+import threading
+
+import httpx
+
+from config import (
+    USER_AGENT, HTTP2_ENABLED, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_KEEPALIVE_EXPIRY
+)
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__, log_to_file=False)
+
+_client = None
+_client_lock = threading.Lock()
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Тело ответа, освобождающее слот хоста при закрытии"""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+        self.released = False
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if not self.released:
+                self.released = True
+                self.release()
+
+class HostLimitedTransport(httpx.BaseTransport):
+    """Ограничивает число одновременных соединений с каждым хостом"""
+
+    def __init__(self, transport, per_host=HTTP_MAX_CONNECTIONS_PER_HOST, wait_timeout=HTTP_READ_TIMEOUT):
+        self.transport = transport
+        self.per_host = per_host
+        self.wait_timeout = wait_timeout
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    def _semaphore(self, host):
+        with self.lock:
+            semaphore = self.semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self.semaphores[host] = semaphore
+            return semaphore
+
+    def handle_request(self, request):
+        semaphore = self._semaphore(request.url.host)
+        if not semaphore.acquire(timeout=self.wait_timeout):
+            raise httpx.PoolTimeout(f"Нет свободных соединений с {request.url.host}", request=request)
+
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        # Слот занят, пока тело ответа не будет прочитано или закрыто
+        response.stream = _ReleasingStream(response.stream, semaphore.release)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+def _http2_available():
+    if not HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("⚠️ Пакет h2 не установлен, HTTP/2 отключен (pip install httpx[http2])")
+        return False
+    return True
+
+def create_http_client():
+    """Создает HTTP-клиент с пулом соединений, HTTP/2 и таймаутами"""
+    transport = httpx.HTTPTransport(
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        retries=1
+    )
+    return httpx.Client(
+        transport=HostLimitedTransport(transport),
+        headers={"User-Agent": USER_AGENT},
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        follow_redirects=True
+    )
+
+def get_http_client():
+    """Общий для всех клиентов платформ HTTP-клиент (один на процесс)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_http_client()
+        return _client
+
+def close_http_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__, log_to_file=False)
+
+class Metrics:
+    """Простой потокобезопасный реестр счетчиков, значений и распределений"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._window = window
+        self.started_at = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.observations = {}
+        # Сколько значений записано и сколько из них уже передано (для рабочих процессов)
+        self._observed = {}
+        self._drained = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            if name not in self.observations:
+                self.observations[name] = deque(maxlen=self._window)
+            self.observations[name].append(value)
+            self._observed[name] = self._observed.get(name, 0) + 1
+
+    def percentile(self, name, pct):
+        with self._lock:
+            values = sorted(self.observations.get(name, ()))
+        if not values:
+            return None
+        idx = min(int(len(values) * pct / 100), len(values) - 1)
+        return values[idx]
+
+    def drain(self):
+        """
+        Забирает накопленное с прошлого вызова: счетчики (обнуляя их), значения и новые замеры.
+        Рабочие процессы так передают метрики основному; окна замеров остаются на месте.
+        Значения относятся к своему процессу (например, состояние его предохранителей),
+        поэтому передаются вместе с pid.
+        """
+        with self._lock:
+            observations = {}
+            for name, values in self.observations.items():
+                new_count = min(self._observed[name] - self._drained.get(name, 0), len(values))
+                if new_count:
+                    observations[name] = list(values)[-new_count:]
+                self._drained[name] = self._observed[name]
+            data = {
+                "pid": os.getpid(),
+                "counters": self.counters,
+                "gauges": dict(self.gauges),
+                "observations": observations,
+            }
+            self.counters = {}
+        return data
+
+    def merge(self, data):
+        """
+        Добавляет метрики, полученные от рабочего процесса. Его значения хранятся
+        под именем name@pid и не заменяют одноименные значения основного процесса.
+        """
+        for name, value in data.get("counters", {}).items():
+            self.inc(name, value)
+        suffix = f"@{data['pid']}" if "pid" in data else "@worker"
+        with self._lock:
+            for name, value in data.get("gauges", {}).items():
+                self.gauges[f"{name}{suffix}"] = value
+        for name, values in data.get("observations", {}).items():
+            for value in values:
+                self.observe(name, value)
+
+    def snapshot(self):
+        with self._lock:
+            observations = {name: list(values) for name, values in self.observations.items()}
+            snapshot = {
+                "uptime": time.time() - self.started_at,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "observations": {},
+            }
+
+        for name, values in observations.items():
+            values.sort()
+            snapshot["observations"][name] = {
+                "count": len(values),
+                "avg": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(int(len(values) * 0.95), len(values) - 1)],
+                "max": values[-1],
+            }
+
+        return snapshot
+
+def format_summary(snapshot):
+    """Краткая сводка метрик одной строкой на раздел"""
+    counters = ", ".join(f"{name}={value}" for name, value in sorted(snapshot["counters"].items()))
+    gauges = ", ".join(
+        f"{name}={value:.2f}" if isinstance(value, float) else f"{name}={value}"
+        for name, value in sorted(snapshot["gauges"].items())
+    )
+    observations = ", ".join(
+        f"{name}: n={stats['count']} p50={stats['p50']:.3g} p95={stats['p95']:.3g} max={stats['max']:.3g}"
+        for name, stats in sorted(snapshot["observations"].items())
+    )
+    return (
+        f"📊 Метрики за {snapshot['uptime'] / 60:.0f} мин\n"
+        f"Счетчики: {counters or '-'}\n"
+        f"Значения: {gauges or '-'}\n"
+        f"Распределения: {observations or '-'}"
+    )
+
+async def log_metrics_periodically(interval):
+    """Пишет сводку метрик в журнал каждые interval секунд"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(format_summary(metrics.snapshot()))
+
+metrics = Metrics()
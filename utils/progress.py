@@ -0,0 +1,253 @@
+import asyncio
+import re
+import subprocess
+import threading
+import time
+
+from config import PROGRESS_UPDATE_INTERVAL
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__, log_to_file=False)
+
+KEY_VALUE_RE = re.compile(r'^\w+=')
+
+YTDLP_PROGRESS_RE = re.compile(
+    r'\[download\]\s+([\d.]+)%'
+    r'(?:\s+of\s+~?\s*([\d.]+)\s*([KMG]?i?B))?'
+    r'(?:\s+at\s+([\d.]+)\s*([KMG]?i?B)/s)?'
+    r'(?:\s+ETA\s+([\d:]+))?'
+)
+
+SIZE_UNITS = {
+    "B": 1,
+    "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3,
+    "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3,
+}
+
+STAGE_NAMES = {
+    "download": "⬇️ Загрузка",
+    "encode": "🔄 Кодирование",
+}
+
+def _to_bytes(value, unit):
+    try:
+        return float(value) * SIZE_UNITS.get(unit, 1)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_clock(value):
+    seconds = 0
+    for part in value.split(":"):
+        if not part.isdigit():
+            return None
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+def parse_ytdlp_progress(line):
+    """Разбирает строку прогресса yt-dlp (--newline) в событие прогресса"""
+    match = YTDLP_PROGRESS_RE.search(line)
+    if not match:
+        return None
+
+    percent, size, size_unit, speed, speed_unit, eta = match.groups()
+    return {
+        "stage": "download",
+        "percent": float(percent),
+        "total_bytes": _to_bytes(size, size_unit) if size else None,
+        "speed": _to_bytes(speed, speed_unit) if speed else None,
+        "eta": _parse_clock(eta) if eta else None,
+    }
+
+class FfmpegProgressParser:
+    """Собирает блоки вывода `ffmpeg -progress pipe:1` в события прогресса"""
+
+    def __init__(self, duration_ms, stage="encode"):
+        self.duration = max(int(duration_ms or 0), 0) / 1000
+        self.stage = stage
+        self.out_time = 0.0
+        self.speed = None
+
+    def feed(self, line):
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+
+        if key == "out_time_us" or (key == "out_time_ms" and not self.out_time):
+            # out_time_ms у ffmpeg на самом деле в микросекундах
+            try:
+                self.out_time = int(value) / 1_000_000
+            except ValueError:
+                pass
+        elif key == "speed":
+            try:
+                self.speed = float(value.rstrip("x"))
+            except ValueError:
+                self.speed = None
+        elif key == "progress":
+            percent = None
+            eta = None
+            if self.duration > 0:
+                percent = min(self.out_time / self.duration * 100, 100.0)
+                if self.speed:
+                    eta = max(self.duration - self.out_time, 0) / self.speed
+            if value == "end":
+                percent = 100.0
+                eta = 0
+            return {
+                "stage": self.stage,
+                "percent": percent,
+                "speed": self.speed,
+                "eta": eta,
+            }
+        return None
+
+class JobCancelled(BaseException):
+    """
+    Задача отменена пользователем. Наследуется от BaseException,
+    чтобы общие обработчики ошибок не запускали вместо нее запасные варианты загрузки.
+    """
+
+class JobControl:
+    """
+    Обработчик прогресса задачи, через который ее можно отменить:
+    останавливает запущенный дочерний процесс и прерывает задачу при следующем событии прогресса.
+    """
+
+    def __init__(self, report=None):
+        self.report = report
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.process = None
+
+    def __call__(self, event):
+        self.check()
+        if self.report:
+            self.report(event)
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def attach(self, process):
+        with self.lock:
+            self.process = process
+            if self.cancelled.is_set():
+                process.kill()
+
+    def detach(self):
+        with self.lock:
+            self.process = None
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled.set()
+            if self.process and self.process.poll() is None:
+                self.process.kill()
+
+def run_with_progress(cmd, parse_line=None, progress_callback=None):
+    """
+    Запускает процесс, построчно разбирая его вывод.
+    Возвращает код завершения и вывод без строк прогресса.
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace"
+    )
+    control = progress_callback if isinstance(progress_callback, JobControl) else None
+    if control:
+        control.attach(process)
+
+    output_lines = []
+    try:
+        for line in process.stdout:
+            event = parse_line(line) if parse_line else None
+            if event:
+                if progress_callback:
+                    try:
+                        progress_callback(event)
+                    except Exception as e:
+                        logger.debug(f"Ошибка обработчика прогресса: {e}")
+            elif not KEY_VALUE_RE.match(line):
+                output_lines.append(line)
+    finally:
+        if control:
+            control.detach()
+            if control.cancelled.is_set() and process.poll() is None:
+                process.kill()
+        process.wait()
+
+    # Процесс остановлен отменой задачи - его код завершения не должен выглядеть как обычная ошибка
+    if control:
+        control.check()
+    return process.returncode, "".join(output_lines)
+
+def _format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def format_progress(event):
+    stage_name = STAGE_NAMES.get(event.get("stage"), "⏳ Обработка")
+    percent = event.get("percent")
+
+    if percent is None:
+        return f"{stage_name}..."
+
+    filled = int(percent // 10)
+    bar = "▰" * filled + "▱" * (10 - filled)
+    text = f"{stage_name}: {bar} {percent:.0f}%"
+
+    eta = event.get("eta")
+    if eta:
+        text += f" • осталось ~{_format_eta(eta)}"
+    return text
+
+class ProgressReporter:
+    """Обновляет статусное сообщение по событиям прогресса не чаще заданного интервала"""
+
+    def __init__(self, message, header, min_interval=PROGRESS_UPDATE_INTERVAL):
+        self.message = message
+        self.header = header
+        self.min_interval = min_interval
+        self.last_update = 0.0
+        self.last_text = None
+        self.task = None
+        self.closed = False
+
+    def __call__(self, event):
+        if self.closed:
+            return
+        now = time.monotonic()
+        finished = event.get("percent") is not None and event["percent"] >= 100
+        if now - self.last_update < self.min_interval and not finished:
+            return
+
+        text = f"{self.header}\n\n{format_progress(event)}"
+        if text == self.last_text or (self.task and not self.task.done()):
+            return
+
+        self.last_update = now
+        self.last_text = text
+        self.task = asyncio.ensure_future(self._edit(text))
+
+    async def _edit(self, text):
+        if self.closed:
+            return
+        try:
+            await self.message.edit_text(text, parse_mode="HTML")
+        except Exception as e:
+            logger.debug(f"Не удалось обновить прогресс: {e}")
+
+    async def close(self):
+        """
+        Дожидается последнего обновления и отключает следующие: события из пула процессов
+        могут прийти уже после закрытия и не должны перезаписать итоговое сообщение
+        """
+        self.closed = True
+        if self.task and not self.task.done():
+            try:
+                await self.task
+            except Exception:
+                pass
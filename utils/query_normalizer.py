@@ -0,0 +1,74 @@
+import re
+
+from config import SEARCH_TRANSLITERATE
+
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+TRANSLIT_TABLE = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "",
+    "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
+
+def normalize_query(query, transliterate=SEARCH_TRANSLITERATE):
+    """
+    Приводит поисковый запрос к каноническому виду:
+    нижний регистр, без знаков препинания и лишних пробелов, при необходимости латиницей.
+    """
+    text = NON_WORD_RE.sub(" ", str(query or "").casefold())
+    if transliterate:
+        text = text.translate(TRANSLIT_TABLE)
+    return " ".join(text.split())
+
+def trigrams(text):
+    """Множество триграмм строки (с границами слов) для нечеткого сравнения"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def trigram_similarity(first, second):
+    """Коэффициент Жаккара для двух множеств триграмм"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+def edit_distance(first, second, limit):
+    """Расстояние Левенштейна; при превышении limit возвращает limit + 1"""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (first_char != second_char)
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+def is_typo_variant(first, second, max_total=2):
+    """
+    Отличаются ли нормализованные запросы только опечатками: те же слова в том же количестве,
+    в каждом не больше одной правки (короткие слова - без правок), всего не больше max_total.
+    Запрос с лишним словом ("numb live" и "numb") опечаткой не считается.
+    """
+    first_tokens, second_tokens = first.split(), second.split()
+    if len(first_tokens) != len(second_tokens):
+        return False
+    total = 0
+    for first_token, second_token in zip(first_tokens, second_tokens):
+        if first_token == second_token:
+            continue
+        limit = 1 if min(len(first_token), len(second_token)) >= 4 else 0
+        distance = edit_distance(first_token, second_token, limit)
+        if distance > limit:
+            return False
+        total += distance
+        if total > max_total:
+            return False
+    return True
@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import httpx
+
+from config import (
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT, HEDGE_MIN_DELAY,
+    RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+)
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger(__name__, log_to_file=False)
+
+# Коды ответов, при которых запрос стоит повторить и считать сбоем платформы
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Минимум замеров задержки, после которого p95 считается надежным
+HEDGE_MIN_SAMPLES = 20
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+class CircuitOpenError(Exception):
+    """Запрос не выполнен: предохранитель эндпоинта разомкнут"""
+
+class CircuitBreaker:
+    """
+    Предохранитель эндпоинта: после серии сбоев перестает пропускать запросы,
+    через reset_timeout пропускает один пробный и по его результату замыкается или снова размыкается.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._export()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state("half_open")
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            if self.state != "closed":
+                logger.info(f"✅ Эндпоинт {self.name} снова доступен")
+                self._set_state("closed")
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            metrics.inc(f"circuit_{self.name}_failures")
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"⚠️ Эндпоинт {self.name} отключен на {self.reset_timeout} с после {self.failures} сбоев")
+                self.opened_at = time.monotonic()
+                self._set_state("open")
+
+    def release_probe(self):
+        """Пробный запрос прерван не по вине платформы: следующий запрос снова будет пробным"""
+        with self.lock:
+            if self.state == "half_open":
+                self._set_state("open")
+
+    def _set_state(self, state):
+        self.state = state
+        self._export()
+
+    def _export(self):
+        metrics.set_gauge(f"circuit_{self.name}_state", CIRCUIT_STATES[self.state])
+
+def get_breaker(endpoint):
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint)
+            _breakers[endpoint] = breaker
+        return breaker
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def _hedge_delay(endpoint):
+    latencies = metrics.observations.get(f"http_latency_{endpoint}")
+    if not latencies or len(latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(metrics.percentile(f"http_latency_{endpoint}", 95), HEDGE_MIN_DELAY)
+
+def _timed_get(session, endpoint, url, kwargs):
+    started_at = time.monotonic()
+    response = session.get(url, **kwargs)
+    metrics.observe(f"http_latency_{endpoint}", time.monotonic() - started_at)
+    return response
+
+def _hedged_get(session, endpoint, url, kwargs):
+    """
+    Отправляет запрос и, если он не завершился за p95 задержки эндпоинта,
+    дублирует его. Возвращает первый успешный ответ.
+    """
+    delay = _hedge_delay(endpoint)
+    if delay is None:
+        return _timed_get(session, endpoint, url, kwargs)
+
+    futures = [_hedge_executor.submit(_timed_get, session, endpoint, url, kwargs)]
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        metrics.inc(f"http_hedged_{endpoint}")
+        futures.append(_hedge_executor.submit(_timed_get, session, endpoint, url, kwargs))
+
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except httpx.HTTPError as e:
+                error = e
+                continue
+            # Ответ отставшего дубликата уже не нужен
+            for other in pending:
+                other.add_done_callback(lambda f: f.exception() is None and f.result().close())
+            return response
+    raise error
+
+def resilient_get(session, endpoint, url, hedge=False, **kwargs):
+    """
+    GET-запрос к платформе через предохранитель эндпоинта с повторами и
+    экспоненциальной задержкой. hedge=True допустим только для идемпотентных запросов.
+    """
+    breaker = get_breaker(endpoint)
+    response = None
+
+    for attempt in range(RETRY_ATTEMPTS):
+        if not breaker.allow():
+            metrics.inc(f"circuit_{endpoint}_rejected")
+            raise CircuitOpenError(f"Эндпоинт {endpoint} временно недоступен")
+
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1))
+            metrics.inc(f"http_retries_{endpoint}")
+
+        try:
+            if hedge:
+                response = _hedged_get(session, endpoint, url, kwargs)
+            else:
+                response = _timed_get(session, endpoint, url, kwargs)
+        except httpx.HTTPError as e:
+            breaker.record_failure()
+            logger.warning(f"⚠️ Ошибка запроса к {endpoint} (попытка {attempt + 1}): {e}")
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise
+            continue
+        except Exception:
+            # Любая другая ошибка тоже завершает пробный запрос, иначе предохранитель
+            # остался бы полуоткрытым и отклонял все следующие запросы
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release_probe()
+            raise
+
+        if response.status_code not in RETRYABLE_STATUSES:
+            breaker.record_success()
+            return response
+
+        breaker.record_failure()
+        logger.warning(f"⚠️ {endpoint} ответил {response.status_code} (попытка {attempt + 1})")
+
+    return response
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from config import SCRATCH_DIR, SCRATCH_MAX_MB
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger(__name__, log_to_file=False)
+
+JOB_PREFIX = "job-"
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class ScratchSpace:
+    """
+    Рабочее место для загрузок: каждая загрузка получает свой каталог job-<pid>-<id>,
+    который удаляется целиком после отправки. Место резервируется заранее по прогнозу
+    размера; если лимит занят, новая загрузка ждет освобождения места.
+    """
+
+    def __init__(self, base_dir=SCRATCH_DIR, max_mb=SCRATCH_MAX_MB):
+        self.base_dir = base_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self.reserved = 0
+        self.active = 0
+        self.condition = None
+
+    def _get_condition(self):
+        # Условие создается в цикле событий бота при первом использовании
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    def warm_up(self):
+        """Создает рабочий каталог и удаляет то, что осталось от завершившихся процессов бота"""
+        try:
+            os.makedirs(self.base_dir, exist_ok=True)
+            removed, freed = self.sweep()
+        except OSError as e:
+            logger.error(f"❌ Ошибка подготовки рабочего каталога {self.base_dir}: {e}")
+            return None
+        return f"{self.base_dir}, удалено забытых каталогов загрузок: {removed} ({freed / (1024 * 1024):.1f} МБ)"
+
+    def sweep(self):
+        """
+        Удаляет каталоги загрузок job-<pid>-* завершившихся процессов. Возвращает (число, байт).
+        Остальное не трогается: SCRATCH_DIR может быть общим каталогом вроде /tmp.
+        Вызывается при запуске, до первой загрузки, поэтому каталоги со своим pid тоже забытые:
+        их оставил прежний процесс бота с тем же pid (например, pid 1 в контейнере).
+        """
+        own_pid = os.getpid()
+        removed = freed = 0
+        for entry in os.scandir(self.base_dir):
+            if not entry.name.startswith(JOB_PREFIX) or not entry.is_dir(follow_symlinks=False):
+                continue
+            pid = entry.name[len(JOB_PREFIX):].split("-", 1)[0]
+            if not pid.isdigit() or (int(pid) != own_pid and _pid_alive(int(pid))):
+                continue
+            size = _dir_size(entry.path)
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+            freed += size
+
+        if removed:
+            metrics.inc("scratch_orphans_removed", removed)
+            metrics.inc("scratch_orphan_bytes_removed", freed)
+            logger.info(f"🧹 Удалено забытых каталогов загрузок: {removed} ({freed / (1024 * 1024):.1f} МБ)")
+        metrics.set_gauge("scratch_bytes", sum(
+            _dir_size(entry.path) for entry in os.scandir(self.base_dir)
+            if entry.name.startswith(JOB_PREFIX) and entry.is_dir(follow_symlinks=False)
+        ))
+        return removed, freed
+
+    async def _reserve(self, size):
+        condition = self._get_condition()
+        async with condition:
+            if self.active and self.reserved + size > self.max_bytes:
+                metrics.inc("scratch_quota_waits")
+                logger.info("⏳ Рабочий каталог заполнен, загрузка ждет освобождения места")
+                started_at = time.monotonic()
+                # Одна загрузка проходит всегда, даже если ее прогноз больше лимита
+                await condition.wait_for(lambda: not self.active or self.reserved + size <= self.max_bytes)
+                metrics.observe("scratch_quota_wait_seconds", time.monotonic() - started_at)
+            self.reserved += size
+            self.active += 1
+            self._update_gauges()
+
+    async def _release(self, size):
+        condition = self._get_condition()
+        async with condition:
+            self.reserved -= size
+            self.active -= 1
+            self._update_gauges()
+            condition.notify_all()
+
+    def _update_gauges(self):
+        metrics.set_gauge("scratch_reserved_bytes", self.reserved)
+        metrics.set_gauge("scratch_active_jobs", self.active)
+
+    @asynccontextmanager
+    async def job(self, reserve_bytes=0):
+        """Каталог для одной загрузки; reserve_bytes - ожидаемый объем файлов в нем"""
+        size = min(max(int(reserve_bytes), 0), self.max_bytes)
+        await self._reserve(size)
+        path = os.path.join(self.base_dir, f"{JOB_PREFIX}{os.getpid()}-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(path)
+            yield path
+        finally:
+            used = _dir_size(path)
+            metrics.observe("scratch_job_bytes", used)
+            if used > size:
+                metrics.inc("scratch_reservation_overruns")
+            shutil.rmtree(path, ignore_errors=True)
+            await asyncio.shield(self._release(size))
+
+scratch_space = ScratchSpace()
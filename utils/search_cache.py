@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_FUZZY_THRESHOLD
+from utils.metrics import metrics
+from utils.query_normalizer import is_typo_variant, normalize_query, trigrams, trigram_similarity
+
+# Сколько последних запросов сравнивать с новым при нечетком поиске
+FUZZY_CANDIDATES = 200
+
+class SearchCache:
+    """
+    LRU-кэш результатов поиска с ограниченным временем жизни.
+    Ключи нормализуются, а близкие по написанию запросы находятся по триграммам.
+    """
+
+    def __init__(self, max_entries=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, fuzzy_threshold=SEARCH_FUZZY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fuzzy_threshold = fuzzy_threshold
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def _key(self, platform, query, limit):
+        return (platform, normalize_query(query), limit)
+
+    def get(self, platform, query, limit):
+        key = self._key(platform, query, limit)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                metrics.inc("search_cache_hits")
+                return entry[1]
+            if entry:
+                del self.entries[key]
+
+            similar_key = self._find_similar(key)
+            if similar_key:
+                self.entries.move_to_end(similar_key)
+                metrics.inc("search_cache_fuzzy_hits")
+                return self.entries[similar_key][1]
+        metrics.inc("search_cache_misses")
+        return None
+
+    def _find_similar(self, key):
+        """
+        Ищет среди последних запросов той же платформы самый похожий на key.
+        Триграммы отбирают кандидатов, а повторно используются только результаты
+        запросов, отличающихся опечатками (не лишним или другим словом).
+        """
+        if self.fuzzy_threshold >= 1:
+            return None
+
+        platform, query, limit = key
+        query_trigrams = trigrams(query)
+        now = time.monotonic()
+        best_key, best_score = None, self.fuzzy_threshold
+
+        for i, (candidate_key, entry) in enumerate(reversed(self.entries.items())):
+            if i >= FUZZY_CANDIDATES:
+                break
+            if candidate_key[0] != platform or candidate_key[2] != limit or now - entry[0] >= self.ttl:
+                continue
+            score = trigram_similarity(query_trigrams, entry[2])
+            if score >= best_score and is_typo_variant(query, candidate_key[1]):
+                best_key, best_score = candidate_key, score
+        return best_key
+
+    def put(self, platform, query, limit, results):
+        key = self._key(platform, query, limit)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), results, trigrams(key[1]))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+search_cache = SearchCache()
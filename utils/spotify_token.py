@@ -0,0 +1,211 @@
+import base64
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: межпроцессная блокировка недоступна, обновления только внутри процесса
+    fcntl = None
+
+from config import (
+    SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_TOKEN_PATH, SPOTIFY_TOKEN_REFRESH_MARGIN
+)
+from utils.http_client import get_http_client
+from utils.logger import setup_logger
+from utils.metrics import metrics
+from utils.resilience import backoff_delay
+
+logger = setup_logger(__name__, log_to_file=False)
+
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+_manager = None
+_manager_lock = threading.Lock()
+
+class SpotifyTokenManager:
+    """
+    Токен Spotify (client credentials), общий для всех процессов бота.
+    Токен хранится в файле: рабочие процессы и перезапущенный бот берут его оттуда,
+    фоновый поток основного процесса обновляет его заранее, до истечения срока.
+    """
+
+    def __init__(self, client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET,
+                 path=SPOTIFY_TOKEN_PATH, refresh_margin=SPOTIFY_TOKEN_REFRESH_MARGIN):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.access_token = None
+        self.expires_at = 0.0
+        self.obtained_at = 0.0
+        # Токен, отклоненный Spotify: в файле он может еще числиться действующим
+        self.rejected_token = None
+        self.refresher = None
+        self.stopped = threading.Event()
+
+    def get_token(self):
+        """Возвращает действующий токен; запрашивает новый, только если его нет ни в памяти, ни в файле"""
+        if self.access_token and time.time() < self.expires_at:
+            return self.access_token
+
+        with self.lock:
+            if self.access_token and time.time() < self.expires_at:
+                return self.access_token
+            if self._load() and time.time() < self.expires_at:
+                return self.access_token
+
+            metrics.inc("spotify_token_blocking_refreshes")
+            return self._refresh_shared()
+
+    def invalidate(self, token):
+        """Сбрасывает токен, отклоненный Spotify, чтобы следующий запрос получил новый"""
+        with self.lock:
+            self.rejected_token = token
+            if self.access_token == token:
+                self.access_token = None
+                self.expires_at = 0.0
+
+    def start_refresher(self):
+        """Запускает фоновое обновление токена (достаточно одного потока на все процессы)"""
+        if self.refresher or not self.client_id or not self.client_secret:
+            return
+        self.refresher = threading.Thread(target=self._refresh_loop, name="spotify-token", daemon=True)
+        self.refresher.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _margin(self):
+        # Короткоживущий токен обновляем не раньше середины его срока
+        return min(self.refresh_margin, max(self.expires_at - self.obtained_at, 0) / 2)
+
+    def _refresh_loop(self):
+        attempt = 0
+        while not self.stopped.is_set():
+            delay = self.expires_at - self._margin() - time.time()
+            if delay > 0:
+                self.stopped.wait(delay)
+                continue
+
+            with self.lock:
+                # Другой процесс мог уже обновить файл
+                if self._load() and self.expires_at - self._margin() > time.time():
+                    token = self.access_token
+                else:
+                    token = self._refresh_shared(force=True)
+
+            if token:
+                attempt = 0
+            else:
+                self.stopped.wait(backoff_delay(attempt))
+                attempt += 1
+
+    def _refresh_shared(self, force=False):
+        """
+        Обновляет токен под файловой блокировкой: пока один процесс ждет ответа Spotify,
+        остальные ждут блокировку и затем читают его результат из файла.
+        """
+        lock_file = None
+        try:
+            if fcntl:
+                self._ensure_dir()
+                lock_file = open(f"{self.path}.lock", "a")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                min_valid_until = time.time() + (self._margin() if force else 0)
+                if self._load() and self.expires_at > min_valid_until:
+                    return self.access_token
+            return self._refresh()
+        except OSError as e:
+            logger.error(f"❌ Ошибка блокировки файла токена Spotify: {e}")
+            return self._refresh()
+        finally:
+            if lock_file:
+                lock_file.close()
+
+    def _refresh(self):
+        if not self.client_id or not self.client_secret:
+            logger.error("Spotify credentials not configured")
+            return None
+
+        auth = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode("utf-8")).decode("utf-8")
+        started_at = time.monotonic()
+        try:
+            response = get_http_client().post(
+                SPOTIFY_TOKEN_URL,
+                headers={
+                    "Authorization": f"Basic {auth}",
+                    "Content-Type": "application/x-www-form-urlencoded"
+                },
+                data={"grant_type": "client_credentials"}
+            )
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            metrics.inc("spotify_token_refresh_failures")
+            logger.error(f"Error getting Spotify access token: {e}")
+            return None
+
+        metrics.inc("spotify_token_refreshes")
+        metrics.observe("spotify_token_refresh_seconds", time.monotonic() - started_at)
+        self.access_token = result["access_token"]
+        self.obtained_at = time.time()
+        # 60 секунд запаса на задержку сети и расхождение часов
+        self.expires_at = time.time() + result["expires_in"] - 60
+        self._save()
+        logger.info("Successfully obtained Spotify access token")
+        return self.access_token
+
+    def _ensure_dir(self):
+        token_dir = os.path.dirname(self.path)
+        if token_dir:
+            os.makedirs(token_dir, exist_ok=True)
+
+    def _load(self):
+        """Читает токен из файла, если он новее того, что в памяти"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Не удалось прочитать файл токена Spotify: {e}")
+            return False
+
+        # Токен другого приложения Spotify не подходит
+        if data.get("client_id") != self.client_id:
+            return False
+        if data.get("access_token") == self.rejected_token:
+            return bool(self.access_token)
+        if data.get("expires_at", 0) > self.expires_at:
+            self.access_token = data.get("access_token")
+            self.expires_at = data["expires_at"]
+            self.obtained_at = data.get("obtained_at", 0)
+        return bool(self.access_token)
+
+    def _save(self):
+        try:
+            self._ensure_dir()
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({
+                    "client_id": self.client_id,
+                    "access_token": self.access_token,
+                    "obtained_at": self.obtained_at,
+                    "expires_at": self.expires_at
+                }, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось сохранить токен Spotify: {e}")
+
+def get_token_manager():
+    """Общий менеджер токена Spotify (один на процесс)"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SpotifyTokenManager()
+        return _manager
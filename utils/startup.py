@@ -0,0 +1,57 @@
+import asyncio
+import inspect
+import time
+
+from config import WARMUP_TIMEOUT
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger(__name__, log_to_file=False)
+
+async def _run_step(name, step, timeout):
+    started_at = time.monotonic()
+    try:
+        if inspect.iscoroutinefunction(step):
+            result = await asyncio.wait_for(step(), timeout)
+        else:
+            result = await asyncio.wait_for(asyncio.to_thread(step), timeout)
+        ok = result is not None and result is not False
+    except asyncio.TimeoutError:
+        result, ok = f"не завершился за {timeout:.0f} с", False
+    except Exception as e:
+        result, ok = e, False
+
+    elapsed = time.monotonic() - started_at
+    metrics.observe(f"warmup_{name}_seconds", elapsed)
+    metrics.set_gauge(f"warmup_{name}_ok", int(ok))
+    return name, ok, result, elapsed
+
+async def warm_up(steps, timeout=WARMUP_TIMEOUT):
+    """
+    Выполняет шаги прогрева параллельно. Шаг - функция без аргументов (обычная
+    выполняется в потоке); None, False или ошибка считаются неудачей, но не мешают запуску.
+    Возвращает словарь {имя шага: успех}.
+    """
+    results = await asyncio.gather(*[
+        _run_step(name, step, timeout) for name, step in steps.items()
+    ])
+
+    for name, ok, result, elapsed in results:
+        details = "" if result is None or isinstance(result, bool) else f": {result}"
+        if ok:
+            logger.info(f"✅ {name} готов за {elapsed:.2f} с{details}")
+        else:
+            logger.warning(f"⚠️ {name} не подготовлен{details}")
+    return {name: ok for name, ok, _, _ in results}
+
+def report_ready(boot_started_at, results):
+    """Сообщает о готовности бота и времени запуска"""
+    boot_seconds = time.monotonic() - boot_started_at
+    metrics.set_gauge("boot_seconds", boot_seconds)
+    metrics.set_gauge("ready", 1)
+
+    failed = [name for name, ok in results.items() if not ok]
+    if failed:
+        logger.warning(f"⚠️ Бот запущен за {boot_seconds:.2f} с, не подготовлено: {', '.join(failed)}")
+    else:
+        logger.info(f"🚀 Бот готов к работе за {boot_seconds:.2f} с")
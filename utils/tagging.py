@@ -0,0 +1,95 @@
+import io
+
+from config import TITLE_BRANDING
+from utils.http_client import get_http_client
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__, log_to_file=False)
+
+# mutagen импортируется при первой записи тегов, а не при запуске бота
+TEXT_FRAMES = {
+    "title": "TIT2",
+    "artist": "TPE1",
+    "album": "TALB",
+    "genre": "TCON",
+    "track_number": "TRCK",
+    "year": "TYER",
+}
+
+BRANDING_SEPARATOR = " | "
+
+def branded_title(title):
+    """Название трека с подписью бота"""
+    if not TITLE_BRANDING:
+        return title
+    return f"{title}{BRANDING_SEPARATOR}{TITLE_BRANDING}" if title else TITLE_BRANDING
+
+def rebrand_tag_blob(blob):
+    """
+    Меняет подпись бота в названии внутри сериализованного ID3-тега.
+    Теги без подписи возвращаются без изменений.
+    """
+    from mutagen.id3 import ID3, TIT2
+
+    tags = ID3(io.BytesIO(blob))
+    frame = tags.get("TIT2")
+    if not frame or not frame.text:
+        return blob
+
+    old_title = str(frame.text[0])
+    title, separator, suffix = old_title.rpartition(BRANDING_SEPARATOR)
+    if not separator:
+        if not old_title.startswith("@"):
+            return blob
+        title, suffix = "", old_title
+    if not suffix.startswith("@") or suffix == TITLE_BRANDING:
+        return blob
+
+    tags.setall("TIT2", [TIT2(encoding=3, text=branded_title(title))])
+    buffer = io.BytesIO()
+    tags.save(buffer, v1=0, v2_version=3)
+    return buffer.getvalue()
+
+def fetch_artwork(artwork_url, session=None):
+    """Скачивает обложку в память, возвращает (данные, mime) или None"""
+    if not artwork_url:
+        return None
+    try:
+        response = (session or get_http_client()).get(artwork_url)
+        response.raise_for_status()
+        mime = response.headers.get("Content-Type", "image/jpeg").split(";")[0]
+        return response.content, mime
+    except Exception as e:
+        logger.error(f"❌ Ошибка загрузки обложки: {e}")
+        return None
+
+def write_tags(filename, metadata, session=None):
+    """
+    Записывает полный ID3-тег вместе с обложкой за один проход.
+    Тег собирается в памяти и заменяет существующий на месте, аудиоданные не перекодируются.
+
+    metadata: title, artist, album, genre, year, track_number, comment, artwork_url
+    """
+    try:
+        from mutagen import id3
+
+        tags = id3.ID3()
+        for key, frame_name in TEXT_FRAMES.items():
+            value = metadata.get(key)
+            if value not in (None, ""):
+                tags.add(getattr(id3, frame_name)(encoding=3, text=str(value)))
+
+        if metadata.get("comment"):
+            tags.add(id3.COMM(encoding=3, lang="eng", desc="", text=str(metadata["comment"])))
+
+        artwork = fetch_artwork(metadata.get("artwork_url"), session)
+        if artwork:
+            data, mime = artwork
+            tags.add(id3.APIC(encoding=3, mime=mime, type=3, desc="Cover", data=data))
+
+        tags.save(filename, v1=0, v2_version=3)
+        logger.info(f"🔖 Метаданные записаны: {metadata.get('artist', '')} - {metadata.get('title', '')}")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи метаданных: {e}")
+        return False
@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText
+
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger(__name__, log_to_file=False)
+
+# Сколько раз повторять запрос после ответа 429 (retry_after)
+MAX_RETRIES = 3
+# Максимальное количество хранимых корзин для отдельных чатов
+MAX_CHAT_BUCKETS = 10000
+
+class TokenBucket:
+    """Корзина токенов с резервированием: каждый запрос сразу получает свое время отправки"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self):
+        """Забирает токен и возвращает время ожидания в секундах"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self, now):
+        return now - self.updated > 60 and now >= self.blocked_until
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Промежуточный слой для всех исходящих запросов к Bot API:
+    общие и поканальные лимиты, склейка промежуточных правок одного сообщения
+    и автоматическое ожидание retry_after при ответе 429.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE, chat_burst=TELEGRAM_CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.pending_edits = {}
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+
+        if isinstance(method, EditMessageText) and chat_id and method.message_id:
+            return await self._send_coalesced(make_request, bot, method, chat_id)
+
+        if chat_id:
+            await self._wait_for_slot(chat_id)
+        return await self._send_with_retry(make_request, bot, method, chat_id)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                self.chat_buckets = {
+                    key: value for key, value in self.chat_buckets.items() if not value.is_idle(now)
+                }
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait_for_slot(self, chat_id):
+        wait = max(self.global_bucket.reserve(), self._chat_bucket(chat_id).reserve())
+        if wait > 0:
+            metrics.observe("telegram_throttle_seconds", wait)
+            await asyncio.sleep(wait)
+
+    async def _send_coalesced(self, make_request, bot, method, chat_id):
+        key = (chat_id, method.message_id)
+
+        pending = self.pending_edits.get(key)
+        if pending:
+            # Правка еще ждет своей очереди - отправим только последнюю версию текста
+            pending["method"] = method
+            metrics.inc("telegram_edits_coalesced")
+            return await asyncio.shield(pending["future"])
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        entry = {"method": method, "future": future}
+        self.pending_edits[key] = entry
+
+        try:
+            await self._wait_for_slot(chat_id)
+            # После получения слота новые правки пойдут отдельным запросом
+            self.pending_edits.pop(key, None)
+            result = await self._send_with_retry(make_request, bot, entry["method"], chat_id)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if self.pending_edits.get(key) is entry:
+                self.pending_edits.pop(key, None)
+            if not future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            raise
+
+    async def _send_with_retry(self, make_request, bot, method, chat_id):
+        attempt = 0
+        while True:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                metrics.inc("telegram_retry_after")
+                if attempt > MAX_RETRIES:
+                    raise
+
+                logger.warning(f"⚠️ Flood control для {type(method).__name__}, ждем {e.retry_after} с (попытка {attempt})")
+                if chat_id:
+                    self._chat_bucket(chat_id).block(e.retry_after)
+                    await self._wait_for_slot(chat_id)
+                else:
+                    self.global_bucket.block(e.retry_after)
+                    await asyncio.sleep(e.retry_after)
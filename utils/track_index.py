@@ -0,0 +1,148 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from config import CACHE_DB_PATH
+from utils.file_id_cache import file_id_cache
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger(__name__, log_to_file=False)
+
+WORD_RE = re.compile(r"\w+")
+
+class TrackIndex:
+    """Локальный полнотекстовый индекс (SQLite FTS5) по трекам, которые бот уже видел"""
+
+    def __init__(self, db_path=CACHE_DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.enabled = True
+
+    def _connect(self):
+        if self.conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "id INTEGER PRIMARY KEY, "
+                "platform TEXT NOT NULL, "
+                "track_id TEXT NOT NULL, "
+                "data TEXT NOT NULL, "
+                "seen_at REAL, "
+                "UNIQUE (platform, track_id))"
+            )
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5("
+                "title, artist, genre, track_id, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def warm_up(self):
+        """Открывает индекс заранее, возвращает число треков в нем"""
+        if not self.enabled:
+            return None
+        try:
+            with self.lock:
+                return self._connect().execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+        except sqlite3.Error as e:
+            self._handle_error("открытия индекса треков", e)
+            return None
+
+    def add(self, tracks):
+        """Добавляет или обновляет треки в индексе"""
+        if not self.enabled:
+            return
+        rows = []
+        for track in tracks:
+            if not track.get("id") or not track.get("platform"):
+                continue
+            # Полные данные API не нужны для поиска и сильно увеличивают базу
+            data = {key: value for key, value in track.items() if key != "raw_track"}
+            rows.append((track["platform"], str(track["id"]), data))
+        if not rows:
+            return
+
+        try:
+            with self.lock:
+                conn = self._connect()
+                now = time.time()
+                for platform, track_id, data in rows:
+                    conn.execute(
+                        "INSERT INTO tracks (platform, track_id, data, seen_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (platform, track_id) DO UPDATE SET data = excluded.data, seen_at = excluded.seen_at",
+                        (platform, track_id, json.dumps(data, ensure_ascii=False), now)
+                    )
+                    row_id = conn.execute(
+                        "SELECT id FROM tracks WHERE platform = ? AND track_id = ?",
+                        (platform, track_id)
+                    ).fetchone()[0]
+                    conn.execute("DELETE FROM tracks_fts WHERE rowid = ?", (row_id,))
+                    conn.execute(
+                        "INSERT INTO tracks_fts (rowid, title, artist, genre, track_id) VALUES (?, ?, ?, ?, ?)",
+                        (row_id, data.get("title", ""), self._artist(data), data.get("genre", ""), track_id)
+                    )
+                conn.commit()
+        except sqlite3.Error as e:
+            self._handle_error("записи в индекс треков", e)
+
+    def search(self, query, platforms=None, limit=10):
+        """
+        Ищет треки в индексе.
+        Треки, уже отправленные в Telegram (есть file_id), идут первыми.
+        """
+        if not self.enabled:
+            return []
+        words = WORD_RE.findall(query.casefold())
+        if not words:
+            return []
+
+        # Каждое слово ищем как префикс, слова объединяются через AND
+        match = " ".join(f'"{word}"*' for word in words)
+        sql = (
+            "SELECT t.data FROM tracks_fts "
+            "JOIN tracks t ON t.id = tracks_fts.rowid "
+            "WHERE tracks_fts MATCH ?"
+        )
+        params = [match]
+        if platforms:
+            sql += f" AND t.platform IN ({', '.join('?' for _ in platforms)})"
+            params.extend(platforms)
+        sql += " ORDER BY bm25(tracks_fts) LIMIT ?"
+        params.append(limit * 2)
+
+        try:
+            with self.lock:
+                rows = self._connect().execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            self._handle_error("поиска по индексу треков", e)
+            return []
+
+        tracks = [json.loads(row[0]) for row in rows]
+        tracks.sort(key=lambda track: file_id_cache.get(track["platform"], track.get("id")) is None)
+        metrics.inc("track_index_hits" if tracks else "track_index_misses")
+        return tracks[:limit]
+
+    def _artist(self, track):
+        user = track.get("user", "")
+        if isinstance(user, dict):
+            return user.get("username", "")
+        return str(user)
+
+    def _handle_error(self, action, e):
+        logger.error(f"❌ Ошибка {action}: {e}")
+        if "fts5" in str(e):
+            # SQLite собран без FTS5 - работаем без локального индекса
+            logger.warning("⚠️ SQLite не поддерживает FTS5, локальный индекс треков отключен")
+            self.enabled = False
+
+track_index = TrackIndex()
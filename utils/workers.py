@@ -0,0 +1,355 @@
+import asyncio
+import importlib
+import multiprocessing
+import os
+import time
+import uuid
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import DOWNLOAD_WORKERS, WARMUP_TIMEOUT
+from utils.capabilities import get_capabilities, set_capabilities
+from utils.fingerprint import compute_fingerprint
+from utils.logger import setup_logger
+from utils.metrics import metrics
+from utils.progress import JobCancelled, JobControl
+
+logger = setup_logger(__name__, log_to_file=False)
+
+# Как часто рабочий процесс проверяет, не отменена ли его задача (в секундах)
+CANCEL_POLL_INTERVAL = 0.5
+
+# Клиенты создаются лениво отдельно в каждом рабочем процессе
+_clients = {}
+# Очередь, по которой рабочий процесс передает свои метрики основному
+_metrics_queue = None
+
+def _get_client(name):
+    if name not in _clients:
+        if name == "soundcloud":
+            from api.soundcloud_api import SoundCloudClient
+            _clients[name] = SoundCloudClient()
+        elif name == "spotify":
+            from api.spotify_api import SpotifyClient
+            _clients[name] = SpotifyClient()
+        elif name == "youtube":
+            from api.youtube_api import YouTubeClient
+            _clients[name] = YouTubeClient()
+    return _clients[name]
+
+def _build_spotify_metadata(track_data, artist, title):
+    # Получаем данные из Spotify API для альбома
+    album_name = ""
+    artwork_url = ""
+    release_year = ""
+
+    # Обработка метаданных альбома
+    album_data = track_data.get('album', {})
+    if isinstance(album_data, dict):
+        album_name = album_data.get('name', '')
+
+        # Получаем обложку альбома
+        images = album_data.get('images', [])
+        if images and len(images) > 0 and isinstance(images[0], dict):
+            artwork_url = images[0].get('url', '')
+
+        # Получаем год выпуска
+        release_date = album_data.get('release_date', '')
+        if release_date and isinstance(release_date, str):
+            # Берем только год из даты (первые 4 символа)
+            release_year = release_date[:4] if len(release_date) >= 4 else ''
+
+    # Жанры есть только у полного объекта альбома, загруженного пакетно
+    album_details = track_data.get('album_details') or {}
+    genres = album_details.get('genres') or []
+
+    return {
+        'title': title,
+        'artist': artist,
+        'album': album_name,
+        'artwork_url': artwork_url,
+        'release_year': release_year,
+        'track_number': track_data.get('track_number', ''),
+        'genre': genres[0] if genres else ''  # У трека жанра нет, берем жанр альбома
+    }
+
+def _init_worker(capabilities, metrics_queue):
+    """Рабочий процесс получает возможности FFmpeg/yt-dlp от основного, не проверяя их заново"""
+    global _metrics_queue
+    set_capabilities(capabilities)
+    _metrics_queue = metrics_queue
+
+def _flush_metrics():
+    """Отправляет метрики, накопленные в рабочем процессе, в основной процесс"""
+    if _metrics_queue is None:
+        return
+    try:
+        _metrics_queue.put({"metrics": metrics.drain()})
+    except Exception as e:
+        logger.debug(f"Не удалось отправить метрики: {e}")
+
+def _warm_up_worker(barrier):
+    """Создает клиенты и загружает модули тегов в рабочем процессе до первой задачи"""
+    for name in ("soundcloud", "spotify", "youtube"):
+        _get_client(name)
+    # Модули тегов загружаются заранее, сами имена здесь не нужны
+    for module in ("mutagen.id3", "mutagen.mp3"):
+        importlib.import_module(module)
+
+    # Барьер не дает одному процессу забрать задачи прогрева остальных
+    try:
+        barrier.wait(WARMUP_TIMEOUT)
+    except Exception:
+        pass
+    _flush_metrics()
+    return os.getpid()
+
+def _make_progress_callback(job):
+    progress_queue = job.get("progress_queue")
+    if progress_queue is None:
+        return None
+
+    def report(event):
+        event = dict(event, job_id=job["job_id"])
+        try:
+            progress_queue.put(event)
+        except Exception as e:
+            logger.debug(f"Не удалось отправить прогресс: {e}")
+
+    return report
+
+def _is_cancelled(job):
+    cancelled_jobs = job.get("cancelled_jobs")
+    if cancelled_jobs is None:
+        return False
+    try:
+        return job["job_id"] in cancelled_jobs
+    except (EOFError, OSError):
+        return False
+
+def _watch_cancellation(job, control, finished):
+    """Следит за отменой задачи и останавливает ее дочерние процессы, не дожидаясь события прогресса"""
+    def watch():
+        while not finished.wait(CANCEL_POLL_INTERVAL):
+            if _is_cancelled(job):
+                control.cancel()
+                return
+
+    threading.Thread(target=watch, daemon=True).start()
+
+def run_download_job(job):
+    """Скачивает и кодирует трек, возвращает путь к готовому файлу"""
+    platform = job["platform"]
+    download_url = job["download_url"]
+    track_data = job.get("track_data") or {}
+    output_file = job["output_file"]
+    encode_profile = job.get("encode_profile")
+    audio_quality = encode_profile["ytdlp_quality"] if encode_profile else "0"
+    # Клиенты платформ получают JobControl как обычный обработчик прогресса
+    progress_callback = JobControl(_make_progress_callback(job))
+    finished = threading.Event()
+
+    if _is_cancelled(job):
+        return {"success": False, "path": None, "error": "cancelled"}
+    _watch_cancellation(job, progress_callback, finished)
+
+    try:
+        download_success = False
+
+        if platform == "soundcloud":
+            download_success = bool(_get_client("soundcloud").download_track(download_url, track_data, output_file, encode_profile, progress_callback))
+        elif platform == "spotify" and job.get("youtube_used"):
+            youtube_client = _get_client("youtube")
+            artist = job.get("artist", "")
+            title = job.get("title", "")
+            try:
+                # Подготовка расширенных метаданных из Spotify
+                metadata = _build_spotify_metadata(track_data, artist, title)
+
+                logger.info(f"Подготовлены метаданные: Название={metadata['title']}, Исполнитель={metadata['artist']}, Альбом={metadata['album']}")
+            except Exception as e:
+                logger.error(f"Ошибка при подготовке метаданных: {e}")
+                # Загрузка с минимальными метаданными
+                metadata = {
+                    'title': title,
+                    'artist': artist
+                }
+
+            # yt-dlp сразу кодирует в MP3 с качеством из профиля, повторное кодирование не нужно
+            download_success = youtube_client.download_from_youtube(download_url, output_file, metadata, audio_quality, progress_callback)
+        elif platform == "spotify":
+            download_success = _get_client("spotify").download_track(download_url, track_data, output_file)
+
+        if not download_success or not os.path.exists(output_file):
+            return {"success": False, "path": None, "error": "download_failed"}
+
+        progress_callback.check()
+        # Отпечаток считается здесь же, чтобы не занимать основной процесс
+        fingerprint = compute_fingerprint(output_file)
+        return {"success": True, "path": output_file, "error": None, "fingerprint": fingerprint}
+
+    except JobCancelled:
+        logger.info("🚫 Задача загрузки отменена")
+        return {"success": False, "path": None, "error": "cancelled"}
+    except Exception as e:
+        logger.error(f"❌ Ошибка в задаче загрузки: {e}")
+        return {"success": False, "path": None, "error": str(e)}
+    finally:
+        finished.set()
+        _flush_metrics()
+
+class DownloadWorkerPool:
+    """Пул процессов для скачивания и кодирования треков вне цикла обработки обновлений"""
+
+    def __init__(self, workers=DOWNLOAD_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.manager = None
+        self.progress_queue = None
+        self.progress_thread = None
+        self.cancelled_jobs = None
+        self.listeners = {}
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        with self.start_lock:
+            if not self.executor:
+                self._start()
+
+    def _start(self):
+        if self.workers > 0:
+            context = multiprocessing.get_context("spawn")
+            # Очередь прогресса должна быть доступна из рабочих процессов;
+            # по ней же приходят их метрики
+            self.manager = context.Manager()
+            self.progress_queue = self.manager.Queue()
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context,
+                initializer=_init_worker, initargs=(get_capabilities(), self.progress_queue)
+            )
+            # Отмененные задачи: рабочие процессы опрашивают этот словарь
+            self.cancelled_jobs = self.manager.dict()
+            logger.info(f"🚀 Запущено процессов загрузки: {self.workers}")
+        else:
+            # Режим без отдельных процессов: работа выполняется в потоках бота
+            self.executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+            self.progress_queue = queue.Queue()
+            self.cancelled_jobs = {}
+            logger.info("🚀 Загрузка выполняется в потоках основного процесса")
+
+        self.progress_thread = threading.Thread(target=self._dispatch_progress, daemon=True)
+        self.progress_thread.start()
+
+    async def warm_up(self):
+        """Запускает все рабочие процессы заранее: пул создает их лениво, при первых задачах"""
+        # Проверка возможностей и запуск менеджера блокируют, поэтому идут в потоке,
+        # параллельно с остальными шагами прогрева
+        await asyncio.to_thread(self.start)
+        if self.workers <= 0:
+            return 0
+        loop = asyncio.get_running_loop()
+        barrier = self.manager.Barrier(self.workers)
+        pids = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, _warm_up_worker, barrier)
+            for _ in range(self.workers)
+        ])
+        return f"процессов: {len(set(pids))}"
+
+    def _dispatch_progress(self):
+        progress_queue = self.progress_queue
+        while True:
+            try:
+                event = progress_queue.get()
+            except (EOFError, OSError):
+                break
+            if event is None:
+                break
+            if "metrics" in event:
+                metrics.merge(event["metrics"])
+                continue
+
+            self._record_progress_metrics(event)
+
+            listener = self.listeners.get(event.get("job_id"))
+            if listener:
+                loop, callback = listener
+                loop.call_soon_threadsafe(callback, event)
+
+    def _record_progress_metrics(self, event):
+        speed = event.get("speed")
+        if not speed:
+            return
+        if event.get("stage") == "download":
+            metrics.observe("download_speed_bps", speed)
+        elif event.get("stage") == "encode":
+            metrics.observe("encode_speed_x", speed)
+
+    async def submit(self, job, progress_callback=None):
+        self.start()
+        loop = asyncio.get_running_loop()
+
+        job = dict(job, job_id=uuid.uuid4().hex, cancelled_jobs=self.cancelled_jobs)
+        if progress_callback:
+            job["progress_queue"] = self.progress_queue
+            self.listeners[job["job_id"]] = (loop, progress_callback)
+
+        started_at = time.monotonic()
+        metrics.inc("download_jobs_total")
+        future = None
+        try:
+            future = self.executor.submit(run_download_job, job)
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            self._cancel(job["job_id"], future, started_at)
+            raise
+        except BrokenProcessPool as e:
+            logger.error(f"❌ Рабочий процесс аварийно завершился, перезапускаем пул: {e}")
+            self.shutdown()
+            result = {"success": False, "path": None, "error": "worker_crashed"}
+        finally:
+            self.listeners.pop(job["job_id"], None)
+
+        metrics.observe("download_job_seconds", time.monotonic() - started_at)
+        if not result.get("success"):
+            metrics.inc("download_jobs_failed")
+        return result
+
+    def _cancel(self, job_id, future, started_at):
+        """Отменяет задачу: еще не начатую снимает с очереди, выполняющуюся останавливает в рабочем процессе"""
+        metrics.inc("download_jobs_cancelled")
+        metrics.observe("download_cancelled_after_seconds", time.monotonic() - started_at)
+        if future is None or future.cancel() or future.done():
+            return
+
+        try:
+            self.cancelled_jobs[job_id] = True
+        except (EOFError, OSError, TypeError):
+            return
+        future.add_done_callback(lambda _: self._forget_cancelled(job_id))
+
+    def _forget_cancelled(self, job_id):
+        try:
+            self.cancelled_jobs.pop(job_id, None)
+        except (EOFError, OSError, AttributeError):
+            pass
+
+    def shutdown(self):
+        if not self.executor:
+            return
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+        try:
+            self.progress_queue.put(None)
+        except Exception:
+            pass
+        if self.manager:
+            self.manager.shutdown()
+            self.manager = None
+        self.progress_queue = None
+        self.cancelled_jobs = None
+        logger.info("🛑 Пул процессов загрузки остановлен")
+
+download_pool = DownloadWorkerPool()